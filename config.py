@@ -1,9 +1,5 @@
-from option_hedging.OnPolicyTests.a2c import a2c_trial
-from option_hedging.OnPolicyTests.ppo import ppo_trial
-from option_hedging.OffPolicyTests.dqn import dqn_trial
-from option_hedging.OffPolicyTests.ddpg import ddpg_trial
-from option_hedging.OffPolicyTests.sac import sac_trial
-from option_hedging.OffPolicyTests.td3 import td3_trial
+import importlib
+from typing import Callable
 
 training_kwargs = {
         'trainer_kwargs': {
@@ -18,7 +14,10 @@ training_kwargs = {
                 'show_progress': True
         },
         'buffer_size': 500_000,
-        'subproc': True
+        'backend': 'subproc',  # 'dummy', 'subproc', 'batched', 'shmem', or 'auto' to calibrate on this host
+        'profiling': None,  # {} for per-phase timings in TensorBoard, {'dump_epoch': 2} to also dump epoch 2's profile
+        # {} to stop testing once the result is clear, with episode_per_test as the cap; see SequentialTestCollector
+        'sequential_test': None
 }
 
 lr_kwargs = {
@@ -29,13 +28,20 @@ lr_kwargs = {
         'lr': 0.0025
 }
 
+# off-policy trials: store each episode's observations once, and only the reward components of the infos
+# (see option_hedging.replay_buffer.CompactVectorReplayBuffer)
+off_policy_kwargs = {
+        'compact_buffer': True
+}
+
 env_kwargs = {
         'epsilon': 0.01,
         'sigma': 0.15,
         'rho': 0.02,
         'action_bins': 20,
         'T': 1,
-        'rebalance_frequency': 12
+        'rebalance_frequency': 12,
+        'simulator': None  # price dynamics from utils.market, e.g. Heston(0.0225, 2., 0.0225, 0.3, -0.7); None for GBM
 }
 
 net_kwargs = {
@@ -68,6 +74,7 @@ sac_kwargs = {
         },
         'net_kwargs': net_kwargs,
         'env_kwargs': env_kwargs,
+        **off_policy_kwargs,
         **training_kwargs,
         **lr_kwargs
 }
@@ -79,6 +86,7 @@ ddpg_kwargs = {
         },
         'net_kwargs': net_kwargs,
         'env_kwargs': env_kwargs,
+        **off_policy_kwargs,
         **training_kwargs,
         **lr_kwargs
 }
@@ -112,6 +120,7 @@ dqn_kwargs = {
                            'max_steps': 500_000},
         'net_kwargs': net_kwargs,
         'env_kwargs': env_kwargs,
+        **off_policy_kwargs,
         **training_kwargs,
         **lr_kwargs
 }
@@ -119,15 +128,24 @@ dqn_kwargs = {
 
 options = {
         'ppo': {'kwargs': ppo_kwargs,
-                'trainer': ppo_trial},
+                'trainer': 'option_hedging.OnPolicyTests.ppo:ppo_trial'},
         'a2c': {'kwargs': a2c_kwargs,
-                'trainer': a2c_trial},
+                'trainer': 'option_hedging.OnPolicyTests.a2c:a2c_trial'},
         'sac': {'kwargs': sac_kwargs,
-                'trainer': sac_trial},
+                'trainer': 'option_hedging.OffPolicyTests.sac:sac_trial'},
         'ddpg': {'kwargs': ddpg_kwargs,
-                 'trainer': ddpg_trial},
+                 'trainer': 'option_hedging.OffPolicyTests.ddpg:ddpg_trial'},
         'td3': {'kwargs': td3_kwargs,
-                'trainer': td3_trial},
+                'trainer': 'option_hedging.OffPolicyTests.td3:td3_trial'},
         'dqn': {'kwargs': dqn_kwargs,
-                'trainer': dqn_trial}
+                'trainer': 'option_hedging.OffPolicyTests.dqn:dqn_trial'}
 }
+
+
+def load_trainer(name: str) -> Callable:
+    """
+    Trial function of the selected model. Trainers are registered as 'module:function' strings so that only the
+    selected module (and torch/tianshou with it) is imported.
+    """
+    module_name, function_name = options[name]['trainer'].split(':')
+    return getattr(importlib.import_module(module_name), function_name)
@@ -1,5 +1,4 @@
-from option_hedging.gym_envs import make_env
-from config import options
+from config import options, load_trainer
 
 
 def main() -> None:
@@ -10,6 +9,7 @@ def main() -> None:
     benchmark = input(f'Benchmark against Black-Scholes? y/n\n')
     assert benchmark.lower() in ('y', 'n')
     if benchmark.lower() == 'y':
+        from option_hedging.gym_envs import make_env
         from option_hedging.benchmarks import black_scholes_benchmark
         env = make_env(seed=123, **kwargs['env_kwargs'])()
         mean, std = black_scholes_benchmark(env, n_trials=1000)
@@ -17,12 +17,24 @@ def main() -> None:
     random_benchmark = input(f'Benchmark against random agent? y/n\n')
     assert random_benchmark.lower() in ('y', 'n')
     if random_benchmark.lower() == 'y':
+        from option_hedging.gym_envs import make_env
         from option_hedging.benchmarks import random_agent_benchmark
         env = make_env(seed=123, **kwargs['env_kwargs'])()
         mean, std = random_agent_benchmark(env, n_trials=1000)
         print(f'Random agent benchmark: {mean} +/- {std}\n')
-    trainer = selection['trainer'](**kwargs)
+    trainer = load_trainer(model.lower())(**kwargs)
     trainer.run()
+    comparison = input(f'Compare the agent with Black-Scholes and the random agent on common paths? y/n\n')
+    assert comparison.lower() in ('y', 'n')
+    if comparison.lower() == 'y':
+        from option_hedging.benchmarks import BlackScholesStrategy, RandomStrategy
+        from option_hedging.comparison import compare_strategies, print_comparisons
+        env_kwargs = kwargs['env_kwargs']
+        print_comparisons(compare_strategies({
+            'black_scholes': BlackScholesStrategy(),
+            'agent': trainer.policy,
+            'random': RandomStrategy(env_kwargs['epsilon'], env_kwargs['action_bins'])
+        }, env_kwargs, seed=123))
 
 
 if __name__ == '__main__':
@@ -1,36 +1,18 @@
 import gymnasium as gym
-from tianshou.data import Collector, VectorReplayBuffer
-from tianshou.env import SubprocVectorEnv, DummyVectorEnv
+from tianshou.data import Collector
 from tianshou.trainer import OffpolicyTrainer
 from utils.torch_modules import PreprocessNet
-from tianshou.utils import TensorboardLogger
 from tianshou.utils.lr_scheduler import MultipleLRSchedulers
-from torch.utils.tensorboard import SummaryWriter
 import torch
-import random
-import numpy as np
-import os
-import shutil
-from pathlib import Path
-from option_hedging.gym_envs import make_env
+from option_hedging.parallelism import make_trial_envs, restore_after_run
+from option_hedging.evaluation import make_test_collector
+from option_hedging.replay_buffer import make_replay_buffer
+from utils.experiment import make_logger, seed_everything
+from utils.checkpoint import Checkpointer, checkpoint_dir
+from utils.profiling import attach_profiler
+from utils.prefill_cache import cached_prefill, default_cache_dir
 from typing import Dict, Tuple, Any
 
-log_dir = os.path.join(Path(os.path.abspath(__file__)).parent.parent.parent.absolute(), '.logs')
-if os.path.exists(log_dir):
-    shutil.rmtree(log_dir)
-os.makedirs(log_dir, exist_ok=True)
-logger = TensorboardLogger(SummaryWriter(log_dir=log_dir), train_interval=256)
-
-seed_value = 123
-random.seed(seed_value)
-np.random.seed(seed_value)
-torch.manual_seed(seed_value)
-torch.cuda.manual_seed(seed_value)
-torch.cuda.manual_seed_all(seed_value)
-torch.backends.cudnn.deterministic = True
-torch.backends.cudnn.benchmark = False
-
-
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 
@@ -41,16 +23,28 @@ def sac_trial(trainer_kwargs: Dict[str, int],
               lr_scheduler_kwargs: Dict[str, Any],
               buffer_size: int,
               lr: float,
-              subproc: bool = False
+              subproc: bool = False,
+              backend: str | None = None,
+              train_env_num: int = 20,
+              test_env_num: int = 10,
+              test_env_kwargs: Dict[str, Any] | None = None,
+              batched_test: bool = True,
+              log_dir: str | None = None,
+              seed: int = 123,
+              resume: bool = False,
+              profiling: Dict[str, Any] | None = None,
+              sequential_test: Dict[str, Any] | None = None,
+              compact_buffer: bool = False,
+              prefill_cache_dir: str | None = default_cache_dir
               ):
-
+    seed_everything(seed)
+    logger = make_logger(log_dir, clear=not resume)
     env = gym.make('OptionHedgingEnv', epsilon=0, action_bins=env_kwargs['action_bins'])
-    if subproc:
-        train_envs = SubprocVectorEnv([make_env(seed=k, **env_kwargs) for k in range(20)])
-        test_envs = SubprocVectorEnv([make_env(seed=k * 50, **env_kwargs) for k in range(10)])
-    else:
-        train_envs = DummyVectorEnv([make_env(seed=k, **env_kwargs) for k in range(20)])
-        test_envs = DummyVectorEnv([make_env(seed=k * 50, **env_kwargs) for k in range(10)])
+    if backend is None:
+        backend = 'subproc' if subproc else 'dummy'
+    train_envs, test_envs, restore_fn = make_trial_envs(env_kwargs, test_env_kwargs, backend, train_env_num,
+                                                        0 if batched_test else test_env_num,
+                                                        net_kwargs=net_kwargs, logger=logger)
     if env_kwargs['action_bins'] == 0:
         from tianshou.utils.net.continuous import ActorProb, Critic
         actor_net = PreprocessNet(state_shape=env.observation_space.shape, device=device, **net_kwargs)
@@ -112,13 +106,26 @@ def sac_trial(trainer_kwargs: Dict[str, int],
             lr_scheduler=lr_scheduler,
             **policy_kwargs
         )
-    train_collector = Collector(policy, train_envs, VectorReplayBuffer(buffer_size, len(train_envs)))
-    train_collector.collect(buffer_size, random=True)
-    test_collector = Collector(policy, test_envs)
-    return OffpolicyTrainer(
+    buffer = make_replay_buffer(buffer_size, len(train_envs), env_kwargs, compact=compact_buffer)
+    train_collector = Collector(policy, train_envs, buffer)
+    if not resume:
+        # a resumed run restores the replay buffer from the checkpoint
+        cached_prefill(train_collector, buffer_size, env_kwargs, cache_dir=prefill_cache_dir)
+    if batched_test:
+        # the test paths of the batched backend
+        test_collector = make_test_collector(policy, env_kwargs if test_env_kwargs is None else test_env_kwargs,
+                                             sequential_test, seed=[0, 50])
+    else:
+        test_collector = Collector(policy, test_envs)
+    checkpointer = Checkpointer(checkpoint_dir(logger.writer.log_dir), policy, train_collector, test_collector)
+    trainer = OffpolicyTrainer(
                 policy=policy,
                 train_collector=train_collector,
                 test_collector=test_collector,
                 logger=logger,
+                train_fn=checkpointer.wrap_train_fn(),
+                save_checkpoint_fn=checkpointer.save,
+                resume_from_log=resume,
                 **trainer_kwargs
             )
+    return restore_after_run(attach_profiler(checkpointer.attach(trainer, resume=resume), profiling), restore_fn)
@@ -1,37 +1,208 @@
+import os
 import numpy as np
-from typing import Tuple
-from option_hedging.gym_envs import OptionHedgingEnv, make_env
+import multiprocessing as mp
+from typing import Tuple, Dict, Any, Sequence
+from option_hedging.gym_envs import OptionHedgingEnv, BatchedOptionHedgingEnv, make_env, reward_components
+from utils.portfolio import BatchPortfolio
+from utils.running_stats import RunningStats
 
 
-def black_scholes_benchmark(env: OptionHedgingEnv, n_trials: int) -> Tuple[float, float]:
-    rewards = np.zeros(n_trials)
-    for trial in range(n_trials):
-        obs, info = env.reset()
-        total_reward = 0
-        done, truncated = False, False
-        while not done and not truncated:
-            hedge = env.portfolio.black_scholes_hedge(env.sigma)
-            if env.action_bins > 0:
-                hedge = np.round(hedge/(1+env.epsilon)*env.action_bins)
-            action = np.array([hedge])
-            obs, reward, done, truncated, info = env.step(action)
-            total_reward += reward
-        rewards[trial] = total_reward
-    return np.mean(rewards), np.std(rewards)
-
-
-def random_agent_benchmark(env: OptionHedgingEnv, n_trials: int) -> Tuple[float, float]:
+class Strategy:
+    """
+    Rule-based hedging strategy evaluated on all paths at once. It is called at every rebalancing date with the
+    portfolio as it stands before the price move, and returns the number of shares to hold after it.
+    """
+    def reset(self, n_paths: int) -> None:
+        pass
+
+    def __call__(self, step: int, portfolio: BatchPortfolio, sigma: float, rng: np.random.Generator) -> np.ndarray:
+        raise NotImplementedError
+
+
+class BlackScholesStrategy(Strategy):
+    def __call__(self, step, portfolio, sigma, rng):
+        return portfolio.black_scholes_hedge(sigma)
+
+
+class RandomStrategy(Strategy):
+    def __init__(self, epsilon: float, action_bins: int):
+        """
+        Uniformly random actions, i.e. what env.action_space.sample() produces.
+        """
+        self.epsilon = epsilon
+        self.action_bins = action_bins
+
+    def __call__(self, step, portfolio, sigma, rng):
+        if self.action_bins > 0:
+            return rng.integers(0, self.action_bins, size=portfolio.n_paths) / (self.action_bins - 1) * \
+                (1 + self.epsilon)
+        return rng.uniform(0, 1 + self.epsilon, size=portfolio.n_paths)
+
+
+class DeltaBandStrategy(Strategy):
+    def __init__(self, band: float):
+        """
+        Rebalance to the Black-Scholes hedge only when the current holdings are more than band away from it.
+        """
+        assert band >= 0
+        self.band = band
+
+    def __call__(self, step, portfolio, sigma, rng):
+        delta = portfolio.black_scholes_hedge(sigma)
+        return np.where(np.abs(delta - portfolio.stock_held) > self.band, delta, portfolio.stock_held)
+
+
+class PeriodicRebalanceStrategy(Strategy):
+    def __init__(self, period: int, strategy: Strategy | None = None):
+        """
+        Rebalance according to strategy (Black-Scholes by default) every period steps and hold in between.
+        """
+        assert period >= 1
+        self.period = period
+        self.strategy = BlackScholesStrategy() if strategy is None else strategy
+
+    def reset(self, n_paths):
+        self.strategy.reset(n_paths)
+
+    def __call__(self, step, portfolio, sigma, rng):
+        if (step + 1) % self.period == 0:
+            return self.strategy(step, portfolio, sigma, rng)
+        return portfolio.stock_held.copy()
+
+
+def positions_to_actions(positions: np.ndarray, epsilon: float, action_bins: int) -> np.ndarray:
+    if action_bins == 0:
+        return positions
+    return np.clip(np.round(positions / (1 + epsilon) * (action_bins - 1)), 0, action_bins - 1)
+
+
+def simulate_strategy(strategy: Strategy,
+                      n_trials: int,
+                      env_kwargs: Dict[str, Any],
+                      seed: int | Sequence[int] | None = None,
+                      log_returns: np.ndarray | None = None,
+                      return_components: bool = False,
+                      path_offset: int = 0,
+                      rng: np.random.Generator | None = None
+                      ) -> np.ndarray | Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Run a strategy on n_trials episodes simultaneously and return the total reward of each episode. The episodes are
+    path_offset, ..., path_offset + n_trials - 1 of the run seed: their price paths are drawn up front as a (trials x
+    steps) matrix from the same counter-based streams (or path bank) as the envs, so that the strategy plays the
+    episodes an env seeded with seed would, and the strategy is applied one column at a time, using the same
+    transition and reward as BatchedOptionHedgingEnv. With return_components, the (trials x steps) reward components
+    and fee rates are returned too, from which option_hedging.relabel.relabel_episodes recomputes the episode rewards
+    for other rho and fee values without simulating again.
+    :param strategy: the hedging strategy
+    :param n_trials: number of episodes
+    :param env_kwargs: keyword arguments of the environment (epsilon, sigma, rho, action_bins, ...)
+    :param seed: run seed of the episodes, as given to the envs
+    :param log_returns: optional (n_trials, episode_length) matrix of log price increments to use instead of the
+    episodes of the run
+    :param return_components: also return the per-step reward components
+    :param path_offset: index of the first episode
+    :param rng: generator of randomised strategies, default_rng([*seed, 1]) by default
+    """
+    if rng is None:
+        rng = np.random.default_rng(None if seed is None else [*np.atleast_1d(seed), 1])
+    env = BatchedOptionHedgingEnv(num_envs=n_trials, seed=seed, path_offset=path_offset, **env_kwargs)
+    assert log_returns is None or log_returns.shape == (n_trials, env.episode_length)
+    env.reset(log_returns=log_returns)
+    log_returns = env.log_returns
+    prices = env.portfolio.stock_price[:, None] * np.exp(np.cumsum(log_returns, axis=1))
+
+    strategy.reset(n_trials)
     rewards = np.zeros(n_trials)
-    for trial in range(n_trials):
-        _, _ = env.reset()
-        total_reward = 0
-        done, truncated = False, False
-        while not done and not truncated:
-            action = env.action_space.sample()
-            _, reward, done, truncated, _ = env.step(action)
-            total_reward += reward
-        rewards[trial] = total_reward
-    return np.mean(rewards), np.std(rewards)
+    keys = ('transaction_fees', *reward_components)
+    components = {key: np.empty((n_trials, env.episode_length)) for key in keys} if return_components else None
+    for step in range(env.episode_length):
+        positions = strategy(step, env.portfolio, env.sigma, rng)
+        actions = positions_to_actions(positions, env.epsilon, env.action_bins)
+        _, reward, _, _, info = env.advance(prices[:, step], env.action_to_position(actions))
+        rewards += reward
+        if return_components:
+            for key in keys:
+                components[key][:, step] = info[key]
+    if return_components:
+        return rewards, components
+    return rewards
+
+
+def _evaluate_chunk(args: Tuple[Strategy, int, Dict[str, Any], int | Sequence[int], int, int]) -> RunningStats:
+    strategy, n_trials, env_kwargs, seed, chunk, path_offset = args
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk,)))
+    return RunningStats().update(simulate_strategy(strategy, n_trials, env_kwargs, seed=seed, path_offset=path_offset,
+                                                   rng=rng))
+
+
+def evaluate_strategy(strategy: Strategy,
+                      n_trials: int,
+                      env_kwargs: Dict[str, Any],
+                      seed: int | Sequence[int] = 0,
+                      chunk_size: int = 65536,
+                      n_workers: int | None = None) -> RunningStats:
+    """
+    Mean and variance of a strategy's episode reward over the first n_trials episodes of the run seed (those the
+    envs seeded with seed play), simulated in chunks of chunk_size episodes on a process pool. Chunk k plays episodes
+    k * chunk_size onwards, draws the strategy's randomness from SeedSequence(seed, spawn_key=(k,)) and comes back as
+    a RunningStats, and the chunks are merged in order, so memory does not grow with n_trials and the result is the
+    same whatever the number of workers.
+    :param strategy: the hedging strategy
+    :param n_trials: number of episodes
+    :param env_kwargs: keyword arguments of the environment
+    :param seed: run seed of the episodes, and root entropy of the strategy streams
+    :param chunk_size: episodes simulated at once by a worker
+    :param n_workers: number of processes, all CPUs by default. With 1 worker (or a single chunk) the chunks run in
+    this process
+    """
+    n_chunks = -(-n_trials // chunk_size)
+    tasks = ((strategy, min(chunk_size, n_trials - chunk * chunk_size), env_kwargs, seed, chunk, chunk * chunk_size)
+             for chunk in range(n_chunks))
+    n_workers = min((os.cpu_count() or 1) if n_workers is None else n_workers, n_chunks)
+    stats = RunningStats()
+    if n_workers <= 1:
+        for task in tasks:
+            stats.merge(_evaluate_chunk(task))
+        return stats
+    with mp.Pool(n_workers) as pool:
+        for chunk_stats in pool.imap(_evaluate_chunk, tasks):
+            stats.merge(chunk_stats)
+    return stats
+
+
+def env_kwargs_from_env(env: OptionHedgingEnv) -> Dict[str, Any]:
+    env = env.unwrapped
+    return {
+        'epsilon': env.epsilon,
+        'sigma': env.sigma,
+        'rho': env.rho,
+        'action_bins': env.action_bins,
+        'T': env.T,
+        'rebalance_frequency': int(round(1 / env.dt)),
+        'transaction_fees': env.transaction_fees,
+        'simulator': env.simulator,
+        'path_bank': env.path_bank
+    }
+
+
+def strategy_benchmark(env: OptionHedgingEnv,
+                       strategy: Strategy,
+                       n_trials: int,
+                       n_workers: int | None = None) -> Tuple[float, float]:
+    # the env's run seed: the strategy plays the episodes the env plays (from its first), so a seeded env gives
+    # reproducible benchmarks
+    seed = env.unwrapped.streams.entropy
+    stats = evaluate_strategy(strategy, n_trials, env_kwargs_from_env(env), seed=seed, n_workers=n_workers)
+    return stats.mean, stats.std
+
+
+def black_scholes_benchmark(env: OptionHedgingEnv, n_trials: int, n_workers: int | None = None) -> Tuple[float, float]:
+    return strategy_benchmark(env, BlackScholesStrategy(), n_trials, n_workers)
+
+
+def random_agent_benchmark(env: OptionHedgingEnv, n_trials: int, n_workers: int | None = None) -> Tuple[float, float]:
+    return strategy_benchmark(env, RandomStrategy(env.unwrapped.epsilon, env.unwrapped.action_bins), n_trials,
+                              n_workers)
 
 
 if __name__ == '__main__':
@@ -45,3 +216,5 @@ if __name__ == '__main__':
                    transaction_fees=0.001)()
     print(black_scholes_benchmark(env, 1000))
     print(random_agent_benchmark(env, 1000))
+    print(strategy_benchmark(env, DeltaBandStrategy(band=0.05), 1000))
+    print(strategy_benchmark(env, PeriodicRebalanceStrategy(period=4), 1000))
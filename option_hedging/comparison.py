@@ -0,0 +1,144 @@
+import numpy as np
+import torch
+from statistics import NormalDist
+from tianshou.data import Batch, to_numpy
+from tianshou.policy import BasePolicy
+from option_hedging.benchmarks import Strategy, simulate_strategy
+from option_hedging.export import position_table
+from option_hedging.gym_envs import BatchedOptionHedgingEnv
+from utils.running_stats import RunningStats
+from typing import Dict, Any, NamedTuple
+
+
+class PolicyStrategy(Strategy):
+    def __init__(self, policy: BasePolicy, env_kwargs: Dict[str, Any]):
+        """
+        A trained policy as a Strategy, so that simulate_strategy can run it on given price paths. The policy sees the
+        observation BatchedOptionHedgingEnv would return, including the Black-Scholes hedge of the previous rebalancing
+        date, and its actions go through policy.map_action as in a test Collector.
+        """
+        self.policy = policy
+        action_bins = env_kwargs['action_bins']
+        self.positions = position_table(action_bins, env_kwargs['epsilon']) if action_bins > 0 else None
+        self._previous_hedge: np.ndarray | None = None
+
+    def reset(self, n_paths):
+        self._previous_hedge = None
+
+    def __call__(self, step, portfolio, sigma, rng):
+        # the env observes the stock held at reset and the hedge computed before the last price move afterwards
+        previous_hedge = portfolio.stock_held if step == 0 else self._previous_hedge
+        obs = np.stack([portfolio.stock_price,
+                        portfolio.remaining_time,
+                        portfolio.stock_held,
+                        portfolio.strike_price,
+                        portfolio.option_valuation(sigma),
+                        previous_hedge], axis=1).astype(np.float32)
+        self._previous_hedge = portfolio.black_scholes_hedge(sigma)
+        with torch.no_grad():
+            act = self.policy.map_action(to_numpy(self.policy(Batch(obs=obs, info={})).act))
+        if self.positions is not None:
+            return self.positions[np.asarray(act, dtype=np.int64)].astype(np.float64)
+        return np.asarray(act, dtype=np.float64).reshape(portfolio.n_paths, -1)[:, 0]
+
+
+class Comparison(NamedTuple):
+    baseline: str
+    n_episodes: int
+    # episode reward of the strategy
+    mean: float
+    std: float
+    # paired difference of episode rewards, strategy minus baseline, and the half-width of its confidence interval
+    difference: float
+    half_width: float
+    # half-width the interval would have with the strategy and the baseline run on independent paths
+    unpaired_half_width: float
+    # variance of the unpaired difference over that of the paired one: the factor on the episodes needed
+    variance_reduction: float
+
+
+def compare_strategies(strategies: Dict[str, Strategy | BasePolicy],
+                       env_kwargs: Dict[str, Any],
+                       baseline: str | None = None,
+                       tolerance: float = 0.05,
+                       confidence: float = 0.95,
+                       batch_size: int = 10_000,
+                       max_episodes: int = 1_000_000,
+                       seed: int = 0) -> Dict[str, Comparison]:
+    """
+    Compare hedging strategies and trained policies with common random numbers: every batch of price paths is
+    generated once and every strategy runs on the same paths, with the same random stream for randomised strategies.
+    The per-episode differences to the baseline then cancel the path noise all strategies share, so their confidence
+    intervals are much tighter than those of separate evaluations. Batches of batch_size episodes are run until the
+    confidence interval of every difference has a half-width of at most tolerance, or max_episodes episodes have been
+    run. The paths are the episodes of the run seed in order, drawn from the envs' counter-based streams (or path
+    bank), i.e. those envs seeded with seed play, and batch k draws the strategies' randomness from
+    SeedSequence(seed, spawn_key=(k, 1)).
+    :param strategies: strategies (option_hedging.benchmarks) and policies by name
+    :param env_kwargs: keyword arguments of the environment
+    :param baseline: name of the strategy the others are compared to, the first one if None
+    :param tolerance: largest half-width of the confidence intervals of the differences
+    :param confidence: confidence level of the intervals (normal approximation)
+    :param batch_size: episodes simulated at once
+    :param max_episodes: episodes after which the comparison stops whatever the intervals
+    :param seed: run seed of the episodes, and root entropy of the strategies' randomness
+    """
+    baseline = next(iter(strategies)) if baseline is None else baseline
+    assert baseline in strategies and tolerance > 0 and 0 < confidence < 1
+    policies = {name: strategy for name, strategy in strategies.items() if isinstance(strategy, BasePolicy)}
+    strategies = {name: PolicyStrategy(strategy, env_kwargs) if name in policies else strategy
+                  for name, strategy in strategies.items()}
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    returns = {name: RunningStats() for name in strategies}
+    differences = {name: RunningStats() for name in strategies}
+    training = {name: policy.training for name, policy in policies.items()}
+    for policy in policies.values():
+        policy.eval()
+    try:
+        batch = 0
+        while True:
+            start = returns[baseline].count
+            n = min(batch_size, max_episodes - start)
+            paths = BatchedOptionHedgingEnv(num_envs=n, seed=seed, path_offset=start, **env_kwargs)
+            paths.reset()
+            batch_returns = {}
+            for name, strategy in strategies.items():
+                rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(batch, 1)))
+                batch_returns[name] = simulate_strategy(strategy, n, env_kwargs, seed=seed, path_offset=start,
+                                                        log_returns=paths.log_returns, rng=rng)
+                returns[name].update(batch_returns[name])
+                differences[name].update(batch_returns[name] - batch_returns[baseline])
+            batch += 1
+            half_widths = [z * stats.standard_error for name, stats in differences.items() if name != baseline]
+            if returns[baseline].count >= max_episodes or all(h <= tolerance for h in half_widths):
+                break
+    finally:
+        for name, policy in policies.items():
+            policy.train(training[name])
+
+    comparisons = {}
+    for name, stats in returns.items():
+        paired_variance = differences[name].sample_variance
+        unpaired_variance = stats.sample_variance + returns[baseline].sample_variance
+        comparisons[name] = Comparison(
+            baseline=baseline,
+            n_episodes=stats.count,
+            mean=stats.mean,
+            std=stats.std,
+            difference=differences[name].mean,
+            half_width=z * differences[name].standard_error,
+            unpaired_half_width=z * float(np.sqrt(unpaired_variance / stats.count)),
+            variance_reduction=unpaired_variance / paired_variance if paired_variance > 0 else np.inf
+        )
+    return comparisons
+
+
+def print_comparisons(comparisons: Dict[str, Comparison]) -> None:
+    baseline = next(iter(comparisons.values())).baseline
+    print(f'{comparisons[baseline].n_episodes} episodes on common paths, differences to {baseline}:')
+    for name, c in comparisons.items():
+        print(f'{name:<20}{c.mean:>10.4f} +/- {c.std:<10.4f}'
+              + ('' if name == baseline else f'diff {c.difference:>9.4f} +/- {c.half_width:.4f} '
+                                             f'(unpaired +/- {c.unpaired_half_width:.4f}, '
+                                             f'{c.variance_reduction:.1f}x fewer episodes)'))
@@ -0,0 +1,193 @@
+import time
+import numpy as np
+import torch
+from statistics import NormalDist
+from tianshou.data import Batch, CollectStats, SequenceSummaryStats, to_numpy
+from tianshou.policy import BasePolicy
+from option_hedging.gym_envs import BatchedOptionHedgingEnv
+from utils.running_stats import RunningStats
+from typing import Dict, Any, Sequence, Tuple
+
+
+class BatchedTestCollector:
+    def __init__(self,
+                 policy: BasePolicy,
+                 env_kwargs: Dict[str, Any],
+                 num_envs: int = 10_000,
+                 seed: int | Sequence[int] | None = None,
+                 exploration_noise: bool = False):
+        """
+        Drop-in replacement of a test Collector for the trainers: collect(n_episode=n) plays n OptionHedgingEnv
+        episodes num_envs at a time on a BatchedOptionHedgingEnv. All episodes have the same length, so every path of
+        a round is advanced together and the policy runs one forward pass per time step on the whole batch, instead of
+        one per step of every test env. Actions go through policy.map_action (and exploration noise if asked) as in
+        Collector, and the returns are the env rewards, so the statistics have the same meaning as the Collector's.
+        No transitions are stored.
+        :param policy: the policy under test
+        :param env_kwargs: keyword arguments of the test envs
+        :param num_envs: number of episodes simulated at once
+        :param seed: seed of the test paths
+        :param exploration_noise: apply the policy's exploration noise to its actions
+        """
+        self.policy = policy
+        self.env = BatchedOptionHedgingEnv(num_envs=num_envs, seed=seed, **env_kwargs)
+        self.env_num = num_envs
+        self.exploration_noise = exploration_noise
+        self.buffer = None
+        self.collect_step = self.collect_episode = 0
+        self.collect_time = 0.
+
+    def reset(self, reset_buffer: bool = True, reset_stats: bool = True, gym_reset_kwargs: Dict | None = None) -> None:
+        if reset_stats:
+            self.reset_stat()
+
+    def reset_stat(self) -> None:
+        self.collect_step = self.collect_episode = 0
+        self.collect_time = 0.
+
+    def reset_env(self, gym_reset_kwargs: Dict | None = None) -> None:
+        # every round of collect starts new episodes
+        pass
+
+    def reset_buffer(self, keep_statistics: bool = False) -> None:
+        pass
+
+    def _play(self, n_episode: int) -> np.ndarray:
+        idx = slice(None) if n_episode == self.env_num else np.arange(n_episode)
+        obs, _ = self.env.reset(idx)
+        returns = np.zeros(n_episode)
+        for _ in range(self.env.episode_length):
+            batch = Batch(obs=obs, info={})
+            act = to_numpy(self.policy(batch).act)
+            if self.exploration_noise:
+                act = self.policy.exploration_noise(act, batch)
+            obs, rew, terminated, truncated, _ = self.env.step(self.policy.map_action(act), idx)
+            returns += rew
+        assert np.all(terminated | truncated)
+        return returns
+
+    def _collect_returns(self, n_episode: int) -> np.ndarray:
+        return np.concatenate([self._play(min(self.env_num, n_episode - start))
+                               for start in range(0, n_episode, self.env_num)])
+
+    def collect(self,
+                n_step: int | None = None,
+                n_episode: int | None = None,
+                random: bool = False,
+                render: float | None = None,
+                no_grad: bool = True,
+                gym_reset_kwargs: Dict | None = None) -> CollectStats:
+        if n_step is not None or not n_episode:
+            raise ValueError('BatchedTestCollector only collects whole episodes: pass n_episode')
+        if random:
+            raise ValueError('BatchedTestCollector evaluates the policy, random actions are not supported')
+        start_time = time.time()
+        with torch.no_grad() if no_grad else torch.enable_grad():
+            returns = self._collect_returns(n_episode)
+        lens = np.full(len(returns), self.env.episode_length)
+        collect_time = max(time.time() - start_time, 1e-9)
+        self.collect_step += int(lens.sum())
+        self.collect_episode += len(returns)
+        self.collect_time += collect_time
+        return CollectStats(
+            n_collected_episodes=len(returns),
+            n_collected_steps=int(lens.sum()),
+            collect_time=collect_time,
+            collect_speed=lens.sum() / collect_time,
+            returns=returns,
+            returns_stat=SequenceSummaryStats.from_sequence(returns),
+            lens=lens,
+            lens_stat=SequenceSummaryStats.from_sequence(lens)
+        )
+
+
+class SequentialTestCollector(BatchedTestCollector):
+    def __init__(self,
+                 policy: BasePolicy,
+                 env_kwargs: Dict[str, Any],
+                 target_standard_error: float = 0.05,
+                 min_episodes: int = 100,
+                 growth: float = 2.,
+                 confidence: float = 0.95,
+                 num_envs: int = 10_000,
+                 seed: int | Sequence[int] | None = None,
+                 exploration_noise: bool = False):
+        """
+        BatchedTestCollector whose collect(n_episode=n) plays episodes in growing chunks, min_episodes first and then
+        growth times as many in total after every chunk, and stops as soon as the result is clear: the standard error
+        of the mean return is at most target_standard_error, or the mean return is significantly above or below the
+        best mean returned so far (the best epoch of the trainer), or n episodes (the trainer's episode_per_test) were
+        played. The significance is a two-sided z-test at level confidence on the difference of the means, repeated
+        after every chunk, so its actual error rate is somewhat above 1 - confidence.
+        :param policy: the policy under test
+        :param env_kwargs: keyword arguments of the test envs
+        :param target_standard_error: standard error of the mean return at which testing stops
+        :param min_episodes: episodes of the first chunk
+        :param growth: factor on the number of episodes played after every chunk
+        :param confidence: confidence level of the comparison with the best epoch
+        :param num_envs: number of episodes simulated at once
+        :param seed: seed of the test paths
+        :param exploration_noise: apply the policy's exploration noise to its actions
+        """
+        assert target_standard_error > 0 and min_episodes >= 2 and growth > 1 and 0 < confidence < 1
+        super().__init__(policy, env_kwargs, num_envs=num_envs, seed=seed, exploration_noise=exploration_noise)
+        self.target_standard_error = target_standard_error
+        self.min_episodes = min_episodes
+        self.growth = growth
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        # mean return and its standard error of the best test so far, checkpointed with the trainer's best reward
+        self.best: Tuple[float, float] | None = None
+
+    def _decided(self, stats: RunningStats) -> bool:
+        standard_error = stats.standard_error
+        if standard_error <= self.target_standard_error:
+            return True
+        if self.best is None:
+            return False
+        best_mean, best_standard_error = self.best
+        return abs(stats.mean - best_mean) > self.z * np.hypot(standard_error, best_standard_error)
+
+    def _collect_returns(self, n_episode: int) -> np.ndarray:
+        stats = RunningStats()
+        returns = []
+        chunk = self.min_episodes
+        while True:
+            returns.append(super()._collect_returns(min(chunk, n_episode - stats.count)))
+            stats.update(returns[-1])
+            if stats.count >= n_episode or (stats.count >= 2 and self._decided(stats)):
+                break
+            chunk = max(1, int(np.ceil(stats.count * (self.growth - 1))))
+        # the trainer keeps the epoch with the best mean return
+        if self.best is None or stats.mean > self.best[0]:
+            self.best = (stats.mean, stats.standard_error)
+        return np.concatenate(returns)
+
+
+def make_test_collector(policy: BasePolicy,
+                        env_kwargs: Dict[str, Any],
+                        sequential_test: Dict[str, Any] | None = None,
+                        seed: int | Sequence[int] | None = None) -> BatchedTestCollector:
+    """
+    Test collector of the trials: a BatchedTestCollector, or a SequentialTestCollector built with the keyword
+    arguments sequential_test unless it is None.
+    """
+    if sequential_test is None:
+        return BatchedTestCollector(policy, env_kwargs, seed=seed)
+    return SequentialTestCollector(policy, env_kwargs, seed=seed, **sequential_test)
+
+
+def evaluate_policy(policy: BasePolicy,
+                    env_kwargs: Dict[str, Any],
+                    n_episodes: int,
+                    seed: int | Sequence[int] | None = None,
+                    num_envs: int = 10_000) -> np.ndarray:
+    """
+    Returns of n_episodes episodes of the policy, in eval mode, simulated num_envs at a time by a BatchedTestCollector.
+    """
+    training = policy.training
+    policy.eval()
+    try:
+        return BatchedTestCollector(policy, env_kwargs, num_envs=min(num_envs, n_episodes),
+                                    seed=seed).collect(n_episode=n_episodes).returns
+    finally:
+        policy.train(training)
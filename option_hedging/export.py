@@ -0,0 +1,360 @@
+import pickle
+import numpy as np
+import torch
+import gymnasium as gym
+from torch import nn
+from tianshou.data import Batch
+from tianshou.policy import BasePolicy, SACPolicy
+from tianshou.utils.net.common import MLP
+from tianshou.utils.net import discrete, continuous
+from utils.torch_modules import PreprocessNet, QNet, ResidualBlock
+from typing import Dict, Any, List, Tuple
+
+# an op is a tuple (name, *parameters), see FrozenHedger.run
+Op = Tuple[Any, ...]
+
+_activations = {nn.ReLU: 'relu', nn.GELU: 'gelu', nn.Sigmoid: 'sigmoid', nn.Tanh: 'tanh'}
+
+
+def _module_ops(module: nn.Module) -> List[Op]:
+    """
+    Ops of an eval-mode network built from the modules of utils.torch_modules and tianshou's MLP.
+    """
+    if isinstance(module, PreprocessNet):
+        return _module_ops(module.model)
+    if isinstance(module, QNet):
+        return _module_ops(module.model) + _module_ops(module.output_layer)
+    if isinstance(module, MLP):
+        return _module_ops(module.model)
+    if isinstance(module, ResidualBlock):
+        return [('residual', _module_ops(module.l1))] + _module_ops(module.l2)
+    if isinstance(module, nn.Sequential):
+        return [op for child in module for op in _module_ops(child)]
+    if isinstance(module, nn.Linear):
+        bias = np.zeros(module.out_features) if module.bias is None else module.bias.detach().cpu().double().numpy()
+        return [('linear', module.weight.detach().cpu().double().numpy().T, bias)]
+    if isinstance(module, nn.BatchNorm1d):
+        assert module.track_running_stats, 'BatchNorm without running statistics cannot be frozen'
+        scale = 1 / np.sqrt(module.running_var.detach().cpu().double().numpy() + module.eps)
+        shift = -module.running_mean.detach().cpu().double().numpy() * scale
+        if module.affine:
+            weight = module.weight.detach().cpu().double().numpy()
+            scale, shift = scale * weight, shift * weight + module.bias.detach().cpu().double().numpy()
+        return [('affine', scale, shift)]
+    if type(module) in _activations:
+        return [('activation', _activations[type(module)])]
+    if isinstance(module, (nn.Flatten, nn.Identity)):
+        return []
+    raise NotImplementedError(f'Cannot export {type(module).__name__}')
+
+
+def _actor_ops(policy: BasePolicy) -> List[Op]:
+    """
+    Ops of the deterministic actor of the policy, mapping observations to raw actions: argmax of the Q-values or
+    probabilities for discrete actions, the mean of the action distribution (squashed as the policy does) for
+    stochastic continuous actors.
+    """
+    actor = getattr(policy, 'actor', None)
+    if actor is None:
+        # DQN: the model outputs Q-values
+        return _module_ops(policy.model) + [('argmax',)]
+    if isinstance(actor, discrete.Actor):
+        # softmax is monotonic: the argmax of the logits is the mode
+        return _module_ops(actor.preprocess) + _module_ops(actor.last) + [('argmax',)]
+    if isinstance(actor, continuous.Actor):
+        ops = _module_ops(actor.preprocess) + _module_ops(actor.last)
+        return ops + [('activation', 'tanh'), ('affine', np.float64(actor.max_action), np.float64(0))]
+    if isinstance(actor, continuous.ActorProb):
+        ops = _module_ops(actor.preprocess) + _module_ops(actor.mu)
+        if not actor._unbounded:
+            ops += [('activation', 'tanh'), ('affine', np.float64(actor.max_action), np.float64(0))]
+        if isinstance(policy, SACPolicy):
+            # SAC squashes its Gaussian sample
+            ops.append(('activation', 'tanh'))
+        return ops
+    raise NotImplementedError(f'Cannot export the actor of {type(policy).__name__}')
+
+
+def position_table(action_bins: int, epsilon: float) -> np.ndarray:
+    """
+    Stock held by OptionHedgingEnv for each discrete action.
+    """
+    return (np.arange(action_bins) / (action_bins - 1) * (1 + epsilon)).astype(np.float32)
+
+
+def _position_ops(policy: BasePolicy, env_kwargs: Dict[str, Any]) -> List[Op]:
+    """
+    Ops mapping raw actions to the positions the env holds: policy.map_action, then the env's processing of actions.
+    """
+    if env_kwargs['action_bins'] > 0:
+        return [('take', position_table(env_kwargs['action_bins'], env_kwargs['epsilon']))]
+    ops = []
+    assert isinstance(policy.action_space, gym.spaces.Box)
+    if policy.action_bound_method == 'clip':
+        ops.append(('clip', -1., 1.))
+    elif policy.action_bound_method == 'tanh':
+        ops.append(('activation', 'tanh'))
+    if policy.action_scaling:
+        low, high = policy.action_space.low.astype(np.float64), policy.action_space.high.astype(np.float64)
+        ops.append(('affine', (high - low) / 2, low + (high - low) / 2))
+    return ops + [('select', 0)]
+
+
+def fold_batch_norm(ops: List[Op]) -> List[Op]:
+    """
+    Fold every affine op (a frozen BatchNorm) into the linear op that follows it: W(s * x + t) + b is
+    (diag(s) W) x + (W t + b). The nets of utils.torch_modules normalise after the activation, so a BatchNorm folds
+    into the next Linear rather than the preceding one. Affine ops feeding a residual connection or the output stay
+    as they are.
+    """
+    folded = []
+    for op in ops:
+        if op[0] == 'residual':
+            op = ('residual', fold_batch_norm(op[1]))
+        if op[0] == 'linear' and folded and folded[-1][0] == 'affine':
+            _, scale, shift = folded.pop()
+            weight, bias = op[1], op[2]
+            scale, shift = np.broadcast_to(scale, weight.shape[:1]), np.broadcast_to(shift, weight.shape[:1])
+            op = ('linear', scale[:, None] * weight, shift @ weight + bias)
+        folded.append(op)
+    return folded
+
+
+def _cast(ops: List[Op], dtype: np.dtype) -> List[Op]:
+    cast = []
+    for op in ops:
+        if op[0] == 'residual':
+            cast.append(('residual', _cast(op[1], dtype)))
+        elif op[0] in ('linear', 'affine'):
+            cast.append((op[0], *(np.asarray(p, dtype=dtype) for p in op[1:])))
+        else:
+            cast.append(op)
+    return cast
+
+
+def _erf(x: np.ndarray) -> np.ndarray:
+    from scipy.special import erf
+    return erf(x)
+
+
+class FrozenHedger:
+    def __init__(self, ops: List[Op], obs_dim: int = 6):
+        """
+        Frozen hedging policy in pure NumPy: a list of ops, applied in order to a batch of observations, that ends
+        with the positions held by the env.
+        """
+        self.ops = ops
+        self.obs_dim = obs_dim
+
+    @staticmethod
+    def run(ops: List[Op], x: np.ndarray) -> np.ndarray:
+        for name, *params in ops:
+            # x is always an array allocated by a previous op (never the caller's obs), so ops may work in place
+            if name == 'linear':
+                x = x @ params[0]
+                x += params[1]
+            elif name == 'affine':
+                x = x * params[0]
+                x += params[1]
+            elif name == 'activation':
+                if params[0] == 'relu':
+                    np.maximum(x, 0, out=x)
+                elif params[0] == 'tanh':
+                    np.tanh(x, out=x)
+                elif params[0] == 'sigmoid':
+                    x = 1 / (1 + np.exp(-x))
+                else:
+                    x = 0.5 * x * (1 + _erf(x / np.sqrt(2, dtype=x.dtype)))
+            elif name == 'residual':
+                x = FrozenHedger.run(params[0], x) + x
+            elif name == 'clip':
+                x = np.clip(x, params[0], params[1])
+            elif name == 'argmax':
+                x = np.argmax(x, axis=1)
+            elif name == 'take':
+                x = params[0][x]
+            elif name == 'select':
+                x = x[:, params[0]]
+            else:
+                raise ValueError(f'Unknown op {name}')
+        return x
+
+    def hedge(self, obs_batch: np.ndarray) -> np.ndarray:
+        """
+        Positions (stock held) for a (batch_size, obs_dim) batch of observations, as float32.
+        """
+        obs_batch = np.asarray(obs_batch, dtype=np.float32).reshape(-1, self.obs_dim)
+        return self.run(self.ops, obs_batch).astype(np.float32, copy=False)
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> 'FrozenHedger':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def to_torchscript(self) -> torch.jit.ScriptModule:
+        """
+        TorchScript module of the same ops, whose forward (and hedge) maps a float32 tensor of observations to
+        positions.
+        """
+        return torch.jit.script(ScriptedHedger(_torch_ops(self.ops)))
+
+
+class _Affine(nn.Module):
+    def __init__(self, scale: np.ndarray, shift: np.ndarray):
+        super().__init__()
+        self.register_buffer('scale', torch.as_tensor(scale, dtype=torch.float32))
+        self.register_buffer('shift', torch.as_tensor(shift, dtype=torch.float32))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x * self.scale + self.shift
+
+
+class _Residual(nn.Module):
+    def __init__(self, inner: nn.Sequential):
+        super().__init__()
+        self.inner = inner
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.inner(x) + x
+
+
+class _Clip(nn.Module):
+    def __init__(self, low: float, high: float):
+        super().__init__()
+        self.low = low
+        self.high = high
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.clamp(x, self.low, self.high)
+
+
+class _Argmax(nn.Module):
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.argmax(x, dim=1)
+
+
+class _Take(nn.Module):
+    def __init__(self, table: np.ndarray):
+        super().__init__()
+        self.register_buffer('table', torch.as_tensor(table))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.table[x]
+
+
+class _Select(nn.Module):
+    def __init__(self, column: int):
+        super().__init__()
+        self.column = column
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x[:, self.column]
+
+
+def _torch_ops(ops: List[Op]) -> nn.Sequential:
+    modules = []
+    for name, *params in ops:
+        if name == 'linear':
+            linear = nn.Linear(*params[0].shape)
+            with torch.no_grad():
+                linear.weight.copy_(torch.as_tensor(params[0].T))
+                linear.bias.copy_(torch.as_tensor(params[1]))
+            modules.append(linear)
+        elif name == 'affine':
+            modules.append(_Affine(*params))
+        elif name == 'activation':
+            modules.append({'relu': nn.ReLU, 'tanh': nn.Tanh, 'sigmoid': nn.Sigmoid, 'gelu': nn.GELU}[params[0]]())
+        elif name == 'residual':
+            modules.append(_Residual(_torch_ops(params[0])))
+        elif name == 'clip':
+            modules.append(_Clip(*params))
+        elif name == 'argmax':
+            modules.append(_Argmax())
+        elif name == 'take':
+            modules.append(_Take(params[0]))
+        elif name == 'select':
+            modules.append(_Select(params[0]))
+        else:
+            raise ValueError(f'Unknown op {name}')
+    return nn.Sequential(*modules).eval()
+
+
+class ScriptedHedger(nn.Module):
+    def __init__(self, model: nn.Sequential):
+        super().__init__()
+        self.model = model
+
+    def forward(self, obs: torch.Tensor) -> torch.Tensor:
+        return self.model(obs)
+
+    @torch.jit.export
+    def hedge(self, obs: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(obs)
+
+
+def export_policy(policy: BasePolicy, env_kwargs: Dict[str, Any], fold: bool = True) -> FrozenHedger:
+    """
+    Freeze a trained policy (DQN, PPO, A2C, SAC, discrete SAC, DDPG or TD3) into a FrozenHedger. The policy is
+    exported in eval mode (and left in the mode it was in), so that BatchNorm layers use their running statistics,
+    which are then folded into the next Linear layer. The distribution wrappers are replaced by the deterministic action the policy takes in eval mode
+    (see _actor_ops), followed by the policy's action mapping and the env's conversion of actions into positions.
+    :param policy: trained policy
+    :param env_kwargs: keyword arguments of the env the policy was trained on
+    :param fold: fold BatchNorm layers into the next Linear layer
+    """
+    training = policy.training
+    policy.eval()
+    try:
+        ops = _actor_ops(policy) + _position_ops(policy, env_kwargs)
+    finally:
+        policy.train(training)
+    if fold:
+        ops = fold_batch_norm(ops)
+    return FrozenHedger(_cast(ops, np.float32))
+
+
+def policy_positions(policy: BasePolicy, obs: np.ndarray, env_kwargs: Dict[str, Any]) -> np.ndarray:
+    """
+    Positions the env holds when the policy acts deterministically on obs, through the tianshou policy in eval mode.
+    """
+    training = policy.training
+    policy.eval()
+    deterministic_eval = getattr(policy, 'deterministic_eval', None)
+    if deterministic_eval is not None:
+        policy.deterministic_eval = True
+    try:
+        with torch.no_grad():
+            act = policy.map_action(policy(Batch(obs=obs, info={})).act)
+    finally:
+        policy.train(training)
+        if deterministic_eval is not None:
+            policy.deterministic_eval = deterministic_eval
+    if env_kwargs['action_bins'] > 0:
+        return position_table(env_kwargs['action_bins'], env_kwargs['epsilon'])[np.asarray(act, dtype=np.int64)]
+    return np.asarray(act, dtype=np.float32)[:, 0]
+
+
+def check_parity(policy: BasePolicy,
+                 hedger: FrozenHedger | torch.jit.ScriptModule,
+                 env_kwargs: Dict[str, Any],
+                 n_episodes: int = 1000,
+                 seed: int = 0) -> Dict[str, float]:
+    """
+    Compare the positions of an exported hedger with those of the policy on the observations of n_episodes random
+    episodes. Returns the largest absolute difference and the fraction of observations whose positions differ by
+    more than 1e-4 (for discrete actions, a different action: ties are the only expected cause).
+    """
+    from option_hedging.random_prefill import random_episodes
+    obs = random_episodes(env_kwargs, n_episodes, seed=seed)['obs'].reshape(-1, 6)
+    expected = policy_positions(policy, obs, env_kwargs)
+    if isinstance(hedger, FrozenHedger):
+        positions = hedger.hedge(obs)
+    else:
+        positions = hedger.hedge(torch.as_tensor(obs)).numpy()
+    error = np.abs(positions.astype(np.float64) - expected)
+    return {'max_abs_error': float(error.max()), 'mismatch_rate': float(np.mean(error > 1e-4))}
@@ -1,21 +1,107 @@
+import copy
+import functools
 import numpy as np
 import gymnasium as gym
 from utils.history import History
-from utils.portfolio import SimplePortfolio
-from typing import Union, Tuple, List, Callable
+from utils.portfolio import SimplePortfolio, BatchPortfolio, BookPortfolio, OptionBook, random_book
+from utils.path_bank import PathBank
+from utils.market import MarketSimulator, GBM
+from utils.counter_rng import EpisodeStreams
+from typing import Union, Tuple, List, Callable, Dict, Sequence, Mapping
 
 gym.envs.register('OptionHedgingEnv', 'option_hedging.gym_envs:OptionHedgingEnv')
+gym.envs.register('BookHedgingEnv', 'option_hedging.gym_envs:BookHedgingEnv')
+
+
+def hedging_reward(portfolio_delta: float | np.ndarray,
+                   traded_notional: float | np.ndarray,
+                   transaction_fees: float | np.ndarray,
+                   rho: float = 0.) -> float | np.ndarray:
+    transaction_costs = transaction_fees * np.abs(traded_notional)
+    return portfolio_delta - transaction_costs - rho / 2 * portfolio_delta ** 2
+
+
+# raw terms of the reward, stored in the env infos so that rewards can be recomputed for other rho and fee values
+reward_components = ('portfolio_delta', 'traded_notional', 'liquidation_notional')
+
+
+def relabel_rewards(info: Mapping[str, np.ndarray],
+                    rho: float | np.ndarray,
+                    transaction_fees: float | np.ndarray | None = None) -> np.ndarray:
+    """
+    Rewards of stored transitions under another risk aversion rho and/or fee rate, from the reward_components of
+    their infos, in one array operation. The terminal liquidation cost is included, so that this reproduces the env
+    reward for the rho and fees the transitions were collected with. Array-valued rho or transaction_fees broadcast
+    against the components, e.g. rho[:, None] relabels a whole set of transitions for every rho at once.
+    :param info: infos with the reward_components, and the fee rate 'transaction_fees' if transaction_fees is None
+    :param rho: risk aversion
+    :param transaction_fees: fee rate, the stored one if None
+    """
+    if transaction_fees is None:
+        transaction_fees = np.asarray(info['transaction_fees'])
+    liquidation_notional = np.asarray(info['liquidation_notional'])
+    return hedging_reward(np.asarray(info['portfolio_delta']), np.asarray(info['traded_notional']),
+                          transaction_fees, rho) - liquidation_notional * transaction_fees
+
+
+def _reward_function(info: History, rho: float) -> float:
+    portfolio_delta = info['portfolio_value', -1] - info['portfolio_value', -2]
+    traded_notional = (info['stock_held', -1] - info['stock_held', -2]) * info['stock_price', -1]
+    return hedging_reward(portfolio_delta, traded_notional, info['transaction_fees', -1], rho)
 
 
 def make_reward_function(rho: float = 0.) -> Callable[[History], float]:
+    # a partial rather than a closure, so that envs can be pickled (checkpoints of in-process envs)
+    return functools.partial(_reward_function, rho=rho)
+
+
+def make_spaces(epsilon: float, action_bins: int, T: int) -> Tuple[gym.spaces.Space, gym.spaces.Box]:
+    if action_bins == 0:
+        action_space = gym.spaces.Box(low=0, high=1 + epsilon)
+    else:
+        action_space = gym.spaces.Discrete(action_bins)
+    # stock price, remaining time, stock held, strike price, option_valuation, black_scholes_hedge
+    observation_space = gym.spaces.Box(low=np.array([0, 0, 0, 0, 0, 0]).astype(np.float32),
+                                       high=np.array([1e3, T+1,
+                                                      1 + epsilon, 1e3, 1e3, 1 + 1e-3]).astype(np.float32),
+                                       shape=(6,))
+    return action_space, observation_space
+
+
+class SlotSpaces(Sequence):
+    def __init__(self, space: gym.spaces.Space, n: int):
+        """
+        The spaces of the n envs of a vector env: copies of space, each with its own random generator, made when first
+        accessed, so that a batch of many envs does not copy its spaces up front.
+        """
+        self.space = space
+        self.n = n
+        self._copies: Dict[int, gym.spaces.Space] = {}
 
-    def reward_function(info):
-        portfolio_delta = info['portfolio_value', -1] - info['portfolio_value', -2]
-        transaction_costs = info['transaction_fees', -1] * np.abs((info['stock_held', -1] -
-                                                                   info['stock_held', -2]) * info['stock_price', -1])
-        return portfolio_delta - transaction_costs - rho / 2 * portfolio_delta ** 2
+    def __len__(self) -> int:
+        return self.n
 
-    return reward_function
+    def __getitem__(self, k: int | slice) -> gym.spaces.Space | List[gym.spaces.Space]:
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(self.n))]
+        k = range(self.n)[k]
+        if k not in self._copies:
+            self._copies[k] = copy.deepcopy(self.space)
+        return self._copies[k]
+
+
+def check_path_bank(path_bank: PathBank | None,
+                    sigma: float,
+                    T: int,
+                    rebalance_frequency: int,
+                    simulator: MarketSimulator | None = None) -> None:
+    if path_bank is None:
+        return
+    config = path_bank.config
+    if (config['sigma'], config['T'], config['rebalance_frequency']) != (sigma, T, rebalance_frequency) or \
+            config.get('simulator') != (None if simulator is None else simulator.config()):
+        raise ValueError(f'Path bank was generated for {config}, which does not match sigma={sigma}, T={T}, '
+                         f'rebalance_frequency={rebalance_frequency}, simulator={simulator}')
 
 
 class OptionHedgingEnv(gym.Env):
@@ -29,7 +115,11 @@ class OptionHedgingEnv(gym.Env):
                  T: int = 1,
                  rebalance_frequency: int = 12,
                  transaction_fees: float = 0.001,
-                 benchmark: bool = False):
+                 benchmark: bool = False,
+                 path_bank: PathBank | None = None,
+                 path_offset: int = 0,
+                 path_stride: int = 1,
+                 simulator: MarketSimulator | None = None):
         """
         Gymnasium environment for option hedging.
         :param epsilon: action space is [0, 1+epsilon]
@@ -39,6 +129,16 @@ class OptionHedgingEnv(gym.Env):
         discretised
         :param duration_bounds: minimum and maximum duration
         :param transaction_fees: transaction fees as a percentage of each transaction
+        :param path_bank: if given, episodes replay the bank's log-return paths instead of sampling them
+        :param path_offset: index of the first episode, which selects its path in the bank or its random stream
+        :param path_stride: increment of the episode index at every reset
+        :param simulator: if given, the price moves of every episode are drawn from it at reset (e.g. Heston or Merton
+        dynamics) instead of GBM with volatility sigma, which then remains the volatility of the Black-Scholes
+        valuation and hedge. With a path bank, the bank must have been generated with the same simulator
+
+        The price moves of episode k are drawn at reset from the counter-based stream k of the seed (see
+        EpisodeStreams), so that an episode can be regenerated from the seed and its index alone, and envs of one
+        seed with path_offset i and path_stride n play the same episodes as the n paths of a BatchedOptionHedgingEnv.
         """
         super().__init__()
         assert epsilon >= 0
@@ -47,32 +147,32 @@ class OptionHedgingEnv(gym.Env):
 
         self.T = T
         self.dt = 1/rebalance_frequency
+        self.episode_length = T * rebalance_frequency - 1
         self.transaction_fees = transaction_fees
         self.benchmark = benchmark
         self.action_bins = action_bins
         self.epsilon = epsilon
+        check_path_bank(path_bank, sigma, T, rebalance_frequency, simulator)
+        self.path_bank = path_bank
+        self.path_index = path_offset
+        self.path_stride = path_stride
+        self.simulator = simulator
+        self.market = GBM(sigma) if simulator is None else simulator
+        self.log_returns = None
+        self.t = 0
 
-        if action_bins == 0:
-            self.action_space = gym.spaces.Box(low=0, high=1 + epsilon)
-        else:
-            self.action_space = gym.spaces.Discrete(action_bins)
-        # stock price, remaining time, stock held, strike price, option_valuation, black_scholes_hedge
-        self.observation_space = gym.spaces.Box(low=np.array([0, 0, 0, 0, 0, 0]).astype(np.float32),
-                                                high=np.array([1e3, T+1,
-                                                               1 + epsilon, 1e3, 1e3, 1 + 1e-3]).astype(np.float32),
-                                                shape=(6,))
+        self.action_space, self.observation_space = make_spaces(epsilon, action_bins, T)
 
         self.sigma = sigma
+        self.rho = rho
         self.portfolio = None
         self.reward_function = make_reward_function(rho=rho)
-        self.rng = None
+        self.streams = None
 
-        self.info = None
+        self.info = History(max_size=T*rebalance_frequency)
 
-    def seed(self, seed: int = None) -> List[int]:
-        if seed is not None:
-            seed = int(np.random.SeedSequence().generate_state(1)[0])
-        self.rng = np.random.default_rng(seed=seed)
+    def seed(self, seed: int | Sequence[int] | None = None) -> List[int | Sequence[int] | None]:
+        self.streams = EpisodeStreams(seed)
         return [seed]
 
     def _process_action(self, action: Union[np.ndarray, np.int32]) -> np.float32:
@@ -86,14 +186,20 @@ class OptionHedgingEnv(gym.Env):
             return np.float32(action)
 
     def reset(self, seed: int = None, options: None = None) -> Tuple[np.ndarray, History]:
-        if self.rng is None:
-            self.seed()
+        if seed is not None or self.streams is None:
+            self.seed(seed)
         strike_price = 100
         self.portfolio = SimplePortfolio(strike_price=strike_price,
                                          expiry_time=self.T,
                                          dt=self.dt)
         self.portfolio.init(self.sigma)
-        self.info = History(max_size=self.T*int(1/self.dt))
+        if self.path_bank is not None:
+            self.log_returns = self.path_bank[self.path_index]
+        else:
+            self.log_returns = self.market.simulate_episodes(self.streams, [self.path_index], self.episode_length,
+                                                             self.dt)[0]
+        self.path_index += self.path_stride
+        self.t = 0
 
         state = {
             'stock_price': self.portfolio.stock_price,
@@ -111,14 +217,18 @@ class OptionHedgingEnv(gym.Env):
             stock_held=self.portfolio.stock_held,
             stock_price=self.portfolio.stock_price,
             capital=self.portfolio.capital,
-            option_value=state['option_value']
+            option_value=state['option_value'],
+            portfolio_delta=0,
+            traded_notional=0,
+            liquidation_notional=0
         )
         return np.array(list(state.values()), dtype=np.float32), self.info[-1]
 
     def step(self, action: np.ndarray = None) -> Tuple[np.ndarray, float, bool, bool, History]:
         action = self._process_action(action)
-        done, truncated = False, False
-        price_change = np.exp(self.rng.normal(0, self.sigma*np.sqrt(self.dt)))
+        truncated = False
+        price_change = np.exp(self.log_returns[self.t])
+        self.t += 1
         new_price = self.portfolio.stock_price * price_change
         black_scholes_hedge = self.portfolio.black_scholes_hedge(self.sigma)
         self.portfolio.update_position(new_price, action)
@@ -131,20 +241,23 @@ class OptionHedgingEnv(gym.Env):
             'option_value': self.portfolio.option_valuation(self.sigma),
             'black_scholes_hedge': black_scholes_hedge
         }
+        portfolio_value = self.portfolio.portfolio_valuation(self.sigma)
+        done = bool(np.isclose(self.portfolio.remaining_time, self.dt))
+        liquidation_notional = self.portfolio.stock_held * new_price if done else 0.
         self.info.add(
             transaction_fees=self.transaction_fees,
             reward=0,
             sigma=self.sigma,
-            portfolio_value=self.portfolio.portfolio_valuation(self.sigma),
+            portfolio_value=portfolio_value,
             stock_held=self.portfolio.stock_held,
             stock_price=self.portfolio.stock_price,
             capital=self.portfolio.capital,
             option_value=state['option_value'],
+            portfolio_delta=portfolio_value - self.info['portfolio_value', -1],
+            traded_notional=(self.portfolio.stock_held - self.info['stock_held', -1]) * new_price,
+            liquidation_notional=liquidation_notional
         )
-        reward = self.reward_function(self.info)
-        if np.isclose(self.portfolio.remaining_time, self.dt):
-            reward -= self.portfolio.stock_held * new_price * self.transaction_fees
-            done = True
+        reward = self.reward_function(self.info) - liquidation_notional * self.transaction_fees
 
         self.info['reward', -1] = reward
         return np.array(list(state.values()), dtype=np.float32), reward, done, truncated, self.info[-1]
@@ -153,15 +266,355 @@ class OptionHedgingEnv(gym.Env):
         pass
 
 
+class BatchedOptionHedgingEnv:
+    metadata = {'render_modes': []}
+    info_keys = ('transaction_fees', 'reward', 'sigma', 'portfolio_value', 'stock_held', 'stock_price', 'capital',
+                 'option_value') + reward_components
+
+    def __init__(self,
+                 num_envs: int,
+                 epsilon: float = 0.1,
+                 sigma: float = 0.1,
+                 rho: float = 0.,
+                 action_bins: int = 0,
+                 T: int = 1,
+                 rebalance_frequency: int = 12,
+                 transaction_fees: float = 0.001,
+                 seed: int | Sequence[int] | None = None,
+                 path_bank: PathBank | None = None,
+                 path_offset: int = 0,
+                 path_stride: int = 1,
+                 simulator: MarketSimulator | None = None,
+                 **kwargs):
+        """
+        Runs num_envs independent OptionHedgingEnv episodes as contiguous arrays, advancing all of them with a single
+        vectorised step. Implements the interface of tianshou's BaseVectorEnv, so that it can be handed to a Collector
+        in place of a DummyVectorEnv/SubprocVectorEnv.
+        :param num_envs: number of paths simulated in parallel
+        :param seed: seed of the counter-based streams of the episodes
+        :param path_bank: if given, path i replays bank paths path_offset + (i + k * num_envs) * path_stride in its
+        k-th episode instead of sampling. Otherwise that index selects the episode's random stream, as in
+        OptionHedgingEnv
+        :param simulator: if given, the paths of the envs being reset are drawn from it in one batch
+        See OptionHedgingEnv for the remaining parameters.
+        """
+        assert num_envs >= 1
+        assert epsilon >= 0
+        assert action_bins == 0 or action_bins >= 2
+        assert rebalance_frequency >= 1 and isinstance(rebalance_frequency, int)
+
+        self.env_num = num_envs
+        self.is_async = False
+        self.is_closed = False
+        self.T = T
+        self.dt = 1/rebalance_frequency
+        # an episode ends once a single rebalancing period is left
+        self.episode_length = T * rebalance_frequency - 1
+        self.transaction_fees = transaction_fees
+        self.action_bins = action_bins
+        self.epsilon = epsilon
+        self.sigma = sigma
+        self.rho = rho
+
+        action_space, observation_space = make_spaces(epsilon, action_bins, T)
+        self.action_space = SlotSpaces(action_space, num_envs)
+        self.observation_space = [observation_space] * num_envs
+
+        self.portfolio = BatchPortfolio(n_paths=num_envs, strike_price=100, expiry_time=T, dt=self.dt)
+        self.portfolio_value = np.zeros(num_envs, dtype=np.float64)
+        self.option_value = np.zeros(num_envs, dtype=np.float64)
+        check_path_bank(path_bank, sigma, T, rebalance_frequency, simulator)
+        self.path_bank = path_bank
+        self.path_index = path_offset + np.arange(num_envs) * path_stride
+        self.path_stride = path_stride
+        self.simulator = simulator
+        self.market = GBM(sigma) if simulator is None else simulator
+        self.log_returns = np.zeros((num_envs, self.episode_length))
+        self.t = np.zeros(num_envs, dtype=np.int64)
+        self.streams = None
+        self.seed(seed)
+
+    def __len__(self) -> int:
+        return self.env_num
+
+    def seed(self, seed: int | Sequence[int] | None = None) -> List[int | Sequence[int] | None]:
+        self.streams = EpisodeStreams(seed)
+        return [seed]
+
+    def _wrap_id(self, id: int | Sequence[int] | np.ndarray | slice | None) -> np.ndarray | slice:
+        # A slice for all envs avoids fancy indexing, but selects views: copy before the state is modified
+        if id is None:
+            return slice(None)
+        if isinstance(id, slice):
+            return id
+        return np.atleast_1d(np.asarray(id, dtype=np.int64))
+
+    @staticmethod
+    def _take(array: np.ndarray, idx: np.ndarray | slice) -> np.ndarray:
+        return array[idx].copy() if isinstance(idx, slice) else array[idx]
+
+    def action_to_position(self, action: np.ndarray) -> np.ndarray:
+        """
+        Stock positions the paths are rebalanced to by a batch of actions, as step and advance take them.
+        """
+        action = np.asarray(action, dtype=np.float64).reshape(len(action), -1)[:, 0]
+        if self.action_bins > 0:
+            action = action / (self.action_bins - 1) * (1 + self.epsilon)
+        # single-path env holds positions in float32
+        return action.astype(np.float32).astype(np.float64)
+
+    def _info(self,
+              idx: np.ndarray | slice,
+              reward: np.ndarray,
+              components: Tuple[np.ndarray, np.ndarray, np.ndarray] | None = None) -> Dict[str, np.ndarray]:
+        if components is None:
+            components = (np.zeros(len(reward)),) * len(reward_components)
+        return {
+            'transaction_fees': np.full(len(reward), self.transaction_fees),
+            'reward': reward,
+            'sigma': np.full(len(reward), self.sigma),
+            'portfolio_value': self._take(self.portfolio_value, idx),
+            'stock_held': self._take(self.portfolio.stock_held, idx),
+            'stock_price': self._take(self.portfolio.stock_price, idx),
+            'capital': self._take(self.portfolio.capital, idx),
+            'option_value': self._take(self.option_value, idx),
+            **dict(zip(reward_components, components)),
+            'env_id': np.arange(self.env_num)[idx]
+        }
+
+    def _observation(self, idx: np.ndarray | slice, black_scholes_hedge: np.ndarray) -> np.ndarray:
+        return np.stack([self.portfolio.stock_price[idx],
+                         self.portfolio.remaining_time[idx],
+                         self.portfolio.stock_held[idx],
+                         self.portfolio.strike_price[idx],
+                         self.option_value[idx],
+                         black_scholes_hedge], axis=1).astype(np.float32)
+
+    def reset(self,
+              id: int | Sequence[int] | np.ndarray | slice | None = None,
+              log_returns: np.ndarray | None = None,
+              **kwargs) -> Tuple[np.ndarray, Dict]:
+        """
+        Start new episodes on the selected paths, on their next episodes of the run (or bank paths), or on the given
+        (n_paths, episode_length) log price increments, which are then used instead of drawing any.
+        """
+        idx = self._wrap_id(id)
+        self.portfolio.init(self.sigma, idx)
+        episodes = self.path_index[idx]
+        if log_returns is not None:
+            self.log_returns[idx] = log_returns
+        elif self.path_bank is not None:
+            self.log_returns[idx] = self.path_bank.take(episodes)
+        else:
+            self.log_returns[idx] = self.market.simulate_episodes(self.streams, episodes, self.episode_length, self.dt)
+        self.path_index[idx] += self.env_num * self.path_stride
+        self.t[idx] = 0
+        self.option_value[idx] = self.portfolio.option_valuation(self.sigma, idx)
+        self.portfolio_value[idx] = self.portfolio.portfolio_valuation(self.sigma, idx)
+        stock_held = self.portfolio.stock_held[idx]
+        return self._observation(idx, stock_held), self._info(idx, np.zeros(len(stock_held)))
+
+    def step(self,
+             action: np.ndarray,
+             id: int | Sequence[int] | np.ndarray | slice | None = None
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict]:
+        idx = self._wrap_id(id)
+        stock_held = self.action_to_position(action)
+        assert len(stock_held) == len(self.portfolio.stock_price[idx])
+        paths = np.arange(self.env_num)[idx]
+        price_change = np.exp(self.log_returns[paths, self.t[paths]])
+        self.t[idx] += 1
+        return self.advance(self.portfolio.stock_price[idx] * price_change, stock_held, idx)
+
+    def advance(self,
+                new_price: np.ndarray,
+                stock_held: np.ndarray,
+                id: int | Sequence[int] | np.ndarray | slice | None = None
+                ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict]:
+        """
+        Move the selected paths to new_price and rebalance them to stock_held. This is step() with the price move and
+        the action supplied by the caller, e.g. from a pre-computed price matrix.
+        """
+        idx = self._wrap_id(id)
+        black_scholes_hedge = self.portfolio.black_scholes_hedge(self.sigma, idx)
+        previous_stock_held = self._take(self.portfolio.stock_held, idx)
+        previous_value = self._take(self.portfolio_value, idx)
+        self.portfolio.update_position(new_price, stock_held, idx)
+
+        option_value = self.portfolio.option_valuation(self.sigma, idx)
+        self.option_value[idx] = option_value
+        portfolio_value = new_price * stock_held + self.portfolio.capital[idx] - option_value
+        self.portfolio_value[idx] = portfolio_value
+        portfolio_delta = portfolio_value - previous_value
+        traded_notional = (stock_held - previous_stock_held) * new_price
+        reward = hedging_reward(portfolio_delta, traded_notional, self.transaction_fees, self.rho)
+        done = np.isclose(self.portfolio.remaining_time[idx], self.dt)
+        liquidation_notional = done * stock_held * new_price
+        reward = reward - liquidation_notional * self.transaction_fees
+        truncated = np.zeros_like(done)
+        return self._observation(idx, black_scholes_hedge), reward, done, truncated, \
+            self._info(idx, reward, (portfolio_delta, traded_notional, liquidation_notional))
+
+    def render(self, **kwargs) -> List[None]:
+        return [None] * self.env_num
+
+    def close(self) -> None:
+        self.is_closed = True
+
+
+class BookHedgingEnv(gym.Env):
+    metadata = {'render_modes': []}
+
+    def __init__(self,
+                 book: OptionBook | None = None,
+                 n_options: int = 1000,
+                 book_seed: int | None = 0,
+                 epsilon: float = 0.1,
+                 sigma: float = 0.1,
+                 rho: float = 0.,
+                 action_bins: int = 0,
+                 T: int = 1,
+                 rebalance_frequency: int = 12,
+                 transaction_fees: float = 0.001,
+                 simulator: MarketSimulator | None = None,
+                 path_offset: int = 0,
+                 path_stride: int = 1):
+        """
+        OptionHedgingEnv for a book of options on one underlying (see BookPortfolio): the agent hedges the net delta
+        of the whole book with the stock. The action a in [0, 1+epsilon] holds low + a * (high - low) stock, where
+        [low, high] bounds the Black-Scholes hedge of the book; holdings, hedge, book value and rewards are observed
+        per unit of that range, so that a book made of one short call struck at 100 reproduces OptionHedgingEnv. The
+        observation keeps the layout of OptionHedgingEnv, with the strike averaged over the contracts still in the
+        book. An episode runs until a single rebalancing period is left before the last expiry.
+        :param book: the options, a random_book of n_options contracts if None
+        :param n_options: number of contracts of the random book
+        :param book_seed: seed of the random book
+        :param T: expiry horizon of the random book
+        :param simulator: if given, the price moves of every episode are drawn from it at reset
+        :param path_offset: index of the first episode, which selects its random stream
+        :param path_stride: increment of the episode index at every reset
+        See OptionHedgingEnv for the remaining parameters.
+        """
+        super().__init__()
+        assert epsilon >= 0
+        assert action_bins == 0 or action_bins >= 2
+        assert rebalance_frequency >= 1 and isinstance(rebalance_frequency, int)
+        if book is None:
+            book = random_book(n_options, T=T, rebalance_frequency=rebalance_frequency, seed=book_seed)
+        self.dt = 1/rebalance_frequency
+        self.portfolio = BookPortfolio(book, dt=self.dt)
+        self.hedge_low, hedge_high = self.portfolio.hedge_range
+        self.hedge_scale = hedge_high - self.hedge_low
+        assert self.hedge_scale > 0, 'the book has no delta to hedge'
+        self.T = self.portfolio.horizon * self.dt
+        self.transaction_fees = transaction_fees
+        self.action_bins = action_bins
+        self.epsilon = epsilon
+        self.sigma = sigma
+        self.rho = rho
+        self.action_space, _ = make_spaces(epsilon, action_bins, T)
+        self.observation_space = gym.spaces.Box(low=-1e3, high=1e3, shape=(6,), dtype=np.float32)
+        self.streams = EpisodeStreams()
+        self.simulator = simulator
+        self.market = GBM(sigma) if simulator is None else simulator
+        self.path_index = path_offset
+        self.path_stride = path_stride
+        self.log_returns = None
+        self.portfolio_value = 0.
+
+    def seed(self, seed: int | Sequence[int] | None = None) -> List[int | Sequence[int] | None]:
+        self.streams = EpisodeStreams(seed)
+        return [seed]
+
+    def _process_action(self, action: Union[np.ndarray, np.int32]) -> float:
+        action = float(np.asarray(action).reshape(-1)[0])
+        if self.action_bins > 0:
+            action = action / (self.action_bins - 1) * (1 + self.epsilon)
+        # the single-option env holds positions in float32
+        return self.hedge_low + float(np.float32(action)) * self.hedge_scale
+
+    def _observation(self, black_scholes_hedge: float) -> np.ndarray:
+        return np.array([self.portfolio.stock_price,
+                         self.portfolio.remaining_time,
+                         (self.portfolio.stock_held - self.hedge_low) / self.hedge_scale,
+                         self.portfolio.notional_strike(),
+                         self.portfolio.option_valuation(self.sigma) / self.hedge_scale,
+                         (black_scholes_hedge - self.hedge_low) / self.hedge_scale], dtype=np.float32)
+
+    def _info(self, reward: float, components: Tuple[float, float, float] = (0., 0., 0.)) -> Dict[str, float]:
+        return {
+            'transaction_fees': self.transaction_fees,
+            'reward': reward,
+            'sigma': self.sigma,
+            'portfolio_value': self.portfolio_value,
+            'stock_held': self.portfolio.stock_held,
+            'stock_price': self.portfolio.stock_price,
+            'capital': self.portfolio.capital,
+            'option_value': self.portfolio.option_valuation(self.sigma),
+            **dict(zip(reward_components, components))
+        }
+
+    def reset(self, seed: int = None, options: None = None) -> Tuple[np.ndarray, Dict[str, float]]:
+        if seed is not None:
+            self.seed(seed)
+        self.portfolio.init(self.sigma)
+        self.portfolio_value = self.portfolio.portfolio_valuation(self.sigma)
+        self.log_returns = self.market.simulate_episodes(self.streams, [self.path_index], self.portfolio.horizon - 1,
+                                                         self.dt)[0]
+        self.path_index += self.path_stride
+        return self._observation(self.portfolio.stock_held), self._info(0.)
+
+    def step(self, action: np.ndarray = None) -> Tuple[np.ndarray, float, bool, bool, Dict[str, float]]:
+        stock_held = self._process_action(action)
+        new_price = self.portfolio.stock_price * np.exp(self.log_returns[self.portfolio.step])
+        black_scholes_hedge = self.portfolio.black_scholes_hedge(self.sigma)
+        previous_stock_held, previous_value = self.portfolio.stock_held, self.portfolio_value
+        self.portfolio.update_position(new_price, stock_held)
+        self.portfolio_value = self.portfolio.portfolio_valuation(self.sigma)
+        done = self.portfolio.step == self.portfolio.horizon - 1
+        # the reward components are per unit of hedge range, like the reward
+        components = ((self.portfolio_value - previous_value) / self.hedge_scale,
+                      (stock_held - previous_stock_held) * new_price / self.hedge_scale,
+                      abs(stock_held) * new_price / self.hedge_scale if done else 0.)
+        reward = hedging_reward(components[0], components[1], self.transaction_fees, self.rho) \
+            - components[2] * self.transaction_fees
+        return self._observation(black_scholes_hedge), reward, done, False, self._info(reward, components)
+
+    def render(self) -> None:
+        pass
+
+
+def make_book_env(book: OptionBook | None = None,
+                  seed: int | Sequence[int] | None = None,
+                  **kwargs) -> Callable[[], BookHedgingEnv]:
+    """
+    Env factory of BookHedgingEnv, as make_env for OptionHedgingEnv.
+    """
+    def _init() -> BookHedgingEnv:
+        env = gym.make('BookHedgingEnv', book=book, **kwargs)
+        env.unwrapped.seed(seed)
+        return env
+    return _init
+
+
 def make_env(epsilon: float,
              sigma: float,
              rho: float,
              action_bins: int,
              T: int,
              rebalance_frequency: int,
-             seed: int | None,
+             seed: int | Sequence[int] | None,
              transaction_fees: float = 0.001,
+             path_bank: PathBank | None = None,
+             path_offset: int = 0,
+             path_stride: int = 1,
+             simulator: MarketSimulator | None = None,
+             action_seed: int | None = None,
              **kwargs) -> Callable[[], OptionHedgingEnv]:
+    """
+    Env factory of OptionHedgingEnv, seeding its episode streams with seed and, unless action_seed is None, its action
+    space (e.g. in a worker process, where the action space sampled from lives) with action_seed.
+    """
     def _init() -> OptionHedgingEnv:
         env = gym.make('OptionHedgingEnv',
                        epsilon=epsilon,
@@ -170,7 +623,13 @@ def make_env(epsilon: float,
                        action_bins=action_bins,
                        T=T,
                        rebalance_frequency=rebalance_frequency,
-                       transaction_fees=transaction_fees)
+                       transaction_fees=transaction_fees,
+                       path_bank=path_bank,
+                       path_offset=path_offset,
+                       path_stride=path_stride,
+                       simulator=simulator)
         env.seed(seed)
+        if action_seed is not None:
+            env.action_space.seed(action_seed)
         return env
     return _init
@@ -0,0 +1,350 @@
+import json
+import time
+import asyncio
+import argparse
+import warnings
+import collections
+import numpy as np
+from typing import Dict, Any, List, Tuple, Protocol
+
+# observation layout of OptionHedgingEnv
+observation_keys = ('stock_price', 'remaining_time', 'stock_held', 'strike_price', 'option_value',
+                    'black_scholes_hedge')
+# a request line may carry thousands of observations
+_line_limit = 2 ** 26
+
+
+class Hedger(Protocol):
+    def hedge(self, obs_batch: np.ndarray) -> np.ndarray:
+        ...
+
+
+class HedgeServer:
+    def __init__(self,
+                 hedger: Hedger,
+                 max_batch_size: int = 4096,
+                 max_wait: float = 0.002,
+                 latency_window: int = 10000):
+        """
+        Asyncio hedge server. Requests carry (n, 6) observations in the OptionHedgingEnv layout (observation_keys) and
+        are answered with the n positions of the hedger, e.g. a FrozenHedger from option_hedging.export. Pending
+        requests are gathered into micro-batches of up to max_batch_size observations, waiting at most max_wait seconds
+        after the first one, and each micro-batch is answered with a single forward pass. A request larger than
+        max_batch_size forms a batch of its own.
+        :param hedger: object with a hedge(obs_batch) -> positions method
+        :param max_batch_size: number of observations that closes a micro-batch
+        :param max_wait: seconds a micro-batch stays open for more requests
+        :param latency_window: number of recent requests the latency percentiles are computed on
+        """
+        assert max_batch_size >= 1 and max_wait >= 0
+        self.hedger = hedger
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.n_requests = 0
+        self.n_observations = 0
+        self.n_batches = 0
+        self.start_time = time.perf_counter()
+        self._queue: asyncio.Queue | None = None
+        self._batcher: asyncio.Task | None = None
+        # request that did not fit in the last micro-batch, which opens the next one
+        self._carry: Tuple[np.ndarray, asyncio.Future, float] | None = None
+        # requests of the micro-batch being gathered
+        self._gathering: List[Tuple[np.ndarray, asyncio.Future, float]] = []
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self, host: str | None = None, port: int = 0) -> Tuple[str, int] | None:
+        """
+        Start batching, and with a host, listen for newline-delimited JSON requests on it (port 0 picks a free port).
+        Returns the address listened on.
+        """
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._batch_loop())
+        self.reset_stats()
+        if host is None:
+            return None
+        self._server = await asyncio.start_server(self._handle_connection, host, port, limit=_line_limit)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self) -> None:
+        """
+        Stop listening and batching. Requests not answered yet fail with a RuntimeError.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            self._batcher = None
+        unanswered = self._gathering + ([] if self._carry is None else [self._carry])
+        self._gathering, self._carry = [], None
+        while self._queue is not None and not self._queue.empty():
+            unanswered.append(self._queue.get_nowait())
+        for _, future, _ in unanswered:
+            if not future.done():
+                future.set_exception(RuntimeError('HedgeServer stopped before answering'))
+
+    async def __aenter__(self) -> 'HedgeServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def hedge(self, obs: np.ndarray) -> np.ndarray:
+        """
+        Positions for a batch of observations, answered within the next micro-batch.
+        """
+        obs = np.asarray(obs, dtype=np.float32)
+        if obs.ndim == 1:
+            obs = obs[None]
+        if obs.ndim != 2 or obs.shape[1] != len(observation_keys):
+            raise ValueError(f'Observations must have shape (n, {len(observation_keys)}) with columns '
+                             f'{observation_keys}, got {obs.shape}')
+        if self._batcher is None:
+            raise RuntimeError('HedgeServer is not running')
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((obs, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[np.ndarray, asyncio.Future, float]]:
+        if self._carry is not None:
+            batch, self._carry = [self._carry], None
+        else:
+            batch = [await self._queue.get()]
+        # kept on the server until answered, for stop to fail them if cancelled meanwhile
+        self._gathering = batch
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            if self._queue.empty():
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self._queue.get_nowait()
+            if size + len(item[0]) > self.max_batch_size:
+                self._carry = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    async def _batch_loop(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            self._gathering = []
+            obs = np.concatenate([item[0] for item in batch]) if len(batch) > 1 else batch[0][0]
+            try:
+                positions = np.asarray(self.hedger.hedge(obs))
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            done_time = time.perf_counter()
+            start = 0
+            for item_obs, future, enqueue_time in batch:
+                if not future.done():
+                    future.set_result(positions[start:start + len(item_obs)])
+                start += len(item_obs)
+                self.latencies.append(done_time - enqueue_time)
+            self.n_requests += len(batch)
+            self.n_observations += len(obs)
+            self.n_batches += 1
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        One JSON object per line: {"id": ..., "obs": [[...6 floats], ...]} is answered with {"id": ..., "positions":
+        [...]}, {"id": ..., "stats": true} with the server statistics, and an invalid request with {"id": ...,
+        "error": ...}. Requests of a connection are served concurrently, so responses may come out of order.
+        """
+        pending = set()
+        lock = asyncio.Lock()
+
+        async def respond(request):
+            response = {'id': request.get('id')}
+            try:
+                if 'invalid' in request:
+                    raise ValueError(request['invalid'])
+                if request.get('stats'):
+                    response['stats'] = self.stats()
+                else:
+                    response['positions'] = (await self.hedge(request['obs'])).tolist()
+            except Exception as e:
+                response['error'] = f'{type(e).__name__}: {e}'
+            async with lock:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    request = {'invalid': f'Invalid JSON: {e}'}
+                task = asyncio.create_task(respond(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    def reset_stats(self) -> None:
+        self.latencies.clear()
+        self.n_requests = self.n_observations = self.n_batches = 0
+        self.start_time = time.perf_counter()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Request latency percentiles (seconds, over the latency window), throughput since the server started (or
+        reset_stats) and mean micro-batch size.
+        """
+        elapsed = time.perf_counter() - self.start_time
+        latencies = np.asarray(self.latencies)
+        return {
+            'requests': self.n_requests,
+            'observations': self.n_observations,
+            'batches': self.n_batches,
+            'mean_batch_size': self.n_observations / self.n_batches if self.n_batches else 0.,
+            'latency_p50': float(np.percentile(latencies, 50)) if len(latencies) else np.nan,
+            'latency_p99': float(np.percentile(latencies, 99)) if len(latencies) else np.nan,
+            'requests_per_sec': self.n_requests / elapsed,
+            'observations_per_sec': self.n_observations / elapsed
+        }
+
+
+class HedgeClient:
+    def __init__(self, host: str, port: int):
+        """
+        Client of a HedgeServer over its newline-delimited JSON protocol, standing in for the risk system.
+        """
+        self.host = host
+        self.port = port
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._responses: Dict[int, asyncio.Future] = {}
+        self._receiver: asyncio.Task | None = None
+        self._next_id = 0
+
+    async def connect(self) -> 'HedgeClient':
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port, limit=_line_limit)
+        self._receiver = asyncio.create_task(self._receive())
+        return self
+
+    async def close(self) -> None:
+        self._writer.close()
+        await self._writer.wait_closed()
+        self._receiver.cancel()
+
+    async def __aenter__(self) -> 'HedgeClient':
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _receive(self) -> None:
+        while line := await self._reader.readline():
+            response = json.loads(line)
+            future = self._responses.pop(response.get('id'), None)
+            if future is None:
+                if 'error' in response:
+                    # a request the server could not read (e.g. truncated), which may be any of the pending ones
+                    self._fail_pending(RuntimeError(response['error']))
+                else:
+                    warnings.warn(f'Response to no pending request: {response}', RuntimeWarning)
+            elif 'error' in response:
+                future.set_exception(RuntimeError(response['error']))
+            else:
+                future.set_result(response)
+        self._fail_pending(ConnectionError('HedgeServer closed the connection'))
+
+    def _fail_pending(self, exception: Exception) -> None:
+        responses, self._responses = self._responses, {}
+        for future in responses.values():
+            if not future.done():
+                future.set_exception(exception)
+
+    async def _request(self, **request) -> Dict[str, Any]:
+        request_id, self._next_id = self._next_id, self._next_id + 1
+        future = asyncio.get_running_loop().create_future()
+        self._responses[request_id] = future
+        self._writer.write((json.dumps({'id': request_id, **request}) + '\n').encode())
+        await self._writer.drain()
+        return await future
+
+    async def hedge(self, obs: np.ndarray) -> np.ndarray:
+        response = await self._request(obs=np.asarray(obs, dtype=np.float32).tolist())
+        return np.asarray(response['positions'], dtype=np.float32)
+
+    async def stats(self) -> Dict[str, float]:
+        return (await self._request(stats=True))['stats']
+
+
+async def local_load_test(hedger: Hedger,
+                          obs: np.ndarray,
+                          n_clients: int = 8,
+                          requests_per_client: int = 100,
+                          obs_per_request: int = 1,
+                          max_batch_size: int = 4096,
+                          max_wait: float = 0.002) -> Dict[str, float]:
+    """
+    Serve hedger on a local port and query it from n_clients concurrent HedgeClients, each sending
+    requests_per_client requests of obs_per_request observations drawn from obs. Checks every answer against
+    hedger.hedge and returns the server statistics.
+    """
+    server = HedgeServer(hedger, max_batch_size=max_batch_size, max_wait=max_wait)
+    host, port = await server.start('127.0.0.1', 0)
+    rng = np.random.default_rng(0)
+
+    async def client_session():
+        async with HedgeClient(host, port) as client:
+            async def one_request():
+                request_obs = obs[rng.integers(len(obs), size=obs_per_request)]
+                positions = await client.hedge(request_obs)
+                np.testing.assert_allclose(positions, hedger.hedge(request_obs), rtol=1e-6, atol=1e-6)
+            await asyncio.gather(*(one_request() for _ in range(requests_per_client)))
+
+    try:
+        server.reset_stats()
+        await asyncio.gather(*(client_session() for _ in range(n_clients)))
+        return server.stats()
+    finally:
+        await server.stop()
+
+
+async def serve(hedger: Hedger, host: str, port: int, max_batch_size: int, max_wait: float) -> None:
+    server = HedgeServer(hedger, max_batch_size=max_batch_size, max_wait=max_wait)
+    host, port = await server.start(host, port)
+    print(f'Serving hedges on {host}:{port}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main() -> None:
+    from option_hedging.export import FrozenHedger
+    parser = argparse.ArgumentParser(description='Micro-batching hedge inference server.')
+    parser.add_argument('hedger', help='path of a FrozenHedger saved by FrozenHedger.save')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=4096)
+    parser.add_argument('--max-wait-ms', type=float, default=2.)
+    args = parser.parse_args()
+    asyncio.run(serve(FrozenHedger.load(args.hedger), args.host, args.port, args.max_batch_size,
+                      args.max_wait_ms / 1000))
+
+
+if __name__ == '__main__':
+    main()
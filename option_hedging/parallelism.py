@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import numpy as np
+import torch
+from tianshou.trainer import BaseTrainer
+from tianshou.utils import BaseLogger
+from option_hedging.vector_envs import make_vector_env
+from utils.torch_modules import PreprocessNet
+from typing import Callable, Dict, Any, List, Tuple, NamedTuple, Sequence
+
+
+class ParallelismPlan(NamedTuple):
+    backend: str
+    train_env_num: int
+    test_env_num: int
+    num_workers: int | None
+    torch_threads: int
+    main_cpus: Tuple[int, ...]
+    worker_cpus: Tuple[Tuple[int, ...], ...] | None
+    calibration: Dict[str, float]
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict(), indent=2)
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def calibrate_env(env_kwargs: Dict[str, Any],
+                  num_envs: int,
+                  backend: str,
+                  num_workers: int | None = None,
+                  duration: float = 0.25) -> float:
+    """
+    Seconds per vectorised step of num_envs envs on the given backend, from random actions over about duration
+    seconds (episodes are reset as they end, as in a Collector).
+    """
+    envs = make_vector_env(env_kwargs, num_envs=num_envs, backend=backend, num_workers=num_workers)
+    try:
+        action_space = envs.action_space[0]
+        actions = np.stack([action_space.sample() for _ in range(num_envs)])
+        envs.reset()
+        n_steps, start = 0, time.perf_counter()
+        while time.perf_counter() - start < duration:
+            _, _, terminated, truncated, _ = envs.step(actions)
+            done = np.flatnonzero(terminated | truncated)
+            if len(done):
+                envs.reset(done)
+            n_steps += 1
+        return (time.perf_counter() - start) / n_steps
+    finally:
+        envs.close()
+
+
+def calibrate_policy(net_kwargs: Dict[str, Any],
+                     obs_dim: int,
+                     batch_size: int,
+                     torch_threads: int,
+                     duration: float = 0.25) -> float:
+    """
+    Seconds per forward pass of a PreprocessNet with net_kwargs on a batch of batch_size observations, which stands
+    in for the policy the Collector evaluates between env steps.
+    """
+    previous_threads = torch.get_num_threads()
+    torch.set_num_threads(torch_threads)
+    try:
+        net = PreprocessNet(state_shape=(obs_dim,), device='cpu', **net_kwargs).eval()
+        obs = torch.zeros(batch_size, obs_dim)
+        with torch.no_grad():
+            net(obs)
+            n_steps, start = 0, time.perf_counter()
+            while time.perf_counter() - start < duration:
+                net(obs)
+                n_steps += 1
+        return (time.perf_counter() - start) / n_steps
+    finally:
+        torch.set_num_threads(previous_threads)
+
+
+def plan_parallelism(env_kwargs: Dict[str, Any],
+                     net_kwargs: Dict[str, Any] | None = None,
+                     train_env_num: int = 20,
+                     test_env_num: int = 10,
+                     backends: Sequence[str] = ('dummy', 'batched', 'shmem'),
+                     duration: float = 0.25) -> ParallelismPlan:
+    """
+    Pick the vector env backend and worker count that collect the most steps/sec on this host. Every candidate is
+    timed on a short run of train_env_num envs, and the policy forward pass the Collector makes between steps is
+    timed with the torch threads left to the main process. Shared-memory workers are pinned to their own CPUs, and
+    torch in the main process gets the remaining ones, so that the two never oversubscribe the machine.
+    :param env_kwargs: keyword arguments of make_env
+    :param net_kwargs: keyword arguments of PreprocessNet, None to ignore the policy cost
+    :param train_env_num: number of training envs
+    :param test_env_num: number of test envs
+    :param backends: candidate backends, out of 'dummy', 'batched', 'shmem' and 'subproc'
+    :param duration: seconds spent timing each candidate
+    """
+    cpus = available_cpus()
+    candidates = []
+    for backend in backends:
+        if backend in ('shmem', 'subproc'):
+            # at least one CPU stays with the main process
+            max_workers = min(train_env_num, len(cpus) - 1)
+            worker_counts = sorted({w for w in (1, 2, 4, 8, 16, 32, 64, max_workers) if 1 <= w <= max_workers})
+            if backend == 'subproc':
+                worker_counts = [train_env_num] if train_env_num <= max_workers else []
+            candidates.extend((backend, w) for w in worker_counts)
+        else:
+            candidates.append((backend, None))
+
+    calibration, best = {}, None
+    for backend, num_workers in candidates:
+        torch_threads = len(cpus) - (num_workers or 0)
+        env_time = calibrate_env(env_kwargs, train_env_num, backend, num_workers, duration)
+        policy_time = 0. if net_kwargs is None else calibrate_policy(net_kwargs, 6, train_env_num, torch_threads,
+                                                                     duration)
+        steps_per_sec = train_env_num / (env_time + policy_time)
+        name = backend if num_workers is None else f'{backend}_{num_workers}'
+        calibration[f'{name}_steps_per_sec'] = steps_per_sec
+        if best is None or steps_per_sec > best[0]:
+            best = (steps_per_sec, backend, num_workers, torch_threads)
+
+    _, backend, num_workers, torch_threads = best
+    if num_workers is not None:
+        main_cpus = tuple(cpus[:torch_threads])
+        worker_cpus = tuple((cpu,) for cpu in cpus[torch_threads:torch_threads + num_workers])
+    else:
+        main_cpus, worker_cpus = tuple(cpus), None
+    return ParallelismPlan(backend=backend,
+                           train_env_num=train_env_num,
+                           test_env_num=test_env_num,
+                           num_workers=num_workers,
+                           torch_threads=torch_threads,
+                           main_cpus=main_cpus,
+                           worker_cpus=worker_cpus,
+                           calibration=calibration)
+
+
+def apply_plan(plan: ParallelismPlan) -> Callable[[], None]:
+    """
+    Set the torch intra-op threads and the CPU affinity of this process to those of plan. Both are process-wide, so
+    the returned function restores the previous ones, for the trials run after this one.
+    """
+    torch_threads = torch.get_num_threads()
+    cpus = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else None
+    torch.set_num_threads(plan.torch_threads)
+    if cpus is not None:
+        os.sched_setaffinity(0, plan.main_cpus)
+
+    def restore() -> None:
+        torch.set_num_threads(torch_threads)
+        if cpus is not None:
+            os.sched_setaffinity(0, cpus)
+    return restore
+
+
+def restore_after_run(trainer: BaseTrainer, restore: Callable[[], None] | None) -> BaseTrainer:
+    """
+    Call restore (e.g. returned by apply_plan) once trainer.run returns or raises, unless restore is None.
+    """
+    if restore is None:
+        return trainer
+    run = trainer.run
+
+    def run_and_restore():
+        try:
+            return run()
+        finally:
+            restore()
+    trainer.run = run_and_restore
+    return trainer
+
+
+def make_trial_envs(env_kwargs: Dict[str, Any],
+                    test_env_kwargs: Dict[str, Any] | None,
+                    backend: str,
+                    train_env_num: int,
+                    test_env_num: int,
+                    net_kwargs: Dict[str, Any] | None = None,
+                    logger: BaseLogger | None = None) -> Tuple[Any, Any, Callable[[], None] | None]:
+    """
+    Train and test vector envs of a trial. With backend='auto', the backend and worker layout come from
+    plan_parallelism; the plan is printed and written to the logger's TensorBoard run so that runs are explainable.
+    With test_env_num=0 (e.g. for a BatchedTestCollector), no test envs are made and None is returned for them.
+    The last value returned restores the torch threads and CPU affinity the plan changed (see restore_after_run),
+    or is None without a plan.
+    """
+    test_env_kwargs = env_kwargs if test_env_kwargs is None else test_env_kwargs
+    if backend != 'auto':
+        train_envs = make_vector_env(env_kwargs, num_envs=train_env_num, backend=backend)
+        test_envs = make_vector_env(test_env_kwargs, num_envs=test_env_num, backend=backend, seed_stride=50) \
+            if test_env_num else None
+        return train_envs, test_envs, None
+
+    plan = plan_parallelism(env_kwargs, net_kwargs, train_env_num, test_env_num)
+    restore = apply_plan(plan)
+    print(f'Parallelism plan:\n{plan.to_json()}')
+    if logger is not None and hasattr(logger, 'writer'):
+        logger.writer.add_text('parallelism_plan', f'```\n{plan.to_json()}\n```')
+    train_envs = make_vector_env(env_kwargs, num_envs=train_env_num, backend=plan.backend,
+                                 num_workers=plan.num_workers, worker_cpus=plan.worker_cpus)
+    # test collection never overlaps training collection, so the test workers share the same CPUs
+    test_workers = None if plan.num_workers is None else min(plan.num_workers, test_env_num)
+    test_cpus = None if plan.worker_cpus is None else plan.worker_cpus[:test_workers]
+    test_envs = make_vector_env(test_env_kwargs, num_envs=test_env_num, backend=plan.backend, seed_stride=50,
+                                num_workers=test_workers, worker_cpus=test_cpus) if test_env_num else None
+    return train_envs, test_envs, restore
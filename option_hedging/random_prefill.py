@@ -0,0 +1,117 @@
+import numpy as np
+from tianshou.data import Batch, ReplayBufferManager
+from option_hedging.gym_envs import BatchedOptionHedgingEnv
+from typing import Dict, Any, Callable
+
+
+def random_episodes(env_kwargs: Dict[str, Any],
+                    n_episodes: int,
+                    seed: int | tuple = 0,
+                    path_offset: int = 0,
+                    path_stride: int = 1) -> Dict[str, np.ndarray]:
+    """
+    n_episodes complete OptionHedgingEnv episodes under the uniform random policy, simulated side by side with
+    BatchedOptionHedgingEnv. Every array has shape (n_episodes, episode_length, ...), episode_length being the
+    T * rebalance_frequency - 1 steps of an episode; 'info' maps the env's info keys to such arrays.
+    :param env_kwargs: keyword arguments of make_env
+    :param n_episodes: number of episodes
+    :param seed: seed of the paths and of the actions
+    :param path_offset: index of the first path taken from env_kwargs['path_bank'], if any
+    :param path_stride: increment of the path index between episodes
+    """
+    env = BatchedOptionHedgingEnv(num_envs=n_episodes, seed=seed, path_offset=path_offset, path_stride=path_stride,
+                                  **env_kwargs)
+    # the paths and the actions get independent streams
+    action_rng = np.random.default_rng([*np.atleast_1d(seed), 1])
+    length = env.episode_length
+    obs = np.empty((n_episodes, length + 1, 6), dtype=np.float32)
+    if env.action_bins > 0:
+        act = action_rng.integers(env.action_bins, size=(n_episodes, length))
+    else:
+        act = action_rng.uniform(0, 1 + env.epsilon, size=(n_episodes, length, 1)).astype(np.float32)
+    rew = np.empty((n_episodes, length), dtype=np.float64)
+    terminated = np.empty((n_episodes, length), dtype=bool)
+    truncated = np.empty((n_episodes, length), dtype=bool)
+    info = {key: np.empty((n_episodes, length), dtype=np.float64) for key in env.info_keys}
+
+    obs[:, 0], _ = env.reset()
+    for t in range(length):
+        obs[:, t + 1], rew[:, t], terminated[:, t], truncated[:, t], step_info = env.step(act[:, t])
+        for key in env.info_keys:
+            info[key][:, t] = step_info[key]
+    assert terminated[:, -1].all() and not terminated[:, :-1].any()
+    return {
+        'obs': obs[:, :-1],
+        'act': act,
+        'rew': rew,
+        'terminated': terminated,
+        'truncated': truncated,
+        'obs_next': obs[:, 1:],
+        'info': info
+    }
+
+
+def random_prefill(buffer: ReplayBufferManager,
+                   n_step: int,
+                   env_kwargs: Dict[str, Any],
+                   seed: int = 0,
+                   map_action_inverse: Callable[[np.ndarray], np.ndarray] | None = None,
+                   path_offset: int | None = None) -> int:
+    """
+    Fill a VectorReplayBuffer with random-policy transitions, as Collector.collect(n_step, random=True) would, without
+    stepping envs one transition at a time: the episodes of each sub-buffer come from random_episodes and are written
+    into the buffer arrays in bulk. Every sub-buffer receives whole episodes, about n_step / buffer_num transitions of
+    them, up to its capacity, so that the training collector continues from an episode boundary. The prefill never
+    replays an episode of the training envs: its streams are seeded apart from those of make_vector_env, and it takes
+    the last paths of a path bank, which the training envs replay from the first one. Returns the number of
+    transitions written.
+    :param buffer: empty VectorReplayBuffer, with one sub-buffer per training env
+    :param n_step: number of transitions to write
+    :param env_kwargs: keyword arguments of make_env of the training envs
+    :param seed: seed of the transitions; sub-buffer k draws from the stream (seed, k, 1), which no [seed, seed_stride]
+    of make_vector_env shares
+    :param map_action_inverse: the policy's map_action_inverse, applied to the actions stored in the buffer as the
+    Collector does
+    :param path_offset: index of the first bank path of the prefill, sub-buffer k taking paths path_offset + k,
+    path_offset + k + buffer_num, ...; by default, the prefill ends at the last path of env_kwargs['path_bank']
+    """
+    assert isinstance(buffer, ReplayBufferManager) and len(buffer) == 0
+    buffer_num = buffer.buffer_num
+    length = env_kwargs['T'] * env_kwargs['rebalance_frequency'] - 1
+    n_episodes = [min(-(-(n_step // buffer_num + (k < n_step % buffer_num)) // length), child.maxsize // length)
+                  for k, child in enumerate(buffer.buffers)]
+    if path_offset is None:
+        # negative indices wrap around to the end of the bank
+        path_offset = -buffer_num * max(n_episodes) if env_kwargs.get('path_bank') is not None else 0
+    meta, written = None, 0
+    for k, child in enumerate(buffer.buffers):
+        if n_episodes[k] == 0:
+            continue
+        episodes = random_episodes(env_kwargs, n_episodes[k], seed=(seed, k, 1), path_offset=path_offset + k,
+                                   path_stride=buffer_num)
+        size = n_episodes[k] * length
+        transitions = {key: value.reshape(size, *value.shape[2:]) for key, value in episodes.items() if key != 'info'}
+        transitions['info'] = {key: value.reshape(size) for key, value in episodes['info'].items()}
+        transitions['info']['env_id'] = np.full(size, k)
+        if map_action_inverse is not None:
+            transitions['act'] = np.asarray(map_action_inverse(transitions['act']))
+        transitions['done'] = transitions['terminated'] | transitions['truncated']
+        if meta is None:
+            meta = Batch({key: (Batch({info_key: np.zeros((buffer.maxsize, *v.shape[1:]), dtype=v.dtype)
+                                       for info_key, v in value.items()}) if key == 'info' else
+                                np.zeros((buffer.maxsize, *value.shape[1:]), dtype=value.dtype))
+                          for key, value in transitions.items()}, policy=Batch())
+        offset = buffer._offset[k]
+        meta[offset:offset + size] = Batch(transitions)
+
+        # buffer pointers, as left by ReplayBuffer._add_index after the last (terminal) transition
+        child._index = size % child.maxsize
+        child._size = size
+        child.last_index = np.array([size - 1])
+        child._ep_rew, child._ep_len, child._ep_idx = 0., 0, child._index
+        buffer.last_index[k] = offset + size - 1
+        buffer._lengths[k] = size
+        written += size
+    if meta is not None:
+        buffer.set_batch(meta)
+    return written
@@ -0,0 +1,56 @@
+import numpy as np
+from tianshou.data import ReplayBuffer
+from option_hedging.gym_envs import reward_components, relabel_rewards
+from typing import Dict
+
+
+def _check_components(info) -> None:
+    missing = [key for key in ('transaction_fees', *reward_components) if key not in info]
+    if missing:
+        raise KeyError(f'Stored infos lack the reward components {missing}; they were collected before the envs '
+                       f'recorded them and cannot be relabeled')
+
+
+def relabel_buffer(buffer: ReplayBuffer, rho: float, transaction_fees: float | None = None) -> np.ndarray:
+    """
+    Recompute in place the rewards of every transition of a replay buffer (or VectorReplayBuffer) for risk aversion
+    rho and fee rate transaction_fees (the stored rates if None), so that an off-policy agent can be trained under
+    another reward without collecting its transitions again. The stored info reward and fee rate are updated too, so
+    that the buffer can be relabeled again later. Returns the rewards of the buffer's transitions, in buffer order.
+    :param buffer: replay buffer filled by OptionHedgingEnv-family envs
+    :param rho: risk aversion of the new rewards
+    :param transaction_fees: fee rate of the new rewards, the stored one if None
+    """
+    info = buffer.info
+    _check_components(info)
+    # the whole storage in one pass: the unused slots are zeros and relabel to zero rewards
+    rew = relabel_rewards(info, rho, transaction_fees).astype(buffer.rew.dtype, copy=False)
+    buffer.rew[:] = rew
+    # a CompactVectorReplayBuffer may store the reward components only
+    if 'reward' in info:
+        info.reward[:] = rew
+    if transaction_fees is not None:
+        info.transaction_fees[:] = transaction_fees
+    return rew[buffer.sample_indices(0)]
+
+
+def relabel_episodes(components: Dict[str, np.ndarray],
+                     rho: float | np.ndarray,
+                     transaction_fees: float | np.ndarray | None = None) -> np.ndarray:
+    """
+    Episode rewards of an evaluation set, e.g. from simulate_strategy(..., return_components=True), under every
+    combination of the given rho and transaction_fees values. Components have shape (n_episodes, episode_length);
+    the result has shape rho.shape + transaction_fees.shape + (n_episodes,).
+    :param components: per-step reward components and fee rates of the episodes
+    :param rho: risk aversion, or array of them
+    :param transaction_fees: fee rate, or array of them, the stored one if None
+    """
+    _check_components(components)
+    rho = np.asarray(rho, dtype=np.float64)
+    if transaction_fees is None:
+        rho = rho.reshape(rho.shape + (1, 1))
+    else:
+        transaction_fees = np.asarray(transaction_fees, dtype=np.float64)
+        rho = rho.reshape(rho.shape + (1,) * transaction_fees.ndim + (1, 1))
+        transaction_fees = transaction_fees.reshape(transaction_fees.shape + (1, 1))
+    return relabel_rewards(components, rho, transaction_fees).sum(axis=-1)
@@ -0,0 +1,169 @@
+import numpy as np
+from tianshou.data import Batch, VectorReplayBuffer
+from option_hedging.gym_envs import reward_components
+from typing import Dict, Any, Sequence, Tuple
+
+# info entries kept by default: those relabel_buffer recomputes the rewards from
+default_info_schema = {'transaction_fees': np.float32, **{key: np.float32 for key in reward_components}}
+
+
+class CompactVectorReplayBuffer(VectorReplayBuffer):
+    def __init__(self,
+                 total_size: int,
+                 buffer_num: int,
+                 episode_length: int,
+                 info_schema: Dict[str, Any] | None = None,
+                 episode_columns: Sequence[int] = (3,),
+                 step_columns: Sequence[int] = (1,)):
+        """
+        VectorReplayBuffer for the fixed-horizon episodes of OptionHedgingEnv, storing every observation once. Each
+        sub-buffer holds whole episodes of episode_length transitions at aligned slots (its size is rounded down to a
+        multiple of episode_length), so the next observation of a transition is the observation of the next slot, and
+        only the last one of each episode (and that of the episode being collected) is stored apart. The observation
+        columns constant over an episode (the strike) are stored once per episode and those depending only on the time
+        step (the remaining time) once per step, and the infos are reduced to the entries of info_schema, at its
+        dtypes. The other fields keep the dtypes the Collector adds them with, so sampled batches are the same as those
+        of a VectorReplayBuffer but for the dropped info entries; with float32 reward components (the default), a
+        relabeled reward differs from the env's by float32 rounding.
+
+        Episodes must be added from their first step and end with done exactly at episode_length: add raises
+        ValueError otherwise, e.g. for an on-policy collector whose buffer is reset in the middle of episodes.
+        :param total_size: capacity of the buffer
+        :param buffer_num: number of sub-buffers, one per training env
+        :param episode_length: number of transitions of every episode
+        :param info_schema: info entries to keep and their dtypes, the reward components by default, {} for none
+        :param episode_columns: observation columns constant over an episode
+        :param step_columns: observation columns depending only on the time step
+        """
+        size = int(np.ceil(total_size / buffer_num)) // episode_length * episode_length
+        assert size > 0, 'The sub-buffers must hold at least one episode'
+        super().__init__(size * buffer_num, buffer_num, ignore_obs_next=True)
+        self.episode_length = episode_length
+        self.info_schema = dict(default_info_schema if info_schema is None else info_schema)
+        self.episode_columns = list(episode_columns)
+        self.step_columns = list(step_columns)
+        # observation parts stored apart from _meta, allocated with it
+        self.tables: Dict[str, np.ndarray] = {}
+
+    def _varying_columns(self, obs_dim: int) -> list:
+        constant = set(self.episode_columns) | set(self.step_columns)
+        return [column for column in range(obs_dim) if column not in constant]
+
+    def _allocate_tables(self, obs_dim: int, dtype: np.dtype) -> None:
+        self.tables = {
+            'episode_obs': np.zeros((self.maxsize // self.episode_length, len(self.episode_columns)), dtype=dtype),
+            'step_obs': np.zeros((self.episode_length, len(self.step_columns)), dtype=dtype),
+            'step_filled': np.zeros(self.episode_length, dtype=bool),
+            # constant columns of the episode being added to every sub-buffer, which go to episode_obs once it is
+            # complete: until then, the slots after it in its row still hold a stored episode
+            'current_obs': np.zeros((self.buffer_num, len(self.episode_columns)), dtype=dtype),
+            # next observation of the last transition of every episode, and of the last one added to every sub-buffer
+            'final_obs': np.zeros((self.maxsize // self.episode_length, obs_dim), dtype=dtype),
+            'pending_obs': np.zeros((self.buffer_num, obs_dim), dtype=dtype)
+        }
+
+    def _compact(self, batch: Batch, obs: np.ndarray) -> Batch:
+        compact = Batch(obs=obs[..., self._varying_columns(obs.shape[-1])],
+                        act=batch.act,
+                        rew=batch.rew,
+                        terminated=batch.terminated,
+                        truncated=batch.truncated)
+        if 'done' in batch.keys():
+            compact.done = batch.done
+        if self.info_schema:
+            compact.info = Batch({key: np.asarray(batch.info[key], dtype=dtype)
+                                  for key, dtype in self.info_schema.items()})
+        if 'policy' in batch.keys() and not batch.policy.is_empty():
+            compact.policy = batch.policy
+        return compact
+
+    def add(self, batch: Batch, buffer_ids: np.ndarray | Sequence[int] | None = None):
+        buffer_ids = np.arange(self.buffer_num) if buffer_ids is None else np.asarray(buffer_ids)
+        obs, obs_next = np.asarray(batch.obs), np.asarray(batch.obs_next)
+        if not self.tables:
+            self._allocate_tables(obs.shape[-1], obs.dtype)
+        tables, length = self.tables, self.episode_length
+        # slots the transitions go to, checked before anything is written
+        ptrs = self._offset[buffer_ids] + np.array([self.buffers[k]._index for k in buffer_ids])
+        rows, t = ptrs // length, ptrs % length
+        first = np.array([self.buffers[k]._ep_len == 0 for k in buffer_ids])
+        done = np.logical_or(batch.terminated, batch.truncated)
+        episode_obs, step_obs = obs[:, self.episode_columns], obs[:, self.step_columns]
+        filled = tables['step_filled'][t]
+        if not (np.array_equal(first, t == 0) and np.array_equal(done, t == length - 1)):
+            raise ValueError(f'CompactVectorReplayBuffer stores whole episodes of {length} transitions, added from '
+                             f'their first step')
+        if not (np.array_equal(episode_obs[~first], tables['current_obs'][buffer_ids[~first]])
+                and np.array_equal(step_obs[filled], tables['step_obs'][t[filled]])):
+            raise ValueError('Observation columns declared constant over an episode or per step vary')
+
+        ptrs, ep_rew, ep_len, ep_idx = super().add(self._compact(batch, obs), buffer_ids)
+        tables['current_obs'][buffer_ids] = episode_obs
+        tables['episode_obs'][rows[done]] = episode_obs[done]
+        tables['step_obs'][t] = step_obs
+        tables['step_filled'][t] = True
+        tables['final_obs'][rows[done]] = obs_next[done]
+        tables['pending_obs'][buffer_ids] = obs_next
+        return ptrs, ep_rew, ep_len, ep_idx
+
+    def set_batch(self, batch: Batch) -> None:
+        """
+        Set the storage to batch, either in the compact layout (e.g. a checkpoint of _meta, whose tables are restored
+        separately) or in the full layout of a VectorReplayBuffer with obs_next, holding whole episodes at aligned
+        slots (e.g. from random_prefill), which is compacted.
+        """
+        if 'obs_next' in batch.keys():
+            obs, obs_next = np.asarray(batch.obs), np.asarray(batch.obs_next)
+            length = self.episode_length
+            self._allocate_tables(obs.shape[-1], obs.dtype)
+            self.tables['episode_obs'][:] = obs[::length, self.episode_columns]
+            self.tables['step_obs'][:] = obs[:length, self.step_columns]
+            self.tables['step_filled'][:] = True
+            self.tables['final_obs'][:] = obs_next[length - 1::length]
+            batch = self._compact(batch, obs)
+        super().set_batch(batch)
+
+    def _observations(self, indices: np.ndarray, buffer_ids: np.ndarray, last: np.ndarray) -> np.ndarray:
+        length = self.episode_length
+        obs_dim = self.tables['final_obs'].shape[1]
+        obs = np.empty((len(indices), obs_dim), dtype=self.tables['final_obs'].dtype)
+        obs[:, self._varying_columns(obs_dim)] = self._meta.obs[indices]
+        obs[:, self.episode_columns] = self.tables['episode_obs'][indices // length]
+        current = np.flatnonzero((indices // length == last // length) & (indices <= last) & ~self._meta.done[last])
+        obs[current[:, None], self.episode_columns] = self.tables['current_obs'][buffer_ids[current]]
+        obs[:, self.step_columns] = self.tables['step_obs'][indices % length]
+        return obs
+
+    def _decode(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # observations and next observations of the given slots
+        length = self.episode_length
+        buffer_ids = np.searchsorted(self._offset, indices, side='right') - 1
+        last = self.last_index[buffer_ids]
+        obs = self._observations(indices, buffer_ids, last)
+        last_step = indices % length == length - 1
+        obs_next = self._observations(np.where(last_step, indices, indices + 1), buffer_ids, last)
+        obs_next[last_step] = self.tables['final_obs'][indices[last_step] // length]
+        pending = (indices == last) & ~last_step
+        obs_next[pending] = self.tables['pending_obs'][buffer_ids[pending]]
+        return obs, obs_next
+
+    def __getitem__(self, index: slice | int | list[int] | np.ndarray) -> Batch:
+        if isinstance(index, slice):
+            indices = self.sample_indices(0) if index == slice(None) else self._indices[:len(self)][index]
+        else:
+            indices = index
+        batch = super().__getitem__(indices)
+        shape = np.shape(indices)
+        obs, obs_next = self._decode(np.asarray(indices).reshape(-1))
+        batch.obs, batch.obs_next = obs.reshape(*shape, -1), obs_next.reshape(*shape, -1)
+        return batch
+
+
+def make_replay_buffer(buffer_size: int, buffer_num: int, env_kwargs: Dict[str, Any],
+                       compact: bool = False) -> VectorReplayBuffer:
+    """
+    Replay buffer of the off-policy trials: a VectorReplayBuffer, or a CompactVectorReplayBuffer if compact.
+    """
+    if not compact:
+        return VectorReplayBuffer(buffer_size, buffer_num)
+    return CompactVectorReplayBuffer(buffer_size, buffer_num, env_kwargs['T'] * env_kwargs['rebalance_frequency'] - 1)
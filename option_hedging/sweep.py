@@ -0,0 +1,199 @@
+import os
+import copy
+import json
+import itertools
+import numpy as np
+import multiprocessing as mp
+from multiprocessing.managers import SyncManager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List, Sequence, NamedTuple
+
+
+class Uniform(NamedTuple):
+    low: float
+    high: float
+
+    def sample(self, rng: np.random.Generator) -> float:
+        return float(rng.uniform(self.low, self.high))
+
+
+class LogUniform(NamedTuple):
+    low: float
+    high: float
+
+    def sample(self, rng: np.random.Generator) -> float:
+        return float(np.exp(rng.uniform(np.log(self.low), np.log(self.high))))
+
+
+def set_nested(kwargs: Dict[str, Any], path: str, value: Any) -> None:
+    """
+    Set kwargs['a']['b'] = value for path 'a.b'.
+    """
+    *parents, key = path.split('.')
+    for parent in parents:
+        kwargs = kwargs[parent]
+    kwargs[key] = value
+
+
+def apply_overrides(base_kwargs: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    kwargs = copy.deepcopy(base_kwargs)
+    for path, value in overrides.items():
+        set_nested(kwargs, path, value)
+    return kwargs
+
+
+def grid_configs(space: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """
+    Every combination of the values in space, which maps dotted kwargs paths (e.g. 'net_kwargs.linear_dims',
+    'policy_kwargs.ent_coef', 'lr', 'trainer_kwargs.batch_size') to lists of values.
+    """
+    paths = list(space)
+    return [dict(zip(paths, values)) for values in itertools.product(*(space[path] for path in paths))]
+
+
+def random_configs(space: Dict[str, Sequence[Any] | Uniform | LogUniform],
+                   n_configs: int,
+                   seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    n_configs random configurations, drawing every path of space from its Uniform/LogUniform distribution or
+    uniformly from its list of values.
+    """
+    rng = np.random.default_rng(seed)
+    configs = []
+    for _ in range(n_configs):
+        config = {}
+        for path, values in space.items():
+            if isinstance(values, (Uniform, LogUniform)):
+                config[path] = values.sample(rng)
+            else:
+                config[path] = values[rng.integers(len(values))]
+        configs.append(config)
+    return configs
+
+
+class SuccessiveHalving:
+    def __init__(self, manager: SyncManager, grace_epochs: int = 1, reduction_factor: int = 3,
+                 max_epochs: int = 50):
+        """
+        Asynchronous successive halving (ASHA). Rungs sit at grace_epochs * reduction_factor^k epochs. A trial
+        reaching a rung records its test reward there and continues only if the reward is in the top
+        1/reduction_factor of all rewards recorded at that rung so far. The records live in a Manager, so trials in
+        different processes decide against each other without waiting for a full bracket.
+        """
+        assert grace_epochs >= 1 and reduction_factor >= 2
+        self.reduction_factor = reduction_factor
+        self.rungs = []
+        epochs = grace_epochs
+        while epochs < max_epochs:
+            self.rungs.append(epochs)
+            epochs *= reduction_factor
+        self.records = manager.dict({rung: manager.list() for rung in self.rungs})
+        self.lock = manager.Lock()
+
+    def report(self, epoch: int, reward: float) -> bool:
+        """
+        Record the test reward of a trial after epoch, and whether it should keep training.
+        """
+        if epoch not in self.rungs:
+            return True
+        with self.lock:
+            records = self.records[epoch]
+            records.append(reward)
+            cutoff = np.percentile(list(records), (1 - 1 / self.reduction_factor) * 100)
+        return reward >= cutoff
+
+
+def run_trial(model: str,
+              kwargs: Dict[str, Any],
+              log_dir: str,
+              torch_threads: int,
+              scheduler: SuccessiveHalving | None = None) -> Dict[str, Any]:
+    """
+    Train one configuration epoch by epoch in the calling process, reporting the test reward to the scheduler
+    after every epoch and stopping as soon as it says so.
+    """
+    import torch
+    from config import load_trainer
+    torch.set_num_threads(torch_threads)
+    trainer = load_trainer(model)(log_dir=log_dir, **kwargs)
+    rewards, stopped = [], False
+    for epoch_stat in trainer:
+        test_stat = epoch_stat.test_collect_stat
+        reward = epoch_stat.info_stat.best_reward if test_stat is None else float(test_stat.returns_stat.mean)
+        rewards.append(reward)
+        if scheduler is not None and not scheduler.report(epoch_stat.epoch, reward):
+            stopped = True
+            break
+    trainer.train_collector.env.close()
+    trainer.test_collector.env.close()
+    return {
+        'rewards': rewards,
+        'best_reward': max(rewards) if rewards else None,
+        'epochs': len(rewards),
+        'stopped_early': stopped
+    }
+
+
+def run_sweep(model: str,
+              base_kwargs: Dict[str, Any],
+              configs: List[Dict[str, Any]],
+              sweep_dir: str,
+              n_parallel: int | None = None,
+              backend: str = 'batched',
+              grace_epochs: int | None = 1,
+              reduction_factor: int = 3) -> List[Dict[str, Any]]:
+    """
+    Train every configuration in a process pool of n_parallel trials. Trial k writes its TensorBoard run to
+    sweep_dir/trial_k and gets cpu_count // n_parallel torch threads. Its envs run in-process on the given
+    backend, since pool workers should not fork env workers of their own. With grace_epochs set, poor
+    configurations are stopped early by SuccessiveHalving on the test reward. A results.jsonl line is appended as
+    each trial finishes.
+    :param model: name of the model in config.options
+    :param base_kwargs: kwargs of the trial function the configs are applied to
+    :param configs: overrides of each trial, from grid_configs or random_configs
+    :param sweep_dir: directory of the trial log directories and results
+    :param n_parallel: number of concurrent trials, the CPU count by default
+    :param backend: vector env backend of the trials, 'dummy' or 'batched'
+    :param grace_epochs: epochs of the first successive halving rung, None to train every trial to the end
+    :param reduction_factor: fraction (1/reduction_factor) of the trials kept at each rung
+    """
+    assert backend in ('dummy', 'batched')
+    cpus = os.cpu_count() or 1
+    n_parallel = min(cpus if n_parallel is None else n_parallel, len(configs))
+    torch_threads = max(1, cpus // n_parallel)
+    os.makedirs(sweep_dir, exist_ok=True)
+    results = []
+    with mp.Manager() as manager, ProcessPoolExecutor(max_workers=n_parallel) as pool:
+        scheduler = None
+        if grace_epochs is not None:
+            scheduler = SuccessiveHalving(manager, grace_epochs, reduction_factor,
+                                          base_kwargs['trainer_kwargs']['max_epoch'])
+        futures = {}
+        for k, overrides in enumerate(configs):
+            kwargs = apply_overrides(base_kwargs, overrides)
+            kwargs['backend'] = backend
+            log_dir = os.path.join(sweep_dir, f'trial_{k:04d}')
+            future = pool.submit(run_trial, model, kwargs, log_dir, torch_threads, scheduler)
+            futures[future] = {'trial': k, 'config': overrides, 'log_dir': log_dir}
+        for future in as_completed(futures):
+            result = {**futures[future], **future.result()}
+            results.append(result)
+            with open(os.path.join(sweep_dir, 'results.jsonl'), 'a') as f:
+                f.write(json.dumps(result, default=str) + '\n')
+    return sorted(results, key=lambda result: result['trial'])
+
+
+if __name__ == '__main__':
+    from config import options
+    space = {
+        'lr': LogUniform(1e-4, 1e-2),
+        'net_kwargs.linear_dims': [(64, 64), (128, 64), (256, 128, 64)],
+        'policy_kwargs.ent_coef': LogUniform(1e-4, 1e-2),
+        'trainer_kwargs.batch_size': [32, 64, 128]
+    }
+    sweep_results = run_sweep('ppo', options['ppo']['kwargs'], random_configs(space, n_configs=100),
+                              sweep_dir=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                     '.logs', 'sweep_ppo'))
+    for sweep_result in sorted(sweep_results, key=lambda r: -np.inf if r['best_reward'] is None else r['best_reward'],
+                               reverse=True)[:5]:
+        print(sweep_result)
@@ -0,0 +1,254 @@
+import os
+import sys
+import traceback
+import numpy as np
+import gymnasium as gym
+import multiprocessing as mp
+from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import RawArray
+from tianshou.env import SubprocVectorEnv, DummyVectorEnv
+from tianshou.env.worker.subproc import CloudpickleWrapper
+from option_hedging.gym_envs import BatchedOptionHedgingEnv, make_env
+from typing import Dict, Any, List, Tuple, Callable, Sequence
+
+vector_env_backends = ('dummy', 'subproc', 'batched', 'shmem')
+
+_ctypes = {np.dtype(np.float32): 'f', np.dtype(np.float64): 'd', np.dtype(np.int64): 'q', np.dtype(np.bool_): 'b'}
+
+
+def _shared_array(shape: Tuple[int, ...], dtype: np.dtype) -> Tuple[Any, np.dtype, Tuple[int, ...]]:
+    dtype = np.dtype(dtype)
+    return RawArray(_ctypes[dtype], int(np.prod(shape))), dtype, shape
+
+
+def _as_array(raw: Any, dtype: np.dtype, shape: Tuple[int, ...]) -> np.ndarray:
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _shared_memory_worker(conn: Connection,
+                          env_fns: CloudpickleWrapper,
+                          env_ids: List[int],
+                          buffers: Dict[str, Tuple[Any, np.dtype, Tuple[int, ...]]],
+                          info_keys: Tuple[str, ...],
+                          cpus: Sequence[int] | None = None) -> None:
+    if cpus is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    if 'torch' in sys.modules:
+        # inherited from a parent that imported torch: keep the worker from spawning its own thread pool
+        sys.modules['torch'].set_num_threads(1)
+    envs = dict(zip(env_ids, (env_fn() for env_fn in env_fns.data)))
+    arrays = {name: _as_array(*buffer) for name, buffer in buffers.items()}
+    action, obs, rew, info = arrays['action'], arrays['obs'], arrays['rew'], arrays['info']
+    terminated, truncated = arrays['terminated'], arrays['truncated']
+
+    def write_info(i, env_info):
+        for j, key in enumerate(info_keys):
+            info[i, j] = env_info[key]
+
+    try:
+        while True:
+            command, ids, payload = conn.recv()
+            result = None
+            if command == 'step':
+                for i in ids:
+                    obs[i], rew[i], terminated[i], truncated[i], env_info = envs[i].step(action[i])
+                    write_info(i, env_info)
+            elif command == 'reset':
+                for i in ids:
+                    obs[i], env_info = envs[i].reset(**payload)
+                    rew[i], terminated[i], truncated[i] = 0, False, False
+                    write_info(i, env_info)
+            elif command == 'seed':
+                result = [envs[i].seed(seed) for i, seed in zip(ids, payload)]
+            elif command == 'getattr':
+                result = [getattr(envs[i], payload) for i in ids]
+            elif command == 'setattr':
+                for i, (key, value) in zip(ids, payload):
+                    setattr(envs[i].unwrapped, key, value)
+            elif command == 'close':
+                for env in envs.values():
+                    env.close()
+                conn.send(None)
+                break
+            conn.send(result)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        conn.send(RuntimeError(traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class SharedMemoryVectorEnv:
+    def __init__(self,
+                 env_fns: Sequence[Callable[[], gym.Env]],
+                 num_workers: int | None = None,
+                 info_keys: Sequence[str] = BatchedOptionHedgingEnv.info_keys,
+                 worker_cpus: Sequence[Sequence[int]] | None = None):
+        """
+        Subprocess vector env exchanging data through shared memory. Each worker process owns a contiguous block of
+        environments and writes their observation, reward, done flags and info straight into preallocated shared
+        arrays; only a (command, env ids) message and an empty acknowledgement cross the pipe. The info dict of every
+        environment must contain the float entries info_keys, which is the fixed schema the arrays are laid out for.
+        Implements the interface of tianshou's BaseVectorEnv like BatchedOptionHedgingEnv.
+        :param env_fns: environment constructors, e.g. from make_env
+        :param num_workers: number of worker processes, one per environment by default (capped at the CPU count)
+        :param info_keys: info entries copied back from the environments
+        :param worker_cpus: CPUs each worker process is pinned to, one entry per worker
+        """
+        self.env_num = len(env_fns)
+        self.is_async = False
+        self.is_closed = False
+        self.info_keys = tuple(info_keys)
+        num_workers = min(self.env_num, os.cpu_count() or 1) if num_workers is None else num_workers
+        assert 1 <= num_workers <= self.env_num
+        assert worker_cpus is None or len(worker_cpus) == num_workers
+
+        probe = env_fns[0]()
+        self.observation_space = [probe.observation_space] * self.env_num
+        probe.close()
+        buffers = {
+            'action': _shared_array((self.env_num, *probe.action_space.shape), probe.action_space.dtype),
+            'obs': _shared_array((self.env_num, *probe.observation_space.shape), probe.observation_space.dtype),
+            'rew': _shared_array((self.env_num,), np.float64),
+            'terminated': _shared_array((self.env_num,), np.bool_),
+            'truncated': _shared_array((self.env_num,), np.bool_),
+            'info': _shared_array((self.env_num, len(self.info_keys)), np.float64)
+        }
+        arrays = {name: _as_array(*buffer) for name, buffer in buffers.items()}
+        self._action, self._obs, self._rew = arrays['action'], arrays['obs'], arrays['rew']
+        self._terminated, self._truncated, self._info = arrays['terminated'], arrays['truncated'], arrays['info']
+
+        self.worker_ids = [block.tolist() for block in np.array_split(np.arange(self.env_num), num_workers)]
+        self._worker_of = np.repeat(np.arange(num_workers), [len(block) for block in self.worker_ids])
+        self.conns, self.processes = [], []
+        for w, env_ids in enumerate(self.worker_ids):
+            parent_conn, child_conn = mp.Pipe()
+            process = mp.Process(target=_shared_memory_worker,
+                                 args=(child_conn, CloudpickleWrapper([env_fns[i] for i in env_ids]), env_ids,
+                                       buffers, self.info_keys, None if worker_cpus is None else worker_cpus[w]),
+                                 daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+        # one space per env, as seeded by its constructor in the worker
+        self.action_space = self.get_env_attr('action_space')
+
+    def __len__(self) -> int:
+        return self.env_num
+
+    def _wrap_id(self, id: int | Sequence[int] | np.ndarray | None) -> np.ndarray:
+        if id is None:
+            return np.arange(self.env_num)
+        return np.atleast_1d(np.asarray(id, dtype=np.int64))
+
+    def _dispatch(self, command: str, ids: np.ndarray, payload: Any = None) -> List[Any]:
+        # send to every worker first so that they run concurrently, then wait for all of them
+        assert not self.is_closed
+        workers = np.unique(self._worker_of[ids])
+        for w in workers:
+            mask = self._worker_of[ids] == w
+            worker_payload = [payload[k] for k in np.flatnonzero(mask)] if command in ('seed', 'setattr') else payload
+            self.conns[w].send((command, ids[mask].tolist(), worker_payload))
+        results = []
+        for w in workers:
+            result = self.conns[w].recv()
+            if isinstance(result, Exception):
+                raise result
+            if result is not None:
+                results.extend(result)
+        return results
+
+    def _info_dict(self, ids: np.ndarray) -> Dict[str, np.ndarray]:
+        info = self._info[ids]
+        return {**{key: info[:, j] for j, key in enumerate(self.info_keys)}, 'env_id': ids}
+
+    def seed(self, seed: int | Sequence[int] | None = None) -> List[Any]:
+        ids = np.arange(self.env_num)
+        if seed is None or np.isscalar(seed):
+            seeds = [None if seed is None else seed + i for i in ids]
+        else:
+            seeds = list(seed)
+        return self._dispatch('seed', ids, seeds)
+
+    def get_env_attr(self, key: str, id: int | Sequence[int] | np.ndarray | None = None) -> List[Any]:
+        return self._dispatch('getattr', self._wrap_id(id), key)
+
+    def set_env_attr(self, key: str, value: Any, id: int | Sequence[int] | np.ndarray | None = None) -> None:
+        ids = self._wrap_id(id)
+        self._dispatch('setattr', ids, [(key, value)] * len(ids))
+
+    def reset(self, id: int | Sequence[int] | np.ndarray | None = None, **kwargs) -> Tuple[np.ndarray, Dict]:
+        ids = self._wrap_id(id)
+        self._dispatch('reset', ids, kwargs)
+        return self._obs[ids], self._info_dict(ids)
+
+    def step(self,
+             action: np.ndarray,
+             id: int | Sequence[int] | np.ndarray | None = None
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, Dict]:
+        ids = self._wrap_id(id)
+        self._action[ids] = np.asarray(action).reshape(self._action[ids].shape)
+        self._dispatch('step', ids)
+        # fancy indexing copies, so the returned arrays survive the next step
+        return self._obs[ids], self._rew[ids], self._terminated[ids], self._truncated[ids], self._info_dict(ids)
+
+    def render(self, **kwargs) -> List[None]:
+        return [None] * self.env_num
+
+    def close(self) -> None:
+        if self.is_closed:
+            return
+        for conn in self.conns:
+            try:
+                conn.send(('close', [], None))
+                conn.recv()
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.is_closed = True
+
+    def __del__(self) -> None:
+        if hasattr(self, 'processes'):
+            self.close()
+
+
+def make_vector_env(env_kwargs: Dict[str, Any],
+                    num_envs: int,
+                    backend: str = 'dummy',
+                    seed: int = 0,
+                    seed_stride: int = 1,
+                    num_workers: int | None = None,
+                    worker_cpus: Sequence[Sequence[int]] | None = None
+                    ) -> DummyVectorEnv | SubprocVectorEnv | BatchedOptionHedgingEnv | SharedMemoryVectorEnv:
+    """
+    Build a vectorised OptionHedgingEnv for a tianshou Collector.
+    :param env_kwargs: keyword arguments of make_env
+    :param num_envs: number of environments (paths for the batched backend)
+    :param backend: 'dummy', 'subproc', 'batched' or 'shmem'
+    :param seed: seed of the environments
+    :param seed_stride: the episodes are drawn from the counter-based streams of the run seed (seed, seed_stride), so
+    that train and test envs get different streams, and environment k plays episodes k, k + num_envs, ... (see
+    OptionHedgingEnv): every backend plays the same episodes. The action space of environment k is seeded with
+    seed + k * seed_stride
+    :param num_workers: worker processes of the shmem backend
+    :param worker_cpus: CPUs each shmem worker is pinned to
+    """
+    assert backend in vector_env_backends, f'Unknown backend {backend}. Choose from {vector_env_backends}.'
+    if backend == 'batched':
+        envs = BatchedOptionHedgingEnv(num_envs=num_envs, seed=[seed, seed_stride], **env_kwargs)
+        # the Collector samples random (e.g. buffer prefill) actions from these spaces
+        for k in range(num_envs):
+            envs.action_space[k].seed(seed + k * seed_stride)
+        return envs
+    # interleave the episodes (and the bank's paths) over the workers, and seed the action spaces where they live
+    env_fns = [make_env(seed=[seed, seed_stride], path_offset=k, path_stride=num_envs,
+                        action_seed=seed + k * seed_stride, **env_kwargs)
+               for k in range(num_envs)]
+    if backend == 'shmem':
+        return SharedMemoryVectorEnv(env_fns, num_workers=num_workers, worker_cpus=worker_cpus)
+    if backend == 'subproc':
+        return SubprocVectorEnv(env_fns)
+    return DummyVectorEnv(env_fns)
@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import platform
+import numpy as np
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Tuple
+
+root = Path(os.path.abspath(__file__)).parent.parent.absolute()
+default_baseline_path = os.path.join(root, 'perf', 'baselines.json')
+
+# name -> (factory returning (fn, items per call), regression threshold, whether it runs worker processes)
+registry: Dict[str, Tuple[Callable[[], Tuple[Callable[[], Any], int]], float, bool]] = {}
+# resources (worker processes) to release once the running benchmark is done
+_cleanup: List[Callable[[], Any]] = []
+
+env_kwargs = {
+    'epsilon': 0.01,
+    'sigma': 0.15,
+    'rho': 0.02,
+    'action_bins': 20,
+    'T': 1,
+    'rebalance_frequency': 12
+}
+net_kwargs = {
+    'linear_dims': (256, 128, 64),
+    'residual_dims': None,
+    'activation_fn': 'relu',
+    'norm_layer': True
+}
+
+
+def benchmark(name: str, threshold: float = 0.3, multiprocess: bool = False) -> Callable:
+    """
+    Register a benchmark. The decorated factory builds its fixtures and returns the function to time, with the
+    number of items (steps, paths, samples) one call processes. A run regresses when its time per call exceeds the
+    baseline by more than threshold (relative). The baseline of a multiprocess benchmark, whose workers compete for
+    the CPUs, records the number of CPUs it was measured with, and is only compared on a host with as many.
+    """
+    def register(factory: Callable[[], Tuple[Callable[[], Any], int]]) -> Callable:
+        registry[name] = (factory, threshold, multiprocess)
+        return factory
+    return register
+
+
+def time_call(fn: Callable[[], Any], min_time: float = 0.2, repeat: int = 5) -> float:
+    """
+    Best-of-repeat mean seconds per call, each repeat running fn for at least min_time seconds.
+    """
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_time / elapsed * 1.2))
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def _make_env():
+    from option_hedging.gym_envs import make_env
+    env = make_env(seed=0, **env_kwargs)()
+    env.reset()
+    return env
+
+
+@benchmark('env.reset')
+def _env_reset():
+    env = _make_env()
+    return env.reset, 1
+
+
+@benchmark('env.step')
+def _env_step():
+    env = _make_env()
+
+    def step():
+        _, _, terminated, truncated, _ = env.step(10)
+        if terminated or truncated:
+            env.reset()
+    return step, 1
+
+
+def _book_env_step(n_options: int):
+    from option_hedging.gym_envs import BookHedgingEnv
+    env = BookHedgingEnv(n_options=n_options, **env_kwargs)
+    env.seed(0)
+    env.reset()
+
+    def step():
+        _, _, terminated, truncated, _ = env.step(10)
+        if terminated or truncated:
+            env.reset()
+    return step, 1
+
+
+for _n_options in (1, 1000, 10000):
+    benchmark(f'book_env.step_{_n_options}')(lambda n_options=_n_options: _book_env_step(n_options))
+
+
+def _make_history():
+    from utils.history import History
+    history = History(max_size=12)
+    history.set(reward=0., portfolio_value=0., stock_held=0.5, stock_price=100.)
+    for _ in range(11):
+        history.add(reward=0., portfolio_value=0., stock_held=0.5, stock_price=100.)
+    return history
+
+
+@benchmark('history.add')
+def _history_add():
+    history = _make_history()
+    return lambda: history.add(reward=0., portfolio_value=0., stock_held=0.5, stock_price=100.), 1
+
+
+@benchmark('history.getitem')
+def _history_getitem():
+    history = _make_history()
+    return lambda: history['portfolio_value', -1], 1
+
+
+@benchmark('history.row')
+def _history_row():
+    history = _make_history()
+    return lambda: history[-1], 1
+
+
+def _make_portfolio():
+    from utils.portfolio import SimplePortfolio
+    portfolio = SimplePortfolio(strike_price=100, expiry_time=1, dt=1/12)
+    portfolio.init(0.15)
+    prices = itertools.cycle((100 * np.exp(np.linspace(-0.1, 0.1, 1000))).tolist())
+    return portfolio, prices
+
+
+@benchmark('portfolio.black_scholes_hedge')
+def _portfolio_hedge():
+    portfolio, prices = _make_portfolio()
+
+    def hedge():
+        # a new price on every call, so that the greeks cache misses as in the env
+        portfolio.stock_price = next(prices)
+        return portfolio.black_scholes_hedge(0.15)
+    return hedge, 1
+
+
+@benchmark('portfolio.valuation')
+def _portfolio_valuation():
+    portfolio, prices = _make_portfolio()
+
+    def valuation():
+        portfolio.stock_price = next(prices)
+        portfolio.black_scholes_hedge(0.15)
+        portfolio.option_valuation(0.15)
+        return portfolio.portfolio_valuation(0.15)
+    return valuation, 1
+
+
+@benchmark('black_scholes.batch_65536')
+def _black_scholes_batch():
+    from utils.black_scholes import black_scholes
+    rng = np.random.default_rng(0)
+    stock_price = 100 * np.exp(rng.normal(0, 0.1, 65536))
+    remaining_time = rng.uniform(0, 1, 65536)
+    return lambda: black_scholes(stock_price, 100., remaining_time, 0.15), 65536
+
+
+def _forward(net_class: str, batch_size: int):
+    import torch
+    from utils.torch_modules import PreprocessNet, QNet
+    if net_class == 'QNet':
+        net = QNet(state_shape=(6,), action_shape=20, device='cpu', **net_kwargs)
+    else:
+        net = PreprocessNet(state_shape=(6,), device='cpu', **net_kwargs)
+    net.eval()
+    obs = np.zeros((batch_size, 6), dtype=np.float32)
+
+    def forward():
+        with torch.no_grad():
+            return net(obs)
+    return forward, batch_size
+
+
+for _batch_size in (1, 32, 256, 1024):
+    for _net_class in ('PreprocessNet', 'QNet'):
+        benchmark(f'{_net_class}.forward_{_batch_size}')(
+            lambda net_class=_net_class, batch_size=_batch_size: _forward(net_class, batch_size))
+
+
+def _collect(backend: str, num_envs: int, n_step: int = 960):
+    import torch
+    from tianshou.data import Collector, VectorReplayBuffer
+    from tianshou.policy import DQNPolicy
+    from option_hedging.vector_envs import make_vector_env
+    from utils.torch_modules import QNet
+    envs = make_vector_env(env_kwargs, num_envs=num_envs, backend=backend)
+    _cleanup.append(envs.close)
+    net = QNet(state_shape=(6,), action_shape=env_kwargs['action_bins'], device='cpu', **net_kwargs)
+    policy = DQNPolicy(model=net, optim=torch.optim.Adam(net.parameters()), action_space=envs.action_space[0])
+    policy.eval()
+    collector = Collector(policy, envs, VectorReplayBuffer(10 * n_step, num_envs))
+    collector.reset()
+    return lambda: collector.collect(n_step=n_step), n_step
+
+
+for _backend in ('dummy', 'subproc', 'shmem', 'batched'):
+    for _num_envs in (1, 4, 16):
+        benchmark(f'collect.{_backend}_{_num_envs}', threshold=0.5, multiprocess=_backend in ('subproc', 'shmem'))(
+            lambda backend=_backend, num_envs=_num_envs: _collect(backend, num_envs))
+
+
+def _hedge(runtime: str, batch_size: int):
+    import torch
+    from tianshou.data import Batch
+    from tianshou.policy import DQNPolicy
+    from option_hedging.export import export_policy
+    from option_hedging.gym_envs import make_spaces
+    from utils.torch_modules import QNet
+    net = QNet(state_shape=(6,), action_shape=env_kwargs['action_bins'], device='cpu', **net_kwargs)
+    action_space, _ = make_spaces(env_kwargs['epsilon'], env_kwargs['action_bins'], env_kwargs['T'])
+    policy = DQNPolicy(model=net, optim=torch.optim.Adam(net.parameters()), action_space=action_space)
+    policy.eval()
+    obs = 100 * np.random.default_rng(0).random((batch_size, 6), dtype=np.float32)
+    if runtime == 'policy':
+        batch = Batch(obs=obs, info={})
+
+        def hedge():
+            with torch.no_grad():
+                return policy.map_action(policy(batch).act)
+        return hedge, batch_size
+    hedger = export_policy(policy, env_kwargs)
+    if runtime == 'torchscript':
+        scripted, obs = hedger.to_torchscript(), torch.as_tensor(obs)
+        return lambda: scripted.hedge(obs), batch_size
+    return lambda: hedger.hedge(obs), batch_size
+
+
+for _batch_size in (1, 10, 100, 1000, 10000):
+    for _runtime in ('policy', 'numpy', 'torchscript'):
+        benchmark(f'hedge.{_runtime}_{_batch_size}')(
+            lambda runtime=_runtime, batch_size=_batch_size: _hedge(runtime, batch_size))
+
+
+def cpu_count() -> int:
+    """
+    Number of CPUs this process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def host_info() -> Dict[str, Any]:
+    import torch
+    return {
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'torch': torch.__version__
+    }
+
+
+def run_benchmarks(names: List[str]) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name in names:
+        factory, _, _ = registry[name]
+        fn, items = factory()
+        seconds = time_call(fn)
+        while _cleanup:
+            _cleanup.pop()()
+        results[name] = {'seconds': seconds, 'items_per_sec': items / seconds}
+        print(f'{name:<36}{seconds * 1e6:>12.2f} us{items / seconds:>16.0f} items/s')
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baselines: Dict[str, Any]) -> List[str]:
+    """
+    Benchmarks slower than their baseline by more than their threshold. Multiprocess benchmarks whose baseline was
+    measured with a different number of CPUs than this host's are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines['results'].get(name)
+        if baseline is None:
+            continue
+        if 'cpu_count' in baseline and baseline['cpu_count'] != cpu_count():
+            print(f'Skipping {name}: its baseline was measured with {baseline["cpu_count"]} CPUs, '
+                  f'this host has {cpu_count()}')
+            continue
+        ratio = result['seconds'] / baseline['seconds']
+        if ratio > 1 + baseline['threshold']:
+            regressions.append(f'{name}: {ratio:.2f}x the baseline (threshold {1 + baseline["threshold"]:.2f}x)')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Speed benchmarks of the environment and training hot path.')
+    parser.add_argument('filters', nargs='*', help='only run benchmarks whose name starts with one of these')
+    parser.add_argument('--baseline', default=default_baseline_path)
+    parser.add_argument('--update', action='store_true', help='store the results as the new baselines')
+    args = parser.parse_args()
+
+    names = [name for name in registry if not args.filters or any(name.startswith(f) for f in args.filters)]
+    results = run_benchmarks(names)
+
+    baselines = {'host': host_info(), 'results': {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.update:
+        for name, result in results.items():
+            baselines['results'][name] = {'seconds': result['seconds'], 'threshold': registry[name][1]}
+            if registry[name][2]:
+                baselines['results'][name]['cpu_count'] = cpu_count()
+        baselines['host'] = host_info()
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        return
+    if baselines['host'] != host_info():
+        print(f"Baselines were recorded on a different host: {baselines['host']}")
+    regressions = compare(results, baselines)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
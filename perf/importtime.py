@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, Tuple, List
+
+root = Path(os.path.abspath(__file__)).parent.parent.absolute()
+default_budget_path = os.path.join(root, 'perf', 'import_budget.json')
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """
+    Cumulative import time of module in milliseconds, measured with python -X importtime in a fresh interpreter,
+    and the modules it left in sys.modules.
+    """
+    code = f'import {module}, sys, json; print(json.dumps(sorted(sys.modules)))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=root, capture_output=True,
+                            text=True, env={**os.environ, 'PYTHONPATH': str(root)}, check=True)
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # top-level entries are not indented
+        if name.rstrip() == f' {module}':
+            cumulative_us = int(cumulative)
+    if cumulative_us is None:
+        raise RuntimeError(f'{module} was already imported at interpreter startup')
+    return cumulative_us / 1000, json.loads(result.stdout.splitlines()[-1])
+
+
+def check_budget(budget: Dict[str, Dict[str, Any]], runs: int = 5) -> Dict[str, Dict[str, Any]]:
+    """
+    Best-of-runs import time of every module in budget against its budget_ms, and the forbidden packages it loads.
+    """
+    report = {}
+    for module, limits in budget.items():
+        timings, loaded = [], []
+        for _ in range(runs):
+            elapsed, loaded = measure_import(module)
+            timings.append(elapsed)
+        forbidden = [name for name in limits.get('forbidden', [])
+                     if any(m == name or m.startswith(f'{name}.') for m in loaded)]
+        report[module] = {
+            'time_ms': min(timings),
+            'budget_ms': limits['budget_ms'],
+            'forbidden_loaded': forbidden,
+            'ok': min(timings) <= limits['budget_ms'] and not forbidden
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Import-time budget of the entry point and the env workers.')
+    parser.add_argument('--budget', default=default_budget_path)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    with open(args.budget) as f:
+        budget = json.load(f)
+    report = check_budget(budget, runs=args.runs)
+    for module, entry in report.items():
+        status = 'ok' if entry['ok'] else 'FAIL'
+        print(f"{module:<32}{entry['time_ms']:>9.1f} ms / {entry['budget_ms']} ms  {status}")
+        if entry['forbidden_loaded']:
+            print(f"    imports forbidden packages: {', '.join(entry['forbidden_loaded'])}")
+    sys.exit(0 if all(entry['ok'] for entry in report.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import copy
+import pytest
+from config import options
+from typing import Dict, Any, Callable
+
+
+@pytest.fixture
+def trial_kwargs() -> Callable[..., Dict[str, Any]]:
+    """
+    Keyword arguments of a short trial of a config.py model: a few hundred steps on 4 dummy envs, without progress
+    output. The returned function takes the model, the log directory, the number of epochs and overrides of the trial
+    arguments (env_kwargs entries go to the env config).
+    """
+    def make(model: str, log_dir: str, max_epoch: int = 1, env_kwargs: Dict[str, Any] | None = None,
+             **extra) -> Dict[str, Any]:
+        kwargs = copy.deepcopy(options[model]['kwargs'])
+        kwargs['trainer_kwargs'].update(max_epoch=max_epoch, step_per_epoch=200, step_per_collect=100, batch_size=16,
+                                        episode_per_test=5, verbose=False, show_progress=False)
+        kwargs['env_kwargs'].update(env_kwargs or {})
+        kwargs.update(buffer_size=484, backend='dummy', train_env_num=4, log_dir=log_dir)
+        if 'epsilon_greedy' in kwargs:
+            kwargs['epsilon_greedy']['max_steps'] = 400
+        kwargs.update(extra)
+        return kwargs
+    return make
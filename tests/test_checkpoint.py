@@ -0,0 +1,22 @@
+import pytest
+import torch
+from config import load_trainer
+
+
+@pytest.mark.parametrize('model, backend', [('ppo', 'dummy'), ('dqn', 'dummy'), ('ppo', 'subproc')])
+def test_resume_is_exact(model, backend, tmp_path, trial_kwargs):
+    trial = load_trainer(model)
+    straight = trial(**trial_kwargs(model, str(tmp_path / 'straight'), 3, backend=backend))
+    straight_info = straight.run()
+    trial(**trial_kwargs(model, str(tmp_path / 'resumed'), 2, backend=backend)).run()
+    resumed = trial(**trial_kwargs(model, str(tmp_path / 'resumed'), 3, backend=backend, resume=True))
+    resumed_info = resumed.run()
+
+    expected, actual = straight.policy.state_dict(), resumed.policy.state_dict()
+    assert expected.keys() == actual.keys()
+    for key in expected:
+        assert torch.equal(expected[key], actual[key]), key
+    assert (resumed.epoch, resumed.env_step, resumed._gradient_step) == \
+           (straight.epoch, straight.env_step, straight._gradient_step)
+    assert (resumed.best_epoch, resumed.best_reward) == (straight.best_epoch, straight.best_reward)
+    assert (resumed_info.train_step, resumed_info.test_step) == (straight_info.train_step, straight_info.test_step)
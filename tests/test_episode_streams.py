@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from option_hedging.gym_envs import BatchedOptionHedgingEnv
+from option_hedging.vector_envs import make_vector_env
+from utils.counter_rng import EpisodeStreams
+
+env_kwargs = {'epsilon': 0.01, 'sigma': 0.15, 'rho': 0.02, 'action_bins': 20, 'T': 1, 'rebalance_frequency': 12}
+n_episodes = 8
+
+
+def _episode_returns(backend: str, num_envs: int, **kwargs) -> np.ndarray:
+    # every env plays n_episodes / num_envs episodes of a constant action, side by side
+    envs = make_vector_env(env_kwargs, num_envs=num_envs, backend=backend, **kwargs)
+    returns = []
+    try:
+        for _ in range(n_episodes // num_envs):
+            envs.reset()
+            episode_return, done = np.zeros(num_envs), np.zeros(num_envs, dtype=bool)
+            while not done.all():
+                _, reward, terminated, truncated, _ = envs.step(np.full(num_envs, 10))
+                episode_return += reward
+                done = np.logical_or(terminated, truncated)
+            returns.extend(episode_return)
+    finally:
+        envs.close()
+    return np.sort(returns)
+
+
+def test_episodes_do_not_depend_on_the_backend():
+    expected = _episode_returns('dummy', 1)
+    for backend, num_envs, kwargs in [('dummy', 4, {}), ('subproc', 8, {}), ('shmem', 8, {'num_workers': 2}),
+                                      ('batched', 8, {})]:
+        np.testing.assert_allclose(_episode_returns(backend, num_envs, **kwargs), expected, rtol=0, atol=1e-9,
+                                   err_msg=f'{backend} with {num_envs} envs')
+
+
+@pytest.mark.parametrize('episode', [4, 9, 2 ** 33 + 7])
+def test_episode_is_regenerated_from_its_stream(episode):
+    seed, dt, n_steps = [0, 1], 1 / env_kwargs['rebalance_frequency'], 11
+    expected = env_kwargs['sigma'] * np.sqrt(dt) * EpisodeStreams(seed).normals([episode], n_steps)[0]
+    # on its own
+    env = BatchedOptionHedgingEnv(num_envs=1, seed=seed, path_offset=episode, **env_kwargs)
+    env.reset()
+    np.testing.assert_array_equal(env.log_returns[0], expected)
+    # or as the second episode of the second of three paths
+    env = BatchedOptionHedgingEnv(num_envs=3, seed=seed, path_offset=episode - 4, **env_kwargs)
+    env.reset()
+    env.reset()
+    np.testing.assert_array_equal(env.log_returns[1], expected)
@@ -0,0 +1,29 @@
+import pytest
+import torch
+from config import load_trainer
+from option_hedging.export import export_policy, check_parity
+
+
+@pytest.mark.parametrize('model, action_bins', [('ppo', 0), ('dqn', 20)])
+def test_export_parity(model, action_bins, tmp_path, trial_kwargs):
+    kwargs = trial_kwargs(model, str(tmp_path), env_kwargs={'action_bins': action_bins})
+    trainer = load_trainer(model)(**kwargs)
+    trainer.run()
+    policy, env_kwargs = trainer.policy, kwargs['env_kwargs']
+    # the nets normalise with BatchNorm, which the export folds into the next Linear layer
+    assert any(isinstance(module, torch.nn.BatchNorm1d) for module in policy.modules())
+    policy.train()
+    hedger = export_policy(policy, env_kwargs)
+    assert policy.training
+    unfolded = export_policy(policy, env_kwargs, fold=False)
+    n_affine = [sum(op[0] == 'affine' for op in h.ops) for h in (hedger, unfolded)]
+    assert n_affine[0] < n_affine[1]
+
+    for exported in (hedger, hedger.to_torchscript()):
+        parity = check_parity(policy, exported, env_kwargs, n_episodes=200)
+        if action_bins > 0:
+            # a different action only where two Q-values tie to float32 precision
+            assert parity['mismatch_rate'] <= 1e-3
+        else:
+            assert parity['max_abs_error'] < 1e-4
+    assert policy.training
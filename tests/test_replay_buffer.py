@@ -0,0 +1,109 @@
+import copy
+import numpy as np
+import pytest
+from tianshou.data import Batch, Collector, VectorReplayBuffer
+from tianshou.policy import RandomPolicy
+from option_hedging.gym_envs import BatchedOptionHedgingEnv
+from option_hedging.replay_buffer import CompactVectorReplayBuffer, default_info_schema
+from option_hedging.vector_envs import make_vector_env
+from utils.checkpoint import buffer_state, load_buffer_state
+from utils.prefill_cache import save_prefill, load_prefill
+
+env_kwargs = {'epsilon': 0.01, 'sigma': 0.15, 'rho': 0.02, 'action_bins': 20, 'T': 1, 'rebalance_frequency': 12}
+episode_length = 11
+buffer_num = 3
+# two episodes per sub-buffer, which collecting five of them wraps around
+total_size = 2 * episode_length * buffer_num
+
+
+def _collector(buffer: VectorReplayBuffer) -> Collector:
+    envs = make_vector_env(env_kwargs, num_envs=buffer_num, backend='batched')
+    collector = Collector(RandomPolicy(action_space=envs.action_space[0]), envs, buffer)
+    collector.reset()
+    return collector
+
+
+def _collectors():
+    # the same random transitions go to a VectorReplayBuffer and to a CompactVectorReplayBuffer
+    return (_collector(VectorReplayBuffer(total_size, buffer_num)),
+            _collector(CompactVectorReplayBuffer(total_size, buffer_num, episode_length)))
+
+
+def _collect(collectors, n_step: int) -> None:
+    for collector in collectors:
+        collector.collect(n_step=n_step, random=True)
+
+
+def _assert_same_samples(expected_buffer: VectorReplayBuffer, buffer: CompactVectorReplayBuffer) -> None:
+    indices = expected_buffer.sample_indices(0)
+    np.testing.assert_array_equal(buffer.sample_indices(0), indices)
+    expected, actual = expected_buffer[indices], buffer[indices]
+    for key in ('obs', 'obs_next', 'act', 'rew', 'terminated', 'truncated', 'done'):
+        np.testing.assert_array_equal(actual[key], expected[key], err_msg=key)
+    assert set(actual.info.keys()) == set(default_info_schema)
+    for key, dtype in default_info_schema.items():
+        np.testing.assert_array_equal(actual.info[key], expected.info[key].astype(dtype), err_msg=key)
+
+
+def test_samples_match_vector_replay_buffer():
+    collectors = _collectors()
+    # in the middle of the first episodes
+    _collect(collectors, 4 * buffer_num)
+    _assert_same_samples(collectors[0].buffer, collectors[1].buffer)
+    # after wrapping around, still in the middle of an episode
+    _collect(collectors, 5 * episode_length * buffer_num)
+    assert len(collectors[1].buffer) == total_size
+    _assert_same_samples(collectors[0].buffer, collectors[1].buffer)
+
+
+def test_buffer_state_round_trip():
+    collectors = _collectors()
+    _collect(collectors, 5 * episode_length * buffer_num + 4 * buffer_num)
+    restored = CompactVectorReplayBuffer(total_size, buffer_num, episode_length)
+    load_buffer_state(restored, buffer_state(collectors[1].buffer))
+    assert restored.tables.keys() == collectors[1].buffer.tables.keys()
+    _assert_same_samples(collectors[0].buffer, restored)
+    # the restored tables let the episodes in progress continue
+    collectors[1].buffer = restored
+    _collect(collectors, 3 * episode_length * buffer_num)
+    _assert_same_samples(collectors[0].buffer, restored)
+
+
+def test_prefill_round_trip(tmp_path):
+    collectors = _collectors()
+    _collect(collectors, 5 * episode_length * buffer_num + 4 * buffer_num)
+    save_prefill(collectors[1], str(tmp_path / 'prefill'))
+    loaded = _collector(CompactVectorReplayBuffer(total_size, buffer_num, episode_length))
+    load_prefill(loaded, str(tmp_path / 'prefill'))
+    assert loaded.buffer.tables.keys() == collectors[1].buffer.tables.keys()
+    _assert_same_samples(collectors[0].buffer, loaded.buffer)
+    # the collector state comes back with the buffer, so collection continues as it would have
+    _collect((collectors[0], loaded), 3 * episode_length * buffer_num)
+    _assert_same_samples(collectors[0].buffer, loaded.buffer)
+
+
+def test_add_rejects_what_it_cannot_store():
+    env = BatchedOptionHedgingEnv(num_envs=1, seed=0, **env_kwargs)
+    obs, _ = env.reset()
+    act = np.array([10])
+    obs_next, rew, terminated, truncated, info = env.step(act)
+    step = Batch(obs=obs, act=act, rew=rew, terminated=terminated, truncated=truncated, obs_next=obs_next, info=info)
+    buffer = CompactVectorReplayBuffer(total_size, 1, episode_length)
+
+    # an episode ending before episode_length transitions
+    ended = copy.deepcopy(step)
+    ended.terminated = np.array([True])
+    with pytest.raises(ValueError):
+        buffer.add(ended)
+    assert len(buffer) == 0
+
+    buffer.add(step)
+    obs, act = obs_next, np.array([3])
+    obs_next, rew, terminated, truncated, info = env.step(act)
+    # a strike that changes within the episode
+    moved = Batch(obs=obs.copy(), act=act, rew=rew, terminated=terminated, truncated=truncated, obs_next=obs_next,
+                  info=info)
+    moved.obs[:, 3] += 1
+    with pytest.raises(ValueError):
+        buffer.add(moved)
+    assert len(buffer) == 1
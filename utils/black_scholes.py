@@ -0,0 +1,64 @@
+import math
+import numpy as np
+from typing import NamedTuple
+
+SQRT_HALF = math.sqrt(0.5)
+
+
+class BlackScholesValues(NamedTuple):
+    d_plus: float | np.ndarray
+    d_minus: float | np.ndarray
+    price: float | np.ndarray
+    delta: float | np.ndarray
+
+
+def norm_cdf(x: float) -> float:
+    # erfc keeps full relative precision in the left tail, unlike 1 + erf
+    return 0.5 * math.erfc(-x * SQRT_HALF)
+
+
+def _black_scholes_scalar(stock_price: float, strike_price: float, remaining_time: float,
+                          sigma: float) -> BlackScholesValues:
+    if remaining_time <= 0:
+        intrinsic = max(stock_price - strike_price, 0.)
+        d = math.inf if stock_price > strike_price else -math.inf
+        return BlackScholesValues(d, d, intrinsic, float(stock_price > strike_price))
+    sigma_sqrt_time = sigma * math.sqrt(remaining_time)
+    d_plus = (math.log(stock_price / strike_price) + sigma ** 2 / 2 * remaining_time) / sigma_sqrt_time
+    d_minus = d_plus - sigma_sqrt_time
+    delta = norm_cdf(d_plus)
+    price = delta * stock_price - norm_cdf(d_minus) * strike_price
+    return BlackScholesValues(d_plus, d_minus, price, delta)
+
+
+def _black_scholes_batch(stock_price: np.ndarray, strike_price: np.ndarray, remaining_time: np.ndarray,
+                         sigma: float | np.ndarray) -> BlackScholesValues:
+    # imported here so that scalar-only processes (env workers) never load scipy
+    from scipy.special import ndtr
+    expired = remaining_time <= 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma_sqrt_time = sigma * np.sqrt(remaining_time)
+        d_plus = (np.log(stock_price / strike_price) + sigma ** 2 / 2 * remaining_time) / sigma_sqrt_time
+    if np.any(expired):
+        d_plus = np.where(expired, np.where(stock_price > strike_price, np.inf, -np.inf), d_plus)
+        sigma_sqrt_time = np.where(expired, 0., sigma_sqrt_time)
+    d_minus = d_plus - sigma_sqrt_time
+    delta = ndtr(d_plus)
+    price = delta * stock_price - ndtr(d_minus) * strike_price
+    return BlackScholesValues(d_plus, d_minus, price, delta)
+
+
+def black_scholes(stock_price: float | np.ndarray,
+                  strike_price: float | np.ndarray,
+                  remaining_time: float | np.ndarray,
+                  sigma: float | np.ndarray) -> BlackScholesValues:
+    """
+    d+, d-, price and delta of a European call (zero interest rate) in a single pass. Scalars go through math.erfc,
+    arrays through the scipy.special.ndtr ufunc. Expired options are valued at their intrinsic value.
+    """
+    if isinstance(stock_price, (int, float)) and isinstance(remaining_time, (int, float)):
+        return _black_scholes_scalar(stock_price, strike_price, remaining_time, sigma)
+    return _black_scholes_batch(np.asarray(stock_price, dtype=np.float64),
+                                np.asarray(strike_price, dtype=np.float64),
+                                np.asarray(remaining_time, dtype=np.float64),
+                                sigma)
@@ -0,0 +1,403 @@
+import os
+import json
+import copy
+import random
+import shutil
+import h5py
+import numpy as np
+import torch
+from concurrent.futures import ThreadPoolExecutor, Future
+from tianshou.data import Collector, ReplayBuffer, ReplayBufferManager
+from tianshou.data.utils.converter import to_hdf5, from_hdf5
+from tianshou.env import DummyVectorEnv
+from tianshou.exploration import BaseNoise
+from tianshou.policy import BasePolicy
+from tianshou.trainer import BaseTrainer
+from tianshou.utils import TensorboardLogger, RunningMeanStd
+from typing import Dict, Any, Callable, Tuple
+
+_buffer_fields = ('_index', '_size', 'last_index', '_ep_rew', '_ep_len', '_ep_idx')
+
+
+def checkpoint_dir(log_dir: str) -> str:
+    return os.path.join(log_dir, 'checkpoint')
+
+
+def latest_checkpoint(directory: str) -> Dict[str, Any] | None:
+    """
+    Metadata of the last complete checkpoint in directory, None if there is none.
+    """
+    path = os.path.join(directory, 'latest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_atomic(path: str, write_fn: Callable[[str], None]) -> None:
+    tmp_path = f'{path}.tmp'
+    write_fn(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def rng_state() -> Dict[str, Any]:
+    state = {
+        'random': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['torch_cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: Dict[str, Any]) -> None:
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'torch_cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['torch_cuda'])
+
+
+def buffer_pointers(buffer: ReplayBuffer) -> Dict[str, Any]:
+    """
+    Copy of the pointers of the buffer and, for a VectorReplayBuffer, of its sub-buffers.
+    """
+    children = buffer.buffers if isinstance(buffer, ReplayBufferManager) else [buffer]
+    pointers = {
+        'children': {str(k): {field: copy.copy(getattr(child, field)) for field in _buffer_fields}
+                     for k, child in enumerate(children)}
+    }
+    if isinstance(buffer, ReplayBufferManager):
+        pointers['last_index'] = buffer.last_index.copy()
+        pointers['lengths'] = buffer._lengths.copy()
+    return pointers
+
+
+def load_buffer_pointers(buffer: ReplayBuffer, pointers: Dict[str, Any]) -> None:
+    children = buffer.buffers if isinstance(buffer, ReplayBufferManager) else [buffer]
+    for k, child in enumerate(children):
+        for field, value in pointers['children'][str(k)].items():
+            setattr(child, field, value)
+    if isinstance(buffer, ReplayBufferManager):
+        buffer.last_index = pointers['last_index']
+        buffer._lengths = pointers['lengths']
+
+
+def buffer_state(buffer: ReplayBuffer) -> Dict[str, Any]:
+    """
+    Copy of the stored transitions and of the pointers of the buffer, with the observation tables of a
+    CompactVectorReplayBuffer.
+    """
+    state = {'meta': copy.deepcopy(buffer._meta), **buffer_pointers(buffer)}
+    tables = getattr(buffer, 'tables', None)
+    if tables:
+        state['tables'] = copy.deepcopy(tables)
+    return state
+
+
+def load_buffer_state(buffer: ReplayBuffer, state: Dict[str, Any]) -> None:
+    buffer.set_batch(state['meta'])
+    load_buffer_pointers(buffer, state)
+    if 'tables' in state:
+        buffer.tables = {key: np.asarray(value) for key, value in state['tables'].items()}
+
+
+def env_state(envs: Any) -> Any:
+    """
+    Copy of the state of vector envs: of the envs themselves when they run in-process (batched, or dummy), and of the
+    attributes of every unwrapped env, fetched from its worker (e.g. its path_index), when they live in other
+    processes (subproc, shmem). None for other envs.
+    """
+    if isinstance(envs, DummyVectorEnv):
+        return [copy.deepcopy(worker.env) for worker in envs.workers]
+    if hasattr(envs, 'portfolio'):
+        return copy.deepcopy(envs.__dict__)
+    if hasattr(envs, 'get_env_attr'):
+        return {'workers': [vars(env) for env in envs.get_env_attr('unwrapped')]}
+    return None
+
+
+def load_env_state(envs: Any, state: Any) -> None:
+    if isinstance(envs, DummyVectorEnv):
+        for worker, env in zip(envs.workers, state):
+            worker.env = env
+    elif 'workers' in state:
+        for k, attributes in enumerate(state['workers']):
+            envs.set_env_attr('__dict__', attributes, id=k)
+    else:
+        envs.__dict__.update(state)
+
+
+def collector_state(collector: Collector) -> Dict[str, Any]:
+    """
+    Copy of the collector statistics, of its current step data and of its envs.
+    """
+    return {
+        'data': copy.deepcopy(collector.data),
+        'collect_step': collector.collect_step,
+        'collect_episode': collector.collect_episode,
+        'collect_time': collector.collect_time,
+        'envs': env_state(collector.env)
+    }
+
+
+def load_collector_state(collector: Collector, state: Dict[str, Any]) -> None:
+    if state['envs'] is not None:
+        load_env_state(collector.env, state['envs'])
+        # the collector samples random actions from the spaces of the restored envs
+        collector._action_space = collector.env.action_space
+        collector.data = state['data']
+    else:
+        # checkpoints of envs in other processes from before their state was saved: their episodes restart
+        collector.reset_env()
+    collector.collect_step = state['collect_step']
+    collector.collect_episode = state['collect_episode']
+    collector.collect_time = state['collect_time']
+
+
+def policy_attributes(policy: BasePolicy) -> Dict[str, Any]:
+    """
+    Training state of the policy that its state_dict leaves out: counters (e.g. DQN's _iter, TD3's _cnt), epsilon,
+    free tensors (SAC's log_alpha), exploration noise and reward normalisation statistics.
+    """
+    attributes = {}
+    module_state = set(dict(policy.named_parameters())) | set(dict(policy.named_buffers()))
+    for name, value in vars(policy).items():
+        if name == 'training' or name in module_state:
+            continue
+        if isinstance(value, torch.Tensor):
+            attributes[name] = value.detach().clone()
+        elif isinstance(value, (bool, int, float, np.number, np.ndarray, BaseNoise, RunningMeanStd)):
+            attributes[name] = copy.deepcopy(value)
+    return attributes
+
+
+def load_policy_attributes(policy: BasePolicy, attributes: Dict[str, Any]) -> None:
+    for name, value in attributes.items():
+        current = getattr(policy, name, None)
+        if isinstance(current, torch.Tensor) and current.requires_grad:
+            # optimizers hold a reference to the tensor, so it is updated in place
+            with torch.no_grad():
+                current.copy_(value)
+        else:
+            setattr(policy, name, value)
+
+
+class CheckpointLogger(TensorboardLogger):
+    """
+    TensorboardLogger that resumes from the counters of the last complete checkpoint in log_dir/checkpoint, rather
+    than from the last save/* scalars of the event file, which are written before the checkpoint is on disk. Every
+    epoch of the trainer ends with log_info_data, after the test, which then calls epoch_end_fn with the epoch.
+    """
+    epoch_end_fn: Callable[[int], None] | None = None
+
+    def log_info_data(self, log_data: dict, step: int) -> None:
+        super().log_info_data(log_data, step)
+        if self.epoch_end_fn is not None:
+            self.epoch_end_fn(step)
+
+    def restore_data(self) -> Tuple[int, int, int]:
+        checkpoint = latest_checkpoint(checkpoint_dir(self.writer.log_dir))
+        if checkpoint is None:
+            return super().restore_data()
+        epoch, env_step, gradient_step = checkpoint['epoch'], checkpoint['env_step'], checkpoint['gradient_step']
+        self.last_save_step = self.last_log_test_step = epoch
+        self.last_log_update_step = gradient_step
+        self.last_log_train_step = env_step
+        return epoch, env_step, gradient_step
+
+
+class Checkpointer:
+    def __init__(self,
+                 directory: str,
+                 policy: BasePolicy,
+                 train_collector: Collector,
+                 test_collector: Collector | None = None,
+                 keep: int = 2,
+                 compression: str = 'gzip'):
+        """
+        Periodic checkpoints of a trial, taken through the trainer's save_checkpoint_fn: policy weights and training
+        attributes, every optimizer of the policy, its LR scheduler, RNG states, the training collector and its
+        envs. The replay buffer is written as a chunked, compressed HDF5 file. The state is copied on the training
+        thread and written to disk on a background thread; each checkpoint goes to its own epoch_<n> directory and
+        becomes the latest one only once complete.
+
+        The trainer tests the policy right after saving, which consumes random numbers, so the RNG states, the test
+        envs and statistics and the best reward are written again once the epoch has ended (with a CheckpointLogger,
+        otherwise when the next epoch starts training). A resumed run restores everything at the start of its first
+        epoch, which makes it continue exactly as the original run would have. The last checkpoint of a run is on disk
+        when the trainer returns.
+        :param directory: directory of the checkpoints, usually checkpoint_dir(log_dir)
+        :param policy: the trained policy
+        :param train_collector: collector of the training envs and replay buffer
+        :param test_collector: collector of the test envs, whose random state is checkpointed with the RNGs
+        :param keep: number of checkpoints kept on disk
+        :param compression: HDF5 compression filter of the replay buffer
+        """
+        self.directory = directory
+        self.policy = policy
+        self.train_collector = train_collector
+        self.test_collector = test_collector
+        self.keep = keep
+        self.compression = compression
+        self.trainer = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: Future | None = None
+        self._saved_epoch = None
+        self._resume = None
+        os.makedirs(directory, exist_ok=True)
+
+    def attach(self, trainer: BaseTrainer, resume: bool = False) -> BaseTrainer:
+        """
+        Register the trainer whose best reward is checkpointed, and with resume, load the latest checkpoint into the
+        policy now and into the RNGs, collector and trainer when training starts.
+        """
+        self.trainer = trainer
+        if isinstance(trainer.logger, CheckpointLogger):
+            trainer.logger.epoch_end_fn = self.end_epoch
+        if resume:
+            self.load()
+        return trainer
+
+    def _optimizers(self) -> Dict[str, torch.optim.Optimizer]:
+        return {name: value for name, value in vars(self.policy).items() if isinstance(value, torch.optim.Optimizer)}
+
+    def _epoch_dir(self, epoch: int) -> str:
+        return os.path.join(self.directory, f'epoch_{epoch:05d}')
+
+    def save(self, epoch: int, env_step: int, gradient_step: int) -> str:
+        """
+        save_checkpoint_fn of the trainer.
+        """
+        lr_scheduler = self.policy.lr_scheduler
+        state = {
+            'policy': {k: v.detach().clone() for k, v in self.policy.state_dict().items()},
+            'policy_attributes': policy_attributes(self.policy),
+            'optimizers': {name: copy.deepcopy(optim.state_dict()) for name, optim in self._optimizers().items()},
+            'lr_scheduler': None if lr_scheduler is None else copy.deepcopy(lr_scheduler.state_dict()),
+            'collector': collector_state(self.train_collector),
+            'train_start': self._train_start_state()
+        }
+        buffer = self.train_collector.buffer
+        buffer_snapshot = buffer_state(buffer) if buffer is not None and len(buffer) else None
+        meta = {'epoch': epoch, 'env_step': env_step, 'gradient_step': gradient_step,
+                'path': os.path.basename(self._epoch_dir(epoch))}
+        self.wait()
+        self._pending = self._executor.submit(self._write, meta, state, buffer_snapshot)
+        self._saved_epoch = epoch
+        return self._epoch_dir(epoch)
+
+    def _train_start_state(self) -> Dict[str, Any]:
+        trainer = self.trainer
+        return {
+            'rng': rng_state(),
+            'test_envs': None if self.test_collector is None else env_state(self.test_collector.env),
+            'best': None if trainer is None else (trainer.best_epoch, trainer.best_reward, trainer.best_reward_std),
+            'test_stats': None if self.test_collector is None else (self.test_collector.collect_step,
+                                                                    self.test_collector.collect_episode,
+                                                                    self.test_collector.collect_time),
+            # the best test a SequentialTestCollector compares with
+            'test_best': getattr(self.test_collector, 'best', None)
+        }
+
+    def _write(self, meta: Dict[str, Any], state: Dict[str, Any], buffer_snapshot: Dict[str, Any] | None) -> None:
+        path = self._epoch_dir(meta['epoch'])
+        os.makedirs(path, exist_ok=True)
+        if buffer_snapshot is not None:
+            def write_buffer(tmp_path):
+                with h5py.File(tmp_path, 'w') as f:
+                    to_hdf5(buffer_snapshot, f, compression=self.compression)
+            _write_atomic(os.path.join(path, 'buffer.h5'), write_buffer)
+        _write_atomic(os.path.join(path, 'state.pt'), lambda tmp_path: torch.save(state, tmp_path))
+
+        def write_meta(tmp_path):
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+        _write_atomic(os.path.join(self.directory, 'latest.json'), write_meta)
+        epochs = sorted(name for name in os.listdir(self.directory) if name.startswith('epoch_'))
+        for name in epochs[:-self.keep]:
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def _write_train_start(self, epoch: int, train_start: Dict[str, Any]) -> None:
+        _write_atomic(os.path.join(self._epoch_dir(epoch), 'train_start.pt'),
+                      lambda tmp_path: torch.save(train_start, tmp_path))
+
+    def wait(self) -> None:
+        """
+        Block until the checkpoint being written is on disk.
+        """
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def end_epoch(self, epoch: int) -> None:
+        """
+        epoch_end_fn of the CheckpointLogger: record the state left by the test following the checkpoint of epoch,
+        and once the trainer stops, wait for the checkpoints to be on disk.
+        """
+        if self._saved_epoch == epoch:
+            self._pending = self._executor.submit(self._write_train_start, epoch, self._train_start_state())
+            self._saved_epoch = None
+        trainer = self.trainer
+        if trainer is not None and (trainer.stop_fn_flag or trainer.epoch >= trainer.max_epoch):
+            self.wait()
+
+    def wrap_train_fn(self, train_fn: Callable[[int, int], None] | None = None) -> Callable[[int, int], None]:
+        """
+        train_fn that restores the state at the start of training on resume, and records it after a checkpoint when
+        the logger does not (see end_epoch).
+        """
+        def checkpoint_train_fn(epoch: int, env_step: int) -> None:
+            if self._resume is not None:
+                self._restore_train_start()
+            elif self._saved_epoch is not None:
+                # queued behind the checkpoint itself on the writer thread
+                self._pending = self._executor.submit(self._write_train_start, self._saved_epoch,
+                                                      self._train_start_state())
+            self._saved_epoch = None
+            if train_fn is not None:
+                train_fn(epoch, env_step)
+        return checkpoint_train_fn
+
+    def load(self) -> Dict[str, Any] | None:
+        """
+        Load the latest checkpoint into the policy. The RNGs, collector and trainer statistics are restored by the
+        train_fn from wrap_train_fn, once the trainer has run its initial test.
+        """
+        meta = latest_checkpoint(self.directory)
+        if meta is None:
+            return None
+        path = os.path.join(self.directory, meta['path'])
+        state = torch.load(os.path.join(path, 'state.pt'), weights_only=False)
+        self.policy.load_state_dict(state['policy'])
+        load_policy_attributes(self.policy, state['policy_attributes'])
+        for name, optim in self._optimizers().items():
+            optim.load_state_dict(state['optimizers'][name])
+        if state['lr_scheduler'] is not None:
+            self.policy.lr_scheduler.load_state_dict(state['lr_scheduler'])
+        if os.path.exists(os.path.join(path, 'train_start.pt')):
+            state['train_start'] = torch.load(os.path.join(path, 'train_start.pt'), weights_only=False)
+        if os.path.exists(os.path.join(path, 'buffer.h5')):
+            with h5py.File(os.path.join(path, 'buffer.h5'), 'r') as f:
+                state['buffer'] = from_hdf5(f)
+        self._resume = state
+        return meta
+
+    def _restore_train_start(self) -> None:
+        state, self._resume = self._resume, None
+        if 'buffer' in state:
+            load_buffer_state(self.train_collector.buffer, state['buffer'])
+        load_collector_state(self.train_collector, state['collector'])
+        train_start = state['train_start']
+        set_rng_state(train_start['rng'])
+        if train_start['test_envs'] is not None:
+            load_env_state(self.test_collector.env, train_start['test_envs'])
+            self.test_collector._action_space = self.test_collector.env.action_space
+        if train_start['best'] is not None and self.trainer is not None:
+            self.trainer.best_epoch, self.trainer.best_reward, self.trainer.best_reward_std = train_start['best']
+        if train_start.get('test_stats') is not None:
+            (self.test_collector.collect_step, self.test_collector.collect_episode,
+             self.test_collector.collect_time) = train_start['test_stats']
+        if train_start.get('test_best') is not None:
+            self.test_collector.best = train_start['test_best']
@@ -0,0 +1,97 @@
+import numpy as np
+from typing import List, Sequence, Tuple
+
+_M0, _M1 = np.uint64(0xD2511F53), np.uint64(0xCD9E8D57)
+_W0, _W1 = 0x9E3779B9, 0xBB67AE85
+_MASK = np.uint64(0xFFFFFFFF)
+_SHIFT = np.uint64(32)
+
+
+def _key_schedule(key: Sequence[int], rounds: int = 10) -> List[Tuple[int, int]]:
+    return [((int(key[0]) + r * _W0) & 0xFFFFFFFF, (int(key[1]) + r * _W1) & 0xFFFFFFFF) for r in range(rounds)]
+
+
+def philox4x32(counter: np.ndarray, key: Sequence[int], rounds: int = 10) -> np.ndarray:
+    """
+    Philox4x32 block cipher (Salmon et al., Parallel Random Numbers: As Easy as 1, 2, 3) applied to every counter at
+    once. Counters are (..., 4) arrays of 32-bit words held in uint64, so that the 32 x 32-bit products fit; returns
+    the (..., 4) random words of each counter.
+    """
+    c0, c1, c2, c3 = (np.asarray(counter[..., i], dtype=np.uint64) for i in range(4))
+    for k0, k1 in _key_schedule(key, rounds):
+        p0, p1 = _M0 * c0, _M1 * c2
+        c0, c1, c2, c3 = ((p1 >> _SHIFT) ^ c1 ^ np.uint64(k0), p1 & _MASK,
+                          (p0 >> _SHIFT) ^ c3 ^ np.uint64(k1), p0 & _MASK)
+    return np.stack([c0, c1, c2, c3], axis=-1)
+
+
+def _philox4x32_block(c0: int, c1: int, c2: int, c3: int, schedule: List[Tuple[int, int]]) -> List[int]:
+    # philox4x32 of a single counter with Python ints, which beat numpy's per-call overhead for a few blocks
+    for k0, k1 in schedule:
+        p0, p1 = 0xD2511F53 * c0, 0xCD9E8D57 * c2
+        c0, c1, c2, c3 = (p1 >> 32) ^ c1 ^ k0, p1 & 0xFFFFFFFF, (p0 >> 32) ^ c3 ^ k1, p0 & 0xFFFFFFFF
+    return [c0, c1, c2, c3]
+
+
+class EpisodeStreams:
+    def __init__(self, seed: int | Sequence[int] | None = None):
+        """
+        Counter-based random numbers of independent episodes. The j-th block of four 32-bit words of episode e in
+        stream s is philox4x32 of the counter (j, s, e mod 2^32, e div 2^32) under a key derived from seed: it is
+        computed directly, without generating anything before it, so any episode can be generated on its own, in any
+        order, and the episodes of a run are the same however they are spread over envs and workers. Streams tell
+        apart the draws of one episode that must not overlap (e.g. the diffusion and the jumps of a price path).
+        :param seed: run seed, fresh entropy if None (kept in entropy, so that the run can be replayed)
+        """
+        self.entropy = np.random.SeedSequence(seed).entropy
+        self.key = np.random.SeedSequence(self.entropy).generate_state(2, np.uint32)
+        self._schedule = _key_schedule(self.key)
+
+    def __repr__(self) -> str:
+        return f'EpisodeStreams({self.entropy!r})'
+
+    def bits(self, episodes: np.ndarray, n: int, stream: int = 0) -> np.ndarray:
+        """
+        (len(episodes), n) random 32-bit words of the given episodes, as uint64.
+        """
+        episodes = np.asarray(episodes, dtype=np.uint64).reshape(-1, 1)
+        n_blocks = -(-n // 4)
+        if len(episodes) * n_blocks <= 16:
+            words = [[word for j in range(n_blocks)
+                      for word in _philox4x32_block(j, stream, int(e) & 0xFFFFFFFF, int(e) >> 32, self._schedule)]
+                     for e in episodes[:, 0]]
+            return np.array(words, dtype=np.uint64).reshape(len(episodes), -1)[:, :n]
+        blocks = np.arange(n_blocks, dtype=np.uint64)
+        counter = np.empty((len(episodes), len(blocks), 4), dtype=np.uint64)
+        counter[..., 0] = blocks
+        counter[..., 1] = stream
+        counter[..., 2] = episodes & _MASK
+        counter[..., 3] = episodes >> _SHIFT
+        return philox4x32(counter, self.key).reshape(len(episodes), -1)[:, :n]
+
+    def uniforms(self, episodes: np.ndarray, n: int, stream: int = 0) -> np.ndarray:
+        """
+        (len(episodes), n) uniform numbers in the open interval (0, 1).
+        """
+        return (self.bits(episodes, n, stream) + 0.5) * 2. ** -32
+
+    def normals(self, episodes: np.ndarray, n: int, stream: int = 0) -> np.ndarray:
+        """
+        (len(episodes), n) standard normal numbers (Box-Muller transform of pairs of uniforms).
+        """
+        u = self.uniforms(episodes, n + n % 2, stream)
+        radius = np.sqrt(-2 * np.log(u[:, 0::2]))
+        angle = 2 * np.pi * u[:, 1::2]
+        normals = np.empty_like(u)
+        normals[:, 0::2] = radius * np.cos(angle)
+        normals[:, 1::2] = radius * np.sin(angle)
+        return normals[:, :n]
+
+    def generator(self, episode: int, stream: int = 0) -> np.random.Generator:
+        """
+        Sequential generator of one episode (numpy's Philox4x64 under the same key, counter (0, 0, episode, stream)),
+        for draws that are not plain normals or uniforms.
+        """
+        key = self.key.astype(np.uint64)
+        return np.random.Generator(np.random.Philox(key=int(key[0] | key[1] << _SHIFT),
+                                                    counter=[0, 0, int(episode), int(stream)]))
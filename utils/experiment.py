@@ -0,0 +1,32 @@
+import os
+import random
+import shutil
+import numpy as np
+import torch
+from pathlib import Path
+from torch.utils.tensorboard import SummaryWriter
+from utils.checkpoint import CheckpointLogger
+
+default_log_dir = os.path.join(Path(os.path.abspath(__file__)).parent.parent.absolute(), '.logs')
+
+
+def make_logger(log_dir: str | None = None, clear: bool = True) -> CheckpointLogger:
+    """
+    TensorBoard logger writing to log_dir (the repository's .logs by default), which is emptied first if clear. Runs
+    resume from the checkpoints under log_dir/checkpoint.
+    """
+    log_dir = default_log_dir if log_dir is None else log_dir
+    if clear and os.path.exists(log_dir):
+        shutil.rmtree(log_dir)
+    os.makedirs(log_dir, exist_ok=True)
+    return CheckpointLogger(SummaryWriter(log_dir=log_dir), train_interval=256)
+
+
+def seed_everything(seed_value: int) -> None:
+    random.seed(seed_value)
+    np.random.seed(seed_value)
+    torch.manual_seed(seed_value)
+    torch.cuda.manual_seed(seed_value)
+    torch.cuda.manual_seed_all(seed_value)
+    torch.backends.cudnn.deterministic = True
+    torch.backends.cudnn.benchmark = False
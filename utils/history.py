@@ -3,81 +3,128 @@ import numpy as np
 
 class History:
     def __init__(self, max_size=10000):
+        """
+        Ring buffer of float64 records. Every column is stored contiguously, so that column lookups and slices do not
+        have to go through an object array. When more than max_size records are added, the oldest are overwritten.
+        """
         self.height = max_size
-
-    def set(self, **kwargs):
-        # Flattening the inputs to put it in np.array
-        self.columns = []
-        for name, value in kwargs.items():
-            if isinstance(value, list):
-                self.columns.extend([f"{name}_{i}" for i in range(len(value))])
-            elif isinstance(value, dict):
-                self.columns.extend([f"{name}_{key}" for key in value.keys()])
-            else:
-                self.columns.append(name)
-
-        self.width = len(self.columns)
-        self.history_storage = np.zeros(shape=(self.height, self.width), dtype='O')
+        self.columns = None
+        self.column_index = {}
+        self.width = 0
+        self.history_storage = None
         self.size = 0
-        self.add(**kwargs)
+        self.start = 0
+        self._keys = None
+        self._flat = True
 
-    def add(self, **kwargs):
-        values = []
+    @staticmethod
+    def _flatten(kwargs):
         columns = []
         for name, value in kwargs.items():
             if isinstance(value, list):
                 columns.extend([f"{name}_{i}" for i in range(len(value))])
-                values.extend(value[:])
             elif isinstance(value, dict):
                 columns.extend([f"{name}_{key}" for key in value.keys()])
-                values.extend(list(value.values()))
             else:
                 columns.append(name)
-                values.append(value)
+        return columns
 
-        if columns == self.columns:
-            self.history_storage[self.size, :] = values
-            self.size = min(self.size + 1, self.height)
-        else:
+    def set(self, **kwargs):
+        # Flattening the inputs to put it in np.array. The storage is only reallocated if the schema changes.
+        columns = self._flatten(kwargs)
+        if columns != self.columns:
+            self.columns = columns
+            self.column_index = {column: i for i, column in enumerate(columns)}
+            self.width = len(columns)
+            self.history_storage = np.zeros(shape=(self.width, self.height), dtype=np.float64)
+            self._keys = tuple(kwargs.keys())
+            self._flat = not any(isinstance(value, (list, dict)) for value in kwargs.values())
+        self.size = 0
+        self.start = 0
+        self.add(**kwargs)
+
+    def add(self, **kwargs):
+        if tuple(kwargs) != self._keys:
             raise ValueError(
-                f"Make sure that your inputs match the initial ones. Initial ones: {self.columns}. New ones: {columns}")
+                f"Make sure that your inputs match the initial ones. Initial ones: {self.columns}. "
+                f"New ones: {self._flatten(kwargs)}")
+        if self._flat:
+            values = list(kwargs.values())
+        else:
+            values = []
+            for value in kwargs.values():
+                if isinstance(value, list):
+                    values.extend(value)
+                elif isinstance(value, dict):
+                    values.extend(value.values())
+                else:
+                    values.append(value)
+            if len(values) != self.width:
+                raise ValueError(
+                    f"Make sure that your inputs match the initial ones. Initial ones: {self.columns}. "
+                    f"New ones: {self._flatten(kwargs)}")
+        if self.size < self.height:
+            row = (self.start + self.size) % self.height
+            self.size += 1
+        else:
+            row = self.start
+            self.start = (self.start + 1) % self.height
+        self.history_storage[:, row] = values
 
     def __len__(self):
         return self.size
 
+    def _column_index(self, column):
+        try:
+            return self.column_index[column]
+        except KeyError:
+            raise ValueError(f"Feature {column} does not exist. Check the available features: {self.columns}")
+
+    def _row(self, t):
+        if t < 0:
+            t += self.size
+        if not 0 <= t < self.size:
+            raise IndexError(f"Index {t} is out of bounds for a history of size {self.size}")
+        return (self.start + t) % self.height
+
+    def _rows(self):
+        # Physical positions of the stored records in chronological order: a slice if they are contiguous.
+        if self.start + self.size <= self.height:
+            return slice(self.start, self.start + self.size)
+        return (self.start + np.arange(self.size)) % self.height
+
+    def column(self, column):
+        """
+        Chronological values of a column. This is a view into the storage unless the ring buffer has wrapped around.
+        """
+        return self.history_storage[self._column_index(column), self._rows()]
+
+    def export(self):
+        """
+        Finished episode as a dict of column arrays, without copying unless the ring buffer has wrapped around. The
+        arrays are overwritten by the next call to set, so copy them if they need to outlive the episode.
+        """
+        rows = self._rows()
+        return {column: self.history_storage[i, rows] for i, column in enumerate(self.columns)}
+
     def __getitem__(self, arg):
         if isinstance(arg, tuple):
             column, t = arg
-            try:
-                column_index = self.columns.index(column)
-            except ValueError as e:
-                raise ValueError(f"Feature {column} does not exist. Check the available features: {self.columns}")
-            return self.history_storage[:self.size][t, column_index]
-        if isinstance(arg, int):
-            t = arg
-            return dict(zip(self.columns, self.history_storage[:self.size][t]))
+            if isinstance(t, (int, np.integer)):
+                return self.history_storage[self._column_index(column), self._row(t)]
+            return self.column(column)[t]
+        if isinstance(arg, (int, np.integer)):
+            return dict(zip(self.columns, self.history_storage[:, self._row(arg)]))
         if isinstance(arg, str):
-            column = arg
-            try:
-                column_index = self.columns.index(column)
-            except ValueError as e:
-                raise ValueError(f"Feature {column} does not exist. Check the available features: {self.columns}")
-            return self.history_storage[:self.size][:, column_index]
+            return self.column(arg)
         if isinstance(arg, list):
-            columns = arg
-            column_indexes = []
-            for column in columns:
-                try:
-                    column_indexes.append(self.columns.index(column))
-                except ValueError as e:
-                    raise ValueError(
-                        f"Feature {column} does not exist. Check the available features: {self.columns}")
-            return self.history_storage[:self.size][:, column_indexes]
+            column_indexes = [self._column_index(column) for column in arg]
+            return self.history_storage[column_indexes][:, self._rows()].T
 
     def __setitem__(self, arg, value):
         column, t = arg
-        try:
-            column_index = self.columns.index(column)
-        except ValueError as e:
-            raise ValueError(f"Feature {column} does not exist. Check the available features: {self.columns}")
-        self.history_storage[:self.size][t, column_index] = value
\ No newline at end of file
+        if isinstance(t, (int, np.integer)):
+            self.history_storage[self._column_index(column), self._row(t)] = value
+        else:
+            rows = (self.start + np.arange(self.size)) % self.height
+            self.history_storage[self._column_index(column), rows[t]] = value
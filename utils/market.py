@@ -0,0 +1,203 @@
+import numpy as np
+from utils.counter_rng import EpisodeStreams
+from typing import Dict, Any, Iterator
+
+
+class MarketSimulator:
+    """
+    Batched price dynamics of the hedged asset. simulate returns the log price increments of n_paths paths over
+    n_steps rebalancing periods of length dt as an (n_paths, n_steps) array, generated for all paths at once, which
+    the envs (simulator argument), PathBank and simulate_strategy replay instead of sampling GBM increments. Every
+    model has a drift of the log price of drift * dt per period, on top of its random part.
+    """
+    def config(self) -> Dict[str, Any]:
+        """
+        Model name and parameters, which identify the dynamics in path bank and prefill cache keys.
+        """
+        return {'model': type(self).__name__, **vars(self)}
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in vars(self).items())})"
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, MarketSimulator) and self.config() == other.config()
+
+    def __hash__(self) -> int:
+        return hash(repr(self))
+
+    def _simulate(self, n_paths: int, n_steps: int, dt: float, rng: np.random.Generator) -> np.ndarray:
+        raise NotImplementedError
+
+    def simulate(self,
+                 n_paths: int,
+                 n_steps: int,
+                 dt: float,
+                 rng: np.random.Generator,
+                 chunk_size: int | None = None) -> np.ndarray:
+        """
+        (n_paths, n_steps) log price increments. With chunk_size, the paths are generated chunk_size at a time, which
+        bounds the memory of the intermediate arrays (e.g. Heston's sub-step normals) for large batches.
+        """
+        if chunk_size is None or n_paths <= chunk_size:
+            return self._simulate(n_paths, n_steps, dt, rng)
+        log_returns = np.empty((n_paths, n_steps))
+        start = 0
+        for chunk in self.chunks(n_paths, n_steps, dt, rng, chunk_size):
+            log_returns[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return log_returns
+
+    def simulate_episodes(self, streams: EpisodeStreams, episodes: np.ndarray, n_steps: int, dt: float) -> np.ndarray:
+        """
+        (len(episodes), n_steps) log price increments of the given episodes of a run, each drawn from its own
+        counter-based stream, so that an episode's path depends only on the run seed and its index. The models
+        compute the paths of all episodes from streams.normals at once; this default simulates them one at a time
+        from their streams.generator.
+        """
+        log_returns = np.empty((len(episodes), n_steps))
+        for i, episode in enumerate(episodes):
+            log_returns[i] = self._simulate(1, n_steps, dt, streams.generator(episode))[0]
+        return log_returns
+
+    def chunks(self,
+               n_paths: int,
+               n_steps: int,
+               dt: float,
+               rng: np.random.Generator,
+               chunk_size: int) -> Iterator[np.ndarray]:
+        """
+        The paths of simulate(n_paths, n_steps, dt, rng, chunk_size), as successive (<= chunk_size, n_steps) arrays.
+        """
+        assert chunk_size >= 1
+        for start in range(0, n_paths, chunk_size):
+            yield self._simulate(min(chunk_size, n_paths - start), n_steps, dt, rng)
+
+
+class GBM(MarketSimulator):
+    def __init__(self, sigma: float, drift: float = 0.):
+        """
+        Geometric Brownian motion with volatility sigma: the dynamics of OptionHedgingEnv without a simulator.
+        """
+        assert sigma >= 0
+        self.sigma = sigma
+        self.drift = drift
+
+    def _simulate(self, n_paths, n_steps, dt, rng):
+        return rng.normal(self.drift * dt, self.sigma * np.sqrt(dt), size=(n_paths, n_steps))
+
+    def simulate_episodes(self, streams, episodes, n_steps, dt):
+        return self.drift * dt + self.sigma * np.sqrt(dt) * streams.normals(episodes, n_steps)
+
+
+class Heston(MarketSimulator):
+    def __init__(self,
+                 v0: float,
+                 kappa: float,
+                 theta: float,
+                 xi: float,
+                 rho: float,
+                 drift: float = 0.,
+                 substeps: int = 4):
+        """
+        Heston stochastic volatility: the variance v follows dv = kappa (theta - v) dt + xi sqrt(v) dW_v, and the log
+        price moves by sqrt(v) dW_S, with corr(dW_S, dW_v) = rho. Discretised with the full truncation Euler scheme
+        on substeps sub-steps per rebalancing period, vectorised over the paths.
+        :param v0: initial variance
+        :param kappa: mean reversion speed of the variance
+        :param theta: long-run variance
+        :param xi: volatility of the variance
+        :param rho: correlation of the price and variance shocks
+        :param drift: drift of the log price per unit of time
+        :param substeps: Euler steps per rebalancing period
+        """
+        assert v0 >= 0 and kappa >= 0 and theta >= 0 and xi >= 0 and -1 <= rho <= 1 and substeps >= 1
+        self.v0 = v0
+        self.kappa = kappa
+        self.theta = theta
+        self.xi = xi
+        self.rho = rho
+        self.drift = drift
+        self.substeps = substeps
+
+    def _simulate(self, n_paths, n_steps, dt, rng):
+        return self._euler(rng.standard_normal((n_steps * self.substeps, 2, n_paths)), n_steps, dt)
+
+    def simulate_episodes(self, streams, episodes, n_steps, dt):
+        normals = streams.normals(episodes, n_steps * self.substeps * 2)
+        return self._euler(normals.reshape(len(episodes), n_steps * self.substeps, 2).transpose(1, 2, 0), n_steps, dt)
+
+    def _euler(self, shocks: np.ndarray, n_steps: int, dt: float) -> np.ndarray:
+        # shocks: (n_steps * substeps, 2, n_paths) independent standard normals of the price and the variance, which
+        # are overwritten
+        n_paths = shocks.shape[2]
+        h = dt / self.substeps
+        shocks[:, 1] = self.rho * shocks[:, 0] + np.sqrt(1 - self.rho ** 2) * shocks[:, 1]
+        shocks *= np.sqrt(h)
+        log_returns = np.full((n_steps, n_paths), self.drift * dt)
+        v = np.full(n_paths, float(self.v0))
+        for t in range(n_steps):
+            for k in range(t * self.substeps, (t + 1) * self.substeps):
+                sqrt_v = np.sqrt(np.maximum(v, 0))
+                log_returns[t] += sqrt_v * shocks[k, 0]
+                v += self.kappa * (self.theta - np.maximum(v, 0)) * h + self.xi * sqrt_v * shocks[k, 1]
+        return log_returns.T.copy()
+
+
+class Merton(MarketSimulator):
+    def __init__(self,
+                 sigma: float,
+                 jump_intensity: float,
+                 jump_mean: float,
+                 jump_std: float,
+                 drift: float = 0.):
+        """
+        Merton jump-diffusion: GBM with volatility sigma plus Poisson(jump_intensity * dt) jumps per period, each
+        adding a N(jump_mean, jump_std^2) move to the log price.
+        :param sigma: volatility of the diffusion
+        :param jump_intensity: expected number of jumps per unit of time
+        :param jump_mean: mean log price jump
+        :param jump_std: standard deviation of the log price jumps
+        :param drift: drift of the log price per unit of time
+        """
+        assert sigma >= 0 and jump_intensity >= 0 and jump_std >= 0
+        self.sigma = sigma
+        self.jump_intensity = jump_intensity
+        self.jump_mean = jump_mean
+        self.jump_std = jump_std
+        self.drift = drift
+
+    def _simulate(self, n_paths, n_steps, dt, rng):
+        log_returns = rng.normal(self.drift * dt, self.sigma * np.sqrt(dt), size=(n_paths, n_steps))
+        n_jumps = rng.poisson(self.jump_intensity * dt, size=(n_paths, n_steps))
+        # the sum of n iid N(m, s^2) jumps is N(n m, n s^2)
+        log_returns += n_jumps * self.jump_mean + np.sqrt(n_jumps) * self.jump_std * rng.standard_normal(n_jumps.shape)
+        return log_returns
+
+    def simulate_episodes(self, streams, episodes, n_steps, dt):
+        normals = streams.normals(episodes, 2 * n_steps)
+        log_returns = self.drift * dt + self.sigma * np.sqrt(dt) * normals[:, :n_steps]
+        # Poisson jump counts by inversion of the CDF, from a separate stream of uniforms
+        u = streams.uniforms(episodes, n_steps, stream=1)
+        n_jumps = np.zeros(u.shape)
+        probability = cdf = np.exp(-self.jump_intensity * dt)
+        k = 0
+        while True:
+            above = u > cdf
+            if not above.any():
+                break
+            n_jumps += above
+            k += 1
+            probability *= self.jump_intensity * dt / k
+            cdf += probability
+        return log_returns + n_jumps * self.jump_mean + np.sqrt(n_jumps) * self.jump_std * normals[:, n_steps:]
+
+
+simulators = {'GBM': GBM, 'Heston': Heston, 'Merton': Merton}
+
+
+def make_simulator(config: Dict[str, Any]) -> MarketSimulator:
+    """
+    Inverse of MarketSimulator.config.
+    """
+    config = dict(config)
+    return simulators[config.pop('model')](**config)
@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import numpy as np
+from utils.market import MarketSimulator, GBM
+from typing import Dict, Any
+
+
+class PathBank:
+    def __init__(self,
+                 root: str,
+                 sigma: float,
+                 T: int,
+                 rebalance_frequency: int,
+                 n_paths: int,
+                 shard_size: int = 65536,
+                 seed: int = 0,
+                 simulator: MarketSimulator | None = None):
+        """
+        Log-return paths of the OptionHedgingEnv market, generated in bulk and stored as .npy shards of shard_size
+        paths each under root/<key>, where key hashes the market config and the seed. Shards are opened as read-only
+        memory maps, so processes using the same bank share the pages instead of copying them. Every shard is drawn
+        from its own SeedSequence, so a bank is identical whichever machine or process generated it. The last shard
+        holds the remaining paths only, and is kept apart from those of banks of other sizes, whose full shards are
+        shared.
+        :param root: directory holding the banks
+        :param sigma: standard deviation of the asset returns
+        :param T: expiry time
+        :param rebalance_frequency: rebalancing dates per unit of time
+        :param n_paths: number of paths
+        :param shard_size: number of paths per shard
+        :param seed: entropy of the paths
+        :param simulator: dynamics of the paths, GBM with volatility sigma if None
+        """
+        assert n_paths >= 1 and shard_size >= 1
+        self.config = {
+            'sigma': sigma,
+            'T': T,
+            'rebalance_frequency': rebalance_frequency,
+            'shard_size': shard_size,
+            'seed': seed
+        }
+        if simulator is not None:
+            self.config['simulator'] = simulator.config()
+        self.simulator = GBM(sigma) if simulator is None else simulator
+        self.key = self.config_key(self.config)
+        self.directory = os.path.join(root, self.key)
+        self.n_steps = T * rebalance_frequency - 1
+        self.shard_size = shard_size
+        # paths simulated at once while generating a shard
+        self.chunk_size = 8192
+        self.n_paths = n_paths
+        self.n_shards = -(-n_paths // shard_size)
+        self._shards = {}
+        self.generate()
+
+    @staticmethod
+    def config_key(config: Dict[str, Any]) -> str:
+        return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+    def __len__(self) -> int:
+        return self.n_paths
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # memory maps are reopened in the receiving process
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _shard_rows(self, shard: int) -> int:
+        return min(self.shard_size, self.n_paths - shard * self.shard_size)
+
+    def _shard_path(self, shard: int) -> str:
+        rows = self._shard_rows(shard)
+        if rows < self.shard_size:
+            return os.path.join(self.directory, f'shard_{shard:05d}_{rows}.npy')
+        return os.path.join(self.directory, f'shard_{shard:05d}.npy')
+
+    def _generate_shard(self, shard: int) -> None:
+        dt = 1 / self.config['rebalance_frequency']
+        rng = np.random.default_rng(np.random.SeedSequence(self.config['seed'], spawn_key=(shard,)))
+        path = self._shard_path(shard)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        rows = self._shard_rows(shard)
+        shard_array = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float64, shape=(rows, self.n_steps))
+        shard_array[:] = self.simulator.simulate(rows, self.n_steps, dt, rng, chunk_size=self.chunk_size)
+        shard_array.flush()
+        del shard_array
+        # atomic, so that concurrent workers never see a partially written shard
+        os.replace(tmp_path, path)
+
+    def generate(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path = os.path.join(self.directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            tmp_path = f'{meta_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({**self.config, 'n_steps': self.n_steps}, f)
+            os.replace(tmp_path, meta_path)
+        for shard in range(self.n_shards):
+            if not os.path.exists(self._shard_path(shard)):
+                self._generate_shard(shard)
+
+    def shard(self, shard: int) -> np.ndarray:
+        if shard not in self._shards:
+            self._shards[shard] = np.load(self._shard_path(shard), mmap_mode='r')
+        return self._shards[shard]
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        index = index % len(self)
+        return self.shard(index // self.shard_size)[index % self.shard_size]
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Paths at the given indices (modulo the size of the bank) as a (len(indices), n_steps) array.
+        """
+        indices = np.asarray(indices) % len(self)
+        shards, rows = np.divmod(indices, self.shard_size)
+        paths = np.empty((len(indices), self.n_steps), dtype=np.float64)
+        for shard in np.unique(shards):
+            mask = shards == shard
+            paths[mask] = self.shard(shard)[rows[mask]]
+        return paths
@@ -1,5 +1,6 @@
 import numpy as np
-import scipy.stats as ss
+from utils.black_scholes import black_scholes, BlackScholesValues
+from typing import NamedTuple, Tuple
 
 
 class SimplePortfolio:
@@ -13,6 +14,8 @@ class SimplePortfolio:
         self.dt = dt
         self.stock_held = None
         self.capital = None
+        self._greeks_key = None
+        self._greeks = None
 
     def init(self, sigma):
         initial_stock_held = self.black_scholes_hedge(sigma)
@@ -27,19 +30,226 @@ class SimplePortfolio:
         self.stock_price = stock_price
         self.stock_held = stock_held
 
+    def greeks(self, sigma) -> BlackScholesValues:
+        # Evaluated once per (S, t, sigma), shared by the hedge and the valuations
+        key = (self.stock_price, self.remaining_time, sigma)
+        if key != self._greeks_key:
+            self._greeks = black_scholes(self.stock_price, self.strike_price, self.remaining_time, sigma)
+            self._greeks_key = key
+        return self._greeks
+
     def black_scholes_hedge(self, sigma):
-        d_plus = 1 / (sigma * np.sqrt(self.remaining_time)) * (
-                    np.log(self.stock_price / self.strike_price) +
-                    sigma ** 2 / 2 * self.remaining_time)
-        return ss.norm.cdf(d_plus)
+        return self.greeks(sigma).delta
 
     def option_valuation(self, sigma):
-        d_plus = (1 / (sigma * np.sqrt(self.remaining_time)) * np.log(self.stock_price / self.strike_price) +
-                  sigma ** 2 / 2 * self.remaining_time)
-        d_minus = d_plus - sigma * np.sqrt(self.remaining_time)
-        return ss.norm.cdf(d_plus) * self.stock_price - ss.norm.cdf(d_minus) * self.strike_price
+        return self.greeks(sigma).price
 
     def portfolio_valuation(self, sigma):
         option_value = self.option_valuation(sigma)
         stock_value = self.stock_price * self.stock_held
         return stock_value + self.capital - option_value
+
+
+class BatchPortfolio:
+    def __init__(self,
+                 n_paths: int,
+                 strike_price: float,
+                 expiry_time: int,
+                 dt: float):
+        """
+        Array counterpart of SimplePortfolio: every attribute holds one entry per path. All methods accept an
+        optional index so that a subset of the paths can be updated in place.
+        """
+        self.n_paths = n_paths
+        self.expiry_time = expiry_time
+        self.dt = dt
+        self.strike_price = np.full(n_paths, strike_price, dtype=np.float64)
+        self.stock_price = np.full(n_paths, 100., dtype=np.float64)
+        self.remaining_time = np.full(n_paths, float(expiry_time), dtype=np.float64)
+        self.stock_held = np.zeros(n_paths, dtype=np.float64)
+        self.capital = np.zeros(n_paths, dtype=np.float64)
+        self._paths = np.arange(n_paths)
+        # cached option price and delta per path, re-evaluated when the path's state changes
+        self._greeks_sigma = None
+        self._stale = np.ones(n_paths, dtype=bool)
+        self._price = np.zeros(n_paths, dtype=np.float64)
+        self._delta = np.zeros(n_paths, dtype=np.float64)
+
+    def init(self, sigma, idx=slice(None)):
+        self.stock_price[idx] = 100.
+        self.remaining_time[idx] = self.expiry_time
+        self._stale[idx] = True
+        initial_stock_held = self.black_scholes_hedge(sigma, idx)
+        self.capital[idx] = self.option_valuation(sigma, idx) - initial_stock_held*self.stock_price[idx]
+        self.stock_held[idx] = initial_stock_held
+
+    def update_position(self, stock_price, stock_held, idx=slice(None)):
+        self.remaining_time[idx] -= self.dt
+        stock_delta = stock_held - self.stock_held[idx]
+        self.capital[idx] -= stock_delta * stock_price
+        self.stock_price[idx] = stock_price
+        self.stock_held[idx] = stock_held
+        self._stale[idx] = True
+
+    def greeks(self, sigma, idx=slice(None)):
+        """
+        Option price and delta of the selected paths. Only paths whose state changed since the last call are
+        re-evaluated.
+        """
+        if sigma != self._greeks_sigma:
+            self._stale[:] = True
+            self._greeks_sigma = sigma
+        stale = self._stale[idx]
+        if stale.all():
+            update = idx
+        elif stale.any():
+            update = self._paths[idx][stale]
+        else:
+            update = None
+        if update is not None:
+            values = black_scholes(self.stock_price[update], self.strike_price[update], self.remaining_time[update],
+                                   sigma)
+            self._price[update] = values.price
+            self._delta[update] = values.delta
+            self._stale[update] = False
+        if isinstance(idx, slice):
+            return self._price[idx].copy(), self._delta[idx].copy()
+        return self._price[idx], self._delta[idx]
+
+    def black_scholes_hedge(self, sigma, idx=slice(None)):
+        return self.greeks(sigma, idx)[1]
+
+    def option_valuation(self, sigma, idx=slice(None)):
+        return self.greeks(sigma, idx)[0]
+
+    def portfolio_valuation(self, sigma, idx=slice(None)):
+        option_value = self.option_valuation(sigma, idx)
+        stock_value = self.stock_price[idx] * self.stock_held[idx]
+        return stock_value + self.capital[idx] - option_value
+
+
+class OptionBook(NamedTuple):
+    """
+    European options on one underlying: one entry per contract. Positive quantities are long, negative short.
+    """
+    strike_price: np.ndarray
+    expiry_time: np.ndarray
+    quantity: np.ndarray
+    is_put: np.ndarray
+
+
+def random_book(n_options: int,
+                T: int = 1,
+                rebalance_frequency: int = 12,
+                strike_range: Tuple[float, float] = (80., 120.),
+                short_fraction: float = 0.8,
+                put_fraction: float = 0.3,
+                seed: int | None = None) -> OptionBook:
+    """
+    Book of n_options unit contracts with strikes uniform in strike_range, expiries on the rebalancing dates after
+    the first one and up to T, short with probability short_fraction and puts with probability put_fraction.
+    """
+    rng = np.random.default_rng(seed)
+    n_dates = T * rebalance_frequency
+    return OptionBook(strike_price=rng.uniform(*strike_range, size=n_options),
+                      expiry_time=rng.integers(2, n_dates + 1, size=n_options) / rebalance_frequency,
+                      quantity=np.where(rng.random(n_options) < short_fraction, -1., 1.),
+                      is_put=rng.random(n_options) < put_fraction)
+
+
+class BookPortfolio:
+    def __init__(self,
+                 book: OptionBook,
+                 dt: float):
+        """
+        SimplePortfolio for a book of options on one underlying, hedged with the stock. The book is valued and its
+        delta aggregated in one vectorised Black-Scholes pass over all contracts per state; puts are priced by put-call
+        parity. Time runs in whole rebalancing periods, so that each contract expires exactly on its date: it then
+        settles its intrinsic value into the capital and leaves the book. option_valuation is the value of the book to
+        its counterparties (the liability of a short book, as for the short call of SimplePortfolio) and
+        black_scholes_hedge the stock that offsets the book's net delta.
+        """
+        self.book = book
+        self.dt = dt
+        expiry_steps = np.rint(np.asarray(book.expiry_time, dtype=np.float64) / dt).astype(np.int64)
+        # sorted by expiry, the contracts still in the book are a suffix of the arrays
+        order = np.argsort(expiry_steps, kind='stable')
+        self.expiry_steps = expiry_steps[order]
+        self.strike_price = np.asarray(book.strike_price, dtype=np.float64)[order]
+        self.quantity = np.asarray(book.quantity, dtype=np.float64)[order]
+        self.is_put = np.asarray(book.is_put, dtype=np.float64)[order]
+        assert (self.expiry_steps >= 1).all(), 'options must expire after the first rebalancing date'
+        self.horizon = int(self.expiry_steps.max())
+        # each contract's delta is in [0, 1] for a call and [-1, 0] for a put, which bounds the hedge of the book
+        hedge_bounds = -self.quantity * np.where(self.is_put, -1., 1.)
+        self.hedge_range = (float(np.minimum(hedge_bounds, 0).sum()), float(np.maximum(hedge_bounds, 0).sum()))
+        self.stock_price = 100.
+        self.step = 0
+        self.stock_held = None
+        self.capital = None
+        # index of the first contract still in the book
+        self.first = 0
+        self._greeks_key = None
+        self._greeks = None
+
+    @property
+    def remaining_time(self) -> float:
+        return (self.horizon - self.step) * self.dt
+
+    def init(self, sigma):
+        self.stock_price = 100.
+        self.step = 0
+        self.first = 0
+        self._greeks_key = None
+        initial_stock_held = self.black_scholes_hedge(sigma)
+        self.capital = self.option_valuation(sigma) - initial_stock_held*self.stock_price
+        self.stock_held = initial_stock_held
+
+    def update_position(self, stock_price, stock_held):
+        self.step += 1
+        stock_delta = stock_held - self.stock_held
+        self.capital -= stock_delta * stock_price
+        self.stock_price = stock_price
+        self.stock_held = stock_held
+        first = int(np.searchsorted(self.expiry_steps, self.step, side='right'))
+        if first > self.first:
+            expired = slice(self.first, first)
+            intrinsic = np.maximum(np.where(self.is_put[expired] == 1, self.strike_price[expired] - stock_price,
+                                            stock_price - self.strike_price[expired]), 0)
+            self.capital += self.quantity[expired] @ intrinsic
+            self.first = first
+
+    def greeks(self, sigma) -> Tuple[float, float]:
+        """
+        Value and delta of the book, evaluated once per (S, t, sigma).
+        """
+        key = (self.stock_price, self.step, sigma)
+        if key != self._greeks_key:
+            book = slice(self.first, None)
+            strike_price, is_put, quantity = self.strike_price[book], self.is_put[book], self.quantity[book]
+            values = black_scholes(np.float64(self.stock_price), strike_price,
+                                   (self.expiry_steps[book] - self.step) * self.dt, sigma)
+            price = values.price - is_put * (self.stock_price - strike_price)
+            delta = values.delta - is_put
+            self._greeks = (float(quantity @ price), float(quantity @ delta))
+            self._greeks_key = key
+        return self._greeks
+
+    def black_scholes_hedge(self, sigma):
+        return -self.greeks(sigma)[1]
+
+    def option_valuation(self, sigma):
+        return -self.greeks(sigma)[0]
+
+    def portfolio_valuation(self, sigma):
+        option_value = self.option_valuation(sigma)
+        stock_value = self.stock_price * self.stock_held
+        return stock_value + self.capital - option_value
+
+    def notional_strike(self) -> float:
+        """
+        Strike of the contracts still in the book, averaged by absolute quantity.
+        """
+        weights = np.abs(self.quantity[self.first:])
+        total = weights.sum()
+        return float(weights @ self.strike_price[self.first:] / total) if total > 0 else 0.
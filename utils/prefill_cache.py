@@ -0,0 +1,175 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+from pathlib import Path
+from tianshou.data import Batch, Collector
+from utils.checkpoint import buffer_pointers, load_buffer_pointers, collector_state, load_collector_state
+from utils.path_bank import PathBank
+from utils.market import MarketSimulator
+from typing import Dict, Any, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+root = Path(os.path.abspath(__file__)).parent.parent.absolute()
+default_cache_dir = os.path.join(root, '.cache', 'prefill')
+# bumped on any change of the stored prefills (transitions, info entries, files), so that older ones are not reused
+cache_version = 1
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, PathBank):
+        return {'path_bank': value.key}
+    if isinstance(value, MarketSimulator):
+        return value.config()
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
+
+
+def prefill_key(collector: Collector, buffer_size: int, env_kwargs: Dict[str, Any], seed: int = 0,
+                seed_stride: int = 1, direct: bool = False, path_offset: int | None = None) -> str:
+    """
+    Hash of everything a random prefill depends on: the env config and seeds, the number of envs and, for a collected
+    prefill, which stores their state, their vector env type, the buffer layout, the policy's mapping of the random
+    actions to the env action space, whether the prefill is generated directly (random_prefill) or collected, the
+    first path of a direct prefill, and the cache_version.
+    """
+    buffer, policy = collector.buffer, collector.policy
+    config = {
+        'env_kwargs': env_kwargs,
+        'env_num': collector.env_num,
+        'envs': None if direct else type(collector.env).__name__,
+        'seed': seed,
+        'seed_stride': seed_stride,
+        'buffer': type(buffer).__name__,
+        'buffer_maxsize': buffer.maxsize,
+        'buffer_num': getattr(buffer, 'buffer_num', 1),
+        'buffer_size': buffer_size,
+        'direct': direct,
+        'path_offset': path_offset,
+        'action_scaling': getattr(policy, 'action_scaling', None),
+        'action_bound_method': getattr(policy, 'action_bound_method', None),
+        'version': cache_version
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=_jsonable).encode()).hexdigest()[:16]
+
+
+def _flatten(batch: Batch, prefix: str = '') -> Tuple[Dict[str, np.ndarray], List[str]]:
+    arrays, empty = {}, []
+    for key, value in batch.items():
+        if isinstance(value, Batch):
+            if value.is_empty():
+                empty.append(prefix + key)
+            else:
+                sub_arrays, sub_empty = _flatten(value, f'{prefix}{key}.')
+                arrays.update(sub_arrays)
+                empty.extend(sub_empty)
+        else:
+            arrays[prefix + key] = value
+    return arrays, empty
+
+
+def _unflatten(arrays: Dict[str, np.ndarray], empty: List[str]) -> Batch:
+    nested = {}
+    for path, value in [*arrays.items(), *((path, Batch()) for path in empty)]:
+        *parents, key = path.split('.')
+        node = nested
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return Batch(nested)
+
+
+def save_prefill(collector: Collector, directory: str, envs: bool = True) -> None:
+    """
+    Write the replay buffer of the collector as one .npy file per field under directory (and per observation table
+    of a CompactVectorReplayBuffer), with the buffer pointers and, if envs, the collector state in state.pt: that of
+    its envs, which are left mid-episode by a collected prefill.
+    """
+    os.makedirs(directory)
+    arrays, empty = _flatten(collector.buffer._meta)
+    tables = getattr(collector.buffer, 'tables', None) or {}
+    for path, value in [*arrays.items(), *((f'tables.{key}', value) for key, value in tables.items())]:
+        np.save(os.path.join(directory, f'{path}.npy'), value)
+    torch.save({'arrays': list(arrays), 'empty': empty, 'tables': list(tables),
+                'pointers': buffer_pointers(collector.buffer),
+                'collector': collector_state(collector) if envs else None},
+               os.path.join(directory, 'state.pt'))
+
+
+def load_prefill(collector: Collector, directory: str) -> None:
+    """
+    Point the replay buffer of the collector at the memory-mapped arrays under directory and restore the collector
+    state, if saved; the collector is left as it is otherwise. The maps are copy-on-write: processes loading the same prefill share its pages until they overwrite them
+    with new transitions, and the files on disk are never modified.
+    """
+    state = torch.load(os.path.join(directory, 'state.pt'), weights_only=False)
+    arrays = {path: np.load(os.path.join(directory, f'{path}.npy'), mmap_mode='c') for path in state['arrays']}
+    collector.buffer.set_batch(_unflatten(arrays, state['empty']))
+    load_buffer_pointers(collector.buffer, state['pointers'])
+    if state.get('tables'):
+        collector.buffer.tables = {key: np.load(os.path.join(directory, f'tables.{key}.npy'), mmap_mode='c')
+                                   for key in state['tables']}
+    if state['collector'] is not None:
+        load_collector_state(collector, state['collector'])
+
+
+def _prefill(collector: Collector, buffer_size: int, env_kwargs: Dict[str, Any], seed: int, direct: bool,
+             path_offset: int | None) -> None:
+    if direct:
+        from option_hedging.random_prefill import random_prefill
+        random_prefill(collector.buffer, buffer_size, env_kwargs, seed=seed,
+                       map_action_inverse=collector.policy.map_action_inverse, path_offset=path_offset)
+    else:
+        collector.collect(buffer_size, random=True)
+
+
+def cached_prefill(collector: Collector,
+                   buffer_size: int,
+                   env_kwargs: Dict[str, Any],
+                   seed: int = 0,
+                   seed_stride: int = 1,
+                   cache_dir: str | None = default_cache_dir,
+                   direct: bool = True,
+                   path_offset: int | None = None) -> bool:
+    """
+    Fill the replay buffer of the collector with buffer_size steps of random actions, loading them from cache_dir when
+    a run with the same prefill_key has stored them, and storing them otherwise. Concurrent processes (e.g. sweep
+    trials) wait on a file lock for the one simulating the prefill instead of simulating it too. Returns whether the
+    prefill came from the cache.
+    :param collector: training collector, freshly reset
+    :param buffer_size: number of random steps to collect
+    :param env_kwargs: keyword arguments of the training envs
+    :param seed: seed of the first training env, as given to make_vector_env
+    :param seed_stride: seed stride of the training envs, as given to make_vector_env
+    :param cache_dir: directory of the cached prefills, None to always simulate
+    :param direct: generate whole episodes in bulk with random_prefill instead of stepping the collector's envs
+    :param path_offset: first path bank index of a direct prefill, the last paths of the bank by default (see
+    random_prefill)
+    """
+    if cache_dir is None:
+        _prefill(collector, buffer_size, env_kwargs, seed, direct, path_offset)
+        return False
+    os.makedirs(cache_dir, exist_ok=True)
+    directory = os.path.join(cache_dir, prefill_key(collector, buffer_size, env_kwargs, seed, seed_stride, direct,
+                                                        path_offset))
+    with open(f'{directory}.lock', 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(directory):
+            load_prefill(collector, directory)
+            return True
+        _prefill(collector, buffer_size, env_kwargs, seed, direct, path_offset)
+        tmp_directory = f'{directory}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        # a direct prefill leaves the envs as they were, freshly reset
+        save_prefill(collector, tmp_directory, envs=not direct)
+        # atomic, so that a process without the lock never sees a partially written prefill
+        os.replace(tmp_directory, directory)
+    return False
@@ -0,0 +1,203 @@
+import os
+import time
+import signal
+import cProfile
+import threading
+import collections
+from types import FrameType
+from tianshou.env import DummyVectorEnv
+from tianshou.trainer import BaseTrainer
+from typing import Dict, Any, List, Tuple
+
+
+class Profiler:
+    def __init__(self,
+                 dump_epoch: int | None = None,
+                 dump_format: str = 'folded',
+                 sample_interval: float = 0.005,
+                 dump_dir: str | None = None):
+        """
+        Per-phase wall time and call counts of a training run, published as TensorBoard scalars every epoch under
+        profile/<phase>/seconds and profile/<phase>/calls. The phases are the collectors' collect (train_collect,
+        test_collect), the vector env step and reset within them (env_step, env_reset), the time the in-process
+        OptionHedgingEnv instances spend simulating (simulate, only for the dummy backend: with worker processes
+        env_step is simulation plus IPC, with the batched backend the vector env is the simulator), the policy
+        forward pass (policy_forward) and its updates (update, which samples the buffer and calls learn). Phases are
+        nested, e.g. train_collect/env_step/simulate, and profile/<phase>/self_seconds excludes the nested phases.
+
+        Nothing is instrumented until attach(trainer) is called, so a run without a Profiler pays no overhead.
+        The instrumented objects get a subclass of their class overriding the timed methods, which keeps their
+        instance state (checkpointed by utils.checkpoint) free of the timers.
+        :param dump_epoch: epoch whose profile is also written to dump_dir, None for none
+        :param dump_format: 'folded' for stack samples in the folded format (one 'frame;frame;... count' line per
+        stack, as py-spy record --format raw writes, for flamegraph.pl, inferno or speedscope), 'cprofile' for a
+        deterministic cProfile dump (pstats, snakeviz)
+        :param sample_interval: seconds of CPU time between stack samples of the folded format
+        :param dump_dir: directory of the dump, the logger's log_dir/profile by default
+        """
+        assert dump_format in ('folded', 'cprofile')
+        self.dump_epoch = dump_epoch
+        self.dump_format = dump_format
+        self.sample_interval = sample_interval
+        self.dump_dir = dump_dir
+        self.trainer: BaseTrainer | None = None
+        self.seconds: Dict[str, float] = collections.defaultdict(float)
+        self.calls: Dict[str, int] = collections.defaultdict(int)
+        # phases published so far, one {phase: (seconds, calls)} per epoch
+        self.epochs: Dict[int, Dict[str, Tuple[float, int]]] = {}
+        self._stack: List[str] = []
+        self._epoch = 0
+        self._epoch_start = time.perf_counter()
+        self._restore: List[Tuple[Any, type]] = []
+        self._cprofile: cProfile.Profile | None = None
+        self._samples: collections.Counter | None = None
+        self._previous_handler = None
+
+    def _timed(self, name: str, method, obj, args, kwargs) -> Any:
+        if not self._stack and self.trainer is not None and self.trainer.epoch != self._epoch:
+            self._start_epoch(self.trainer.epoch)
+        key = f'{self._stack[-1]}/{name}' if self._stack else name
+        self._stack.append(key)
+        start = time.perf_counter()
+        try:
+            return method(obj, *args, **kwargs)
+        finally:
+            self.seconds[key] += time.perf_counter() - start
+            self.calls[key] += 1
+            self._stack.pop()
+
+    def instrument(self, obj: Any, methods: Dict[str, str]) -> None:
+        """
+        Time the methods of obj (method name -> phase name) from now on.
+        """
+        cls = type(obj)
+        self._override(obj, {name: _timed_method(self, getattr(cls, name), phase) for name, phase in methods.items()})
+
+    def _override(self, obj: Any, namespace: Dict[str, Any]) -> None:
+        cls = type(obj)
+        obj.__class__ = type(cls.__name__, (cls,), {**namespace, '__module__': cls.__module__})
+        self._restore.append((obj, cls))
+
+    def attach(self, trainer: BaseTrainer) -> BaseTrainer:
+        """
+        Instrument the collectors, envs, policy and logger of trainer.
+        """
+        self.trainer = trainer
+        for collector, phase in ((trainer.train_collector, 'train_collect'), (trainer.test_collector, 'test_collect')):
+            if collector is None:
+                continue
+            self.instrument(collector, {'collect': phase})
+            self.instrument(collector.env, {'step': 'env_step', 'reset': 'env_reset'})
+            if isinstance(collector.env, DummyVectorEnv):
+                for worker in collector.env.workers:
+                    self.instrument(worker, {'send': 'simulate'})
+        self.instrument(trainer.policy, {'forward': 'policy_forward', 'update': 'update', 'learn': 'learn'})
+        # every epoch ends with log_info_data
+        self._override(trainer.logger, {'log_info_data': _publishing_log_info_data(self, type(trainer.logger))})
+        if self.dump_dir is None and hasattr(trainer.logger, 'writer'):
+            self.dump_dir = os.path.join(trainer.logger.writer.log_dir, 'profile')
+        self._epoch = trainer.epoch
+        self._epoch_start = time.perf_counter()
+        return trainer
+
+    def detach(self) -> None:
+        self._stop_dump()
+        while self._restore:
+            obj, cls = self._restore.pop()
+            obj.__class__ = cls
+        self.trainer = None
+
+    def _start_epoch(self, epoch: int) -> None:
+        # phases timed before the epoch's first collect (e.g. the trainer's initial test) belong to the previous one
+        if self.calls:
+            self.publish(self._epoch)
+        self._epoch = epoch
+        self._epoch_start = time.perf_counter()
+        if epoch == self.dump_epoch:
+            self._start_dump()
+
+    def publish(self, epoch: int) -> Dict[str, Tuple[float, int]]:
+        """
+        Write the phases timed since the last publication to the logger's TensorBoard writer at step epoch, reset
+        them and return them.
+        """
+        elapsed = time.perf_counter() - self._epoch_start
+        phases = {key: (self.seconds[key], self.calls[key]) for key in sorted(self.calls)}
+        self.seconds.clear()
+        self.calls.clear()
+        self._epoch_start = time.perf_counter()
+        self.epochs[epoch] = phases
+        if epoch == self.dump_epoch:
+            self._stop_dump()
+        writer = getattr(self.trainer.logger, 'writer', None) if self.trainer is not None else None
+        if writer is None:
+            return phases
+        for key, (seconds, calls) in phases.items():
+            nested = sum(s for k, (s, _) in phases.items() if k.rpartition('/')[0] == key)
+            writer.add_scalar(f'profile/{key}/seconds', seconds, epoch)
+            writer.add_scalar(f'profile/{key}/self_seconds', seconds - nested, epoch)
+            writer.add_scalar(f'profile/{key}/calls', calls, epoch)
+        outside = elapsed - sum(seconds for key, (seconds, _) in phases.items() if '/' not in key)
+        writer.add_scalar('profile/epoch_seconds', elapsed, epoch)
+        writer.add_scalar('profile/untimed_seconds', outside, epoch)
+        return phases
+
+    def _start_dump(self) -> None:
+        if self.dump_format == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+            return
+        # SIGPROF is delivered to, and can only be handled by, the main thread
+        assert threading.current_thread() is threading.main_thread(), 'Stack sampling requires the main thread'
+        self._samples = collections.Counter()
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.sample_interval, self.sample_interval)
+
+    def _sample(self, signum: int, frame: FrameType | None) -> None:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({code.co_filename}:{frame.f_lineno})')
+            frame = frame.f_back
+        self._samples[';'.join(reversed(stack))] += 1
+
+    def _stop_dump(self) -> None:
+        if self._cprofile is None and self._samples is None:
+            return
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(self.dump_dir, f'epoch_{self._epoch:05d}')
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(f'{path}.prof')
+            self._cprofile = None
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler)
+        with open(f'{path}.folded', 'w') as f:
+            for stack, count in self._samples.items():
+                f.write(f'{stack} {count}\n')
+        self._samples = None
+
+
+def _timed_method(profiler: Profiler, method, phase: str):
+    def timed(self, *args, **kwargs):
+        return profiler._timed(phase, method, self, args, kwargs)
+    timed.__name__ = method.__name__
+    timed.__doc__ = method.__doc__
+    return timed
+
+
+def _publishing_log_info_data(profiler: Profiler, logger_class: type):
+    def log_info_data(self, log_data: dict, step: int) -> None:
+        logger_class.log_info_data(self, log_data, step)
+        profiler.publish(step)
+    return log_info_data
+
+
+def attach_profiler(trainer: BaseTrainer, profiling: Dict[str, Any] | None) -> BaseTrainer:
+    """
+    Attach a Profiler built with the keyword arguments profiling to trainer, unless profiling is None.
+    """
+    if profiling is not None:
+        Profiler(**profiling).attach(trainer)
+    return trainer
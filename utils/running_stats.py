@@ -0,0 +1,50 @@
+import numpy as np
+
+
+class RunningStats:
+    def __init__(self, count: int = 0, mean: float = 0., m2: float = 0.):
+        """
+        Streaming mean and variance: a count, a mean and the sum of squared deviations from it (Welford). Batches are
+        folded in and partial aggregates merged with Chan's pairwise update, so that results computed in chunks or in
+        separate processes combine without keeping the samples.
+        """
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def __repr__(self) -> str:
+        return f'RunningStats(count={self.count}, mean={self.mean}, std={self.std})'
+
+    def update(self, values: np.ndarray) -> 'RunningStats':
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values):
+            mean = values.mean()
+            self.merge(RunningStats(len(values), float(mean), float(np.sum((values - mean) ** 2))))
+        return self
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        count = self.count + other.count
+        if count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self) -> float:
+        # population variance, as np.var
+        return self.m2 / self.count if self.count else np.nan
+
+    @property
+    def sample_variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    @property
+    def standard_error(self) -> float:
+        return float(np.sqrt(self.sample_variance / self.count))